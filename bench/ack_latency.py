@@ -0,0 +1,118 @@
+"""Interaction ack latency with side effects before vs after the ack.
+
+Replays a seeded mix of /host, /rename, /change_runner, /ng and join clicks against the
+fake rate-limited Discord in fake_discord.py and a database commit that takes --commit-ms.
+"before" commits and announces inline and then answers, as those handlers used to. "after"
+answers first and leaves the commit and the announcement to a Jobs task, with the
+announcement going through Outbound. Ack latency is recorded with AckTimings, as the bot does.
+
+    python bench/ack_latency.py --commands 200 --spread 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_discord import FakeChannel, FakeHTTP
+from jobs import AckTimings, Jobs
+from outbound import Outbound
+
+# Which side effects each flow has: (database writes, realm announcements)
+COMMANDS = {
+    "host": (1, 1),
+    "rename": (1, 1),
+    "change_runner": (2, 1),
+    "ng": (1, 0),
+    "join": (1, 0),
+}
+
+
+async def retrying(call):
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            await asyncio.sleep(e.retry_after)
+
+
+class Bench:
+    def __init__(self, commit, channel_count):
+        self.commit = commit
+        self.http = FakeHTTP()
+        self.channels = [FakeChannel(i, self.http) for i in range(channel_count)]
+        self.outbound = Outbound()
+        self.jobs = Jobs()
+        self.timings = AckTimings()
+        self.db_lock = asyncio.Lock()
+
+    async def write(self):
+        async with self.db_lock:  # one connection, one commit at a time
+            await asyncio.sleep(self.commit)
+
+    async def ack(self):
+        await asyncio.sleep(self.http.latency)
+
+    async def before(self, name, channel):
+        started = time.perf_counter()
+        writes, posts = COMMANDS[name]
+        for _ in range(writes):
+            await self.write()
+        for _ in range(posts):
+            await retrying(lambda: channel.send(f"{name} announcement"))
+        await self.ack()
+        self.timings.record(name, started)
+
+    async def after(self, name, channel):
+        started = time.perf_counter()
+        await self.ack()
+        self.timings.record(name, started)
+        self.jobs.spawn(name, self.side_effects(name, channel))
+
+    async def side_effects(self, name, channel):
+        writes, posts = COMMANDS[name]
+        for _ in range(writes):
+            await self.write()
+        for _ in range(posts):
+            await self.outbound.send(channel, f"{name} announcement")
+
+
+async def replay(mode, commands, spread, commit, channel_count, seed):
+    bench = Bench(commit, channel_count)
+    rng = random.Random(seed)
+    schedule = [(rng.uniform(0, spread), rng.choice(list(COMMANDS)), rng.randrange(channel_count)) for _ in range(commands)]
+
+    async def command(at, name, index):
+        await asyncio.sleep(at)
+        await getattr(bench, mode)(name, bench.channels[index])
+
+    await asyncio.gather(*(command(*c) for c in schedule))
+    await bench.jobs.drain()
+    bench.outbound.close()
+    return bench.timings.summary()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--spread", type=float, default=5.0, help="seconds over which the commands arrive")
+    parser.add_argument("--commit-ms", type=float, default=20.0)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("before", "after"):
+        results[mode] = await replay(mode, args.commands, args.spread, args.commit_ms / 1000, args.channels, args.seed)
+    print(f"{'command':>14} {'before p50':>11} {'before p99':>11} {'after p50':>10} {'after p99':>10}")
+    for name in COMMANDS:
+        before, after = results["before"].get(name), results["after"].get(name)
+        if before and after:
+            print(f"{name:>14} {before['p50']:9.0f}ms {before['p99']:9.0f}ms {after['p50']:8.0f}ms {after['p99']:8.0f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
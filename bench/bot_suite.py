@@ -0,0 +1,233 @@
+"""End-to-end command latency and throughput, offline, through the bot's own handlers.
+
+Loads main.oop.py with a scratch runs.db filled by bench/history.py (--rows runs of
+history), points its bot at the fakes in fake_discord.py, and calls the RunsCog commands and
+the Join/Leave button handlers directly with fake contexts and interactions. Phases run one
+after another, each with --concurrency calls in flight:
+
+    host         --runs members host a run (the modal is filled in and submitted)
+    join         --joins clicks on the join buttons of random runs, waitlisting once full
+    runs         /runs as random members, unfiltered and filtered
+    ng           /ng from every runner
+    leave        the Leave button from every attendee
+    top_* and leaderboard, "cold" right after a write and "warm" from the cache
+
+For each, "ack" is the time to the first answer to the interaction, which is what the
+member waits for, and "total" the time until the handler returns. Results go to --json as
+one machine-readable file per commit; --compare prints the change against an earlier one.
+Needs py-cord installed, like the bot.
+
+    python bench/bot_suite.py --rows 1000000 --json results.json
+    python bench/bot_suite.py --rows 1000000 --compare results.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from fake_discord import FakeChannel, FakeContext, FakeGuild, FakeHTTP, FakeInteraction, FakeMember
+from history import FIRST_ID, generate
+from runs import LADDER_LABELS, REALMS, RUN_TYPE_LABELS
+
+LEADERBOARD_COMMANDS = ("top_hosts", "top_monthly_hosts", "top_participants", "top_monthly_participants", "leaderboard")
+
+
+def load_bot(workdir):
+    """Imports main.oop.py with workdir as the current directory, so its runs.db and snapshot land there."""
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        spec = importlib.util.spec_from_file_location("runs_bot", os.path.join(REPO, "main.oop.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    module.run_manager.snapshot.path = os.path.join(workdir, "active_runs.json")  # written later, from any directory
+    return module
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Suite:
+    def __init__(self, bot_module, members, guild, http, concurrency, rng):
+        self.bot = bot_module
+        self.cog = bot_module.bot.get_cog("RunsCog")
+        self.members = members
+        self.guild = guild
+        self.http = http
+        self.concurrency = concurrency
+        self.rng = rng
+        self.samples = defaultdict(list)  # phase -> [(ack, total)]
+        self.elapsed = {}
+
+    async def phase(self, name, calls):
+        """Runs the calls, each a coroutine function taking no arguments, concurrency at a time."""
+        pending = iter(calls)
+
+        async def worker():
+            for call in pending:
+                await call()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        self.elapsed[name] = time.perf_counter() - start
+        # announcements and DMs wait out the channel rate limits; settle them before the next phase
+        await self.bot.jobs.drain()
+        await self.bot.db.flush()
+
+    def command(self, name, phase, member, *args, modal_values=()):
+        async def call():
+            ctx = FakeContext(member, self.guild, self.http, modal_values)
+            await getattr(self.cog, name).callback(self.cog, ctx, *args)
+            self.record(phase, ctx.interaction)
+        return call
+
+    def button(self, handler, phase, member, runner_id):
+        async def call():
+            interaction = FakeInteraction(member, self.guild, self.http, custom_id=f"runs:{phase}:{runner_id}")
+            await handler(interaction, runner_id)
+            self.record(phase, interaction)
+        return call
+
+    def record(self, phase, interaction):
+        done = time.perf_counter()
+        self.samples[phase].append(((interaction.acked_at or done) - interaction.started, done - interaction.started))
+
+    async def run(self, runs, joins, views):
+        manager = self.bot.run_manager
+        hosts = self.members[:runs]
+        players = self.members[runs:]
+        await self.phase("host", [self.command("host", "host", member, self.rng.choice(LADDER_LABELS), self.rng.choice(RUN_TYPE_LABELS),
+                                               modal_values=(f"game-{member.id % 1000}", "pw")) for member in hosts])
+        runner_ids = list(manager.active_runs)
+        await self.phase("join", [self.button(self.bot.join_run, "join", self.rng.choice(players), self.rng.choice(runner_ids))
+                                  for _ in range(joins)])
+        await self.phase("runs", [self.command("runs", "runs", self.rng.choice(self.members),
+                                               *self.rng.choice([(None, None), (self.rng.choice(LADDER_LABELS), None),
+                                                                 (None, self.rng.choice(RUN_TYPE_LABELS))])) for _ in range(views)])
+        await self.phase("ng", [self.command("ng", "ng", self.guild.members[runner_id]) for runner_id in manager.active_runs])
+        for name in LEADERBOARD_COMMANDS:
+            await self.phase(f"{name} (cold)", [self.cold(name, self.rng.choice(self.members)) for _ in range(max(1, views // 10))])
+            await self.phase(f"{name} (warm)", [self.command(name, f"{name} (warm)", self.rng.choice(self.members)) for _ in range(views)])
+        await self.phase("leave", [self.button(self.bot.leave_run, "leave", self.guild.members[attendee_id], run.runner_id)
+                                   for run in list(manager.active_runs.values()) for attendee_id in run.attendees])
+
+    def cold(self, name, member):
+        command = self.command(name, f"{name} (cold)", member)
+
+        async def call():
+            self.bot.leaderboard_cache.version = None  # as after any run or attendee write
+            await command()
+        return call
+
+    def results(self) -> dict:
+        results = {}
+        for phase, samples in self.samples.items():
+            acks = sorted(ack for ack, _ in samples)
+            totals = sorted(total for _, total in samples)
+            results[phase] = {
+                "count": len(samples),
+                "ack_p50_ms": percentile(acks, 0.5) * 1000,
+                "ack_p99_ms": percentile(acks, 0.99) * 1000,
+                "total_p50_ms": percentile(totals, 0.5) * 1000,
+                "total_p99_ms": percentile(totals, 0.99) * 1000,
+                "ops_per_s": len(samples) / self.elapsed[phase],
+            }
+        return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def bench(args, workdir):
+    bot_module = load_bot(workdir)
+    http = FakeHTTP(latency=args.latency_ms / 1000)
+    rng = random.Random(args.seed)
+    # Members who show up in the history, so their leaderboard rows and names are real ones
+    members = [FakeMember(FIRST_ID + n, f"player{n}", http) for n in range(args.runs + args.players)]
+    guild = FakeGuild(bot_module.guild_ids[0], members)
+    channels = {realm: FakeChannel(realm, http) for realm in REALMS}
+    bot = bot_module.bot
+    bot.get_channel = channels.get
+    bot.get_guild = lambda guild_id: guild
+    bot.get_user = guild.get_member
+
+    suite = Suite(bot_module, members, guild, http, args.concurrency, rng)
+    try:
+        await suite.run(args.runs, args.joins, args.views)
+    finally:
+        bot_module.run_manager.expiry.close()
+        bot_module.run_manager.queue.close()
+        for task in [bot_module.run_manager.snapshot.task, *bot_module.run_manager.board.tasks.values()]:
+            if task:
+                task.cancel()
+        bot_module.outbound.close()
+        bot_module.db.close()
+    return suite.results()
+
+
+def report(results, baseline=None):
+    print(f"{'phase':>32} {'count':>6} {'ack p50':>9} {'ack p99':>9} {'total p99':>10} {'ops/s':>9}" + ("   vs baseline p99 / ops/s" if baseline else ""))
+    for phase, r in results.items():
+        line = f"{phase:>32} {r['count']:6d} {r['ack_p50_ms']:7.2f}ms {r['ack_p99_ms']:7.2f}ms {r['total_p99_ms']:8.2f}ms {r['ops_per_s']:9.0f}"
+        old = (baseline or {}).get(phase)
+        if old:
+            line += f"   {(r['ack_p99_ms'] / old['ack_p99_ms'] - 1) * 100:+6.1f}% / {(r['ops_per_s'] / old['ops_per_s'] - 1) * 100:+6.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="runs of synthetic history")
+    parser.add_argument("--db", default=None, help="a runs.db from bench/history.py to copy instead of generating one")
+    parser.add_argument("--runs", type=int, default=50, help="live runs to host")
+    parser.add_argument("--players", type=int, default=500, help="members who join, besides the hosts")
+    parser.add_argument("--joins", type=int, default=400)
+    parser.add_argument("--views", type=int, default=200, help="/runs and leaderboard calls per phase")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Discord round trip")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="write the results here")
+    parser.add_argument("--compare", default=None, help="results file from an earlier run to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "runs.db")
+        if args.db:
+            shutil.copy(args.db, path)
+        else:
+            generate(path, args.rows, args.seed)
+        results = asyncio.run(bench(args, workdir))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    report(results, baseline)
+    if args.json:
+        meta = {"commit": git_commit(), "time": int(time.time()), "python": platform.python_version(),
+                **{key: value for key, value in vars(args).items() if key not in ("json", "compare")}}
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
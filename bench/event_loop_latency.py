@@ -0,0 +1,99 @@
+"""Event-loop latency while many players click "Join Run" at once.
+
+Compares the old pattern (sqlite3 calls plus a commit per write, made directly on the
+event loop behind an asyncio.Lock) with the Database writer thread and its group commit. A heartbeat task wakes every
+millisecond and records how late it was; that lateness is what every other button click
+and the gateway heartbeat would see.
+
+    python bench/event_loop_latency.py --joins 500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+
+class BlockingDatabase(Database):
+    """Same SQL as Database, but run inline on the event loop like the bot used to."""
+
+    def __init__(self, db_name="runs.db"):
+        self.db_name = db_name
+        self.adopted_ids = set()
+        self.lock = asyncio.Lock()
+        self._connect()
+
+    async def _run(self, fn, *args):
+        async with self.lock:
+            return fn(*args)
+
+    def _write(self, fn, *args):
+        self.cursor.execute("BEGIN")
+        fn(*args)
+        self.cursor.execute("COMMIT")
+
+    async def flush(self):
+        pass
+
+    def close(self):
+        self.conn.close()
+
+
+async def heartbeat(samples, stop, interval=0.001):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - expected)
+
+
+async def run_scenario(db, runners, joins):
+    now = int(time.time())
+    for runner_id in range(1, runners + 1):
+        await db.insert_run(runner_id, f"runner{runner_id}", "Baal", "Ladder", f"game{runner_id}", [], now)
+    await db.flush()
+    samples = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(samples, stop))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        db.add_attendee(1 + i % runners, 10_000 + i, f"player{i}") for i in range(joins)
+    ))
+    await db.flush()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    return elapsed, samples
+
+
+def summarize(name, elapsed, samples, joins):
+    lag = sorted(s * 1000 for s in samples) or [0.0]
+    p99 = lag[min(len(lag) - 1, int(len(lag) * 0.99))]
+    print(f"{name:>9}: {joins / elapsed:8.0f} joins/s  loop lag p50={statistics.median(lag):6.2f}ms "
+          f"p99={p99:6.2f}ms max={lag[-1]:6.2f}ms  heartbeats={len(samples)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--joins", type=int, default=500)
+    parser.add_argument("--runners", type=int, default=50)
+    parser.add_argument("--dir", default=None, help="directory for the scratch databases (defaults to a temp dir)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for name, cls in (("before", BlockingDatabase), ("after", Database)):
+            db = cls(os.path.join(tmp, f"{name}.db"))
+            elapsed, samples = await run_scenario(db, args.runners, args.joins)
+            db.close()
+            summarize(name, elapsed, samples, args.joins)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""Cost of keeping a 2-hour expiry timer per live run.
+
+Compares the old pattern, one sleeping task per run that /ng cancels and recreates, with
+ExpiryScheduler, which keeps every deadline in one heap behind a single task. Each round
+schedules --runs timers and then reschedules them --resets times, as /ng and joins do.
+
+    python bench/expiry_timers.py --runs 5000 --resets 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import ExpiryScheduler
+
+TTL = 2 * 60 * 60
+
+
+async def expire(key):
+    pass
+
+
+async def sleep_then_expire(key):
+    await asyncio.sleep(TTL)
+    await expire(key)
+
+
+async def per_run_tasks(runs, resets):
+    timeouts = {}
+    for key in range(runs):
+        timeouts[key] = asyncio.create_task(sleep_then_expire(key))
+    for _ in range(resets):
+        for key in range(runs):
+            timeouts[key].cancel()
+            timeouts[key] = asyncio.create_task(sleep_then_expire(key))
+    await asyncio.sleep(0)  # let the cancelled tasks unwind, as the event loop would
+    pending = len(asyncio.all_tasks())
+    for task in timeouts.values():
+        task.cancel()
+    await asyncio.sleep(0)
+    return pending
+
+
+async def scheduler(runs, resets):
+    timers = ExpiryScheduler(expire, ttl=TTL)
+    for key in range(runs):
+        timers.touch(key)
+    for _ in range(resets):
+        for key in range(runs):
+            timers.touch(key)
+    await asyncio.sleep(0)
+    pending = len(asyncio.all_tasks())
+    timers.close()
+    await asyncio.sleep(0)
+    return pending
+
+
+async def measure(name, fn, runs, resets):
+    baseline = len(asyncio.all_tasks())
+    tracemalloc.start()
+    start = time.perf_counter()
+    pending = await fn(runs, resets) - baseline
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    ops = runs * (resets + 1)
+    print(f"{name:>9}: {elapsed * 1e6 / ops:6.2f}us per (re)schedule  pending tasks={pending:6d}  peak={peak / 1024:8.0f}KiB")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5000)
+    parser.add_argument("--resets", type=int, default=5)
+    args = parser.parse_args()
+
+    await measure("before", per_run_tasks, args.runs, args.resets)
+    await asyncio.sleep(0.1)  # drain the cancelled sleepers before the second measurement
+    await measure("after", scheduler, args.runs, args.resets)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,202 @@
+"""A local stand-in for Discord's HTTP API, for exercising outbound.py offline.
+
+FakeHTTP enforces Discord's per-channel message limit (5 per 5s by default) and answers
+over-limit calls with RateLimited after the usual round trip, the way a 429 would come back.
+FakeChannel and FakeMessage expose the send/edit/pin/delete calls the bot makes.
+
+FakeMember, FakeGuild, FakeInteraction and FakeContext stand in for what a slash command or
+button handler is given, so bench/bot_suite.py can call the bot's handlers directly. Every
+answer to an interaction takes one round trip and stamps acked_at with the first one.
+"""
+import asyncio
+import time
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after, is_global=False):
+        super().__init__(f"429 Too Many Requests, retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+        self.is_global = is_global
+
+
+class FakeHTTP:
+    def __init__(self, latency=0.05, channel_rate=(5, 5.0)):
+        self.latency = latency
+        self.rate, self.per = channel_rate
+        self.windows = {}  # channel ID -> (window start, calls in it)
+        self.calls = 0
+        self.limited = 0
+
+    async def request(self, channel_id):
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        start, count = self.windows.get(channel_id, (now, 0))
+        if now - start >= self.per:
+            start, count = now, 0
+        if count >= self.rate:
+            self.limited += 1
+            raise RateLimited(start + self.per - now)
+        self.windows[channel_id] = (start, count + 1)
+        self.calls += 1
+
+
+class FakeMessage:
+    _ids = 0
+
+    def __init__(self, channel, content):
+        FakeMessage._ids += 1
+        self.id = FakeMessage._ids
+        self.channel = channel
+        self.content = content
+        self.edits = 0
+        self.pinned = False
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.http.request(self.channel.id)
+        if content is not None:
+            self.content = content
+        self.edits += 1
+        return self
+
+    async def pin(self):
+        await self.channel.http.request(self.channel.id)
+        self.pinned = True
+
+    async def delete(self):
+        await self.channel.http.request(self.channel.id)
+
+
+class FakeChannel:
+    def __init__(self, id, http):
+        self.id = id
+        self.http = http
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        await self.http.request(self.id)
+        message = FakeMessage(self, content)
+        self.messages.append(message)
+        return message
+
+    async def pins(self):
+        return [message for message in self.messages if message.pinned]
+
+
+class FakeMember:
+    def __init__(self, id, name, http):
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{id}>"
+        self.http = http
+        self.dms = []
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.http.latency)
+        self.dms.append(content)
+
+
+class FakeGuild:
+    def __init__(self, id, members=()):
+        self.id = id
+        self.members = {member.id: member for member in members}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def _answer(self, kind, content, kwargs):
+        if self.done:
+            raise RuntimeError("This interaction has already been responded to before")
+        self.done = True
+        await self.interaction._answer(kind, content, kwargs)
+
+    async def send_message(self, content=None, **kwargs):
+        await self._answer("message", content, kwargs)
+
+    async def edit_message(self, content=None, **kwargs):
+        await self._answer("edit", content, kwargs)
+
+    async def send_modal(self, modal):
+        await self._answer("modal", None, {"modal": modal})
+        await self.interaction.submit_modal(modal)
+
+    async def defer(self, **kwargs):
+        await self._answer("defer", None, kwargs)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self.interaction._answer("followup", content, kwargs)
+
+
+class FakeInteraction:
+    """A button click or slash command invocation by user.
+
+    modal_values fills in any modal the handler opens, in the order of its inputs, as if
+    the member typed them and pressed submit.
+    """
+
+    def __init__(self, user, guild, http, custom_id=None, modal_values=()):
+        self.user = user
+        self.guild = guild
+        self.http = http
+        self.data = {"custom_id": custom_id} if custom_id else {}
+        self.modal_values = modal_values
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.started = time.perf_counter()
+        self.acked_at = None
+        self.answers = []  # (kind, content, kwargs)
+
+    async def _answer(self, kind, content, kwargs):
+        await asyncio.sleep(self.http.latency)
+        if self.acked_at is None:
+            self.acked_at = time.perf_counter()
+        self.answers.append((kind, content, kwargs))
+
+    async def submit_modal(self, modal):
+        for child, value in zip(modal.children, self.modal_values):
+            child.value = value
+        await modal.callback(FakeInteraction(self.user, self.guild, self.http))
+
+
+class FakeContext:
+    """ApplicationContext for a slash command: respond() answers the interaction once, then follows up."""
+
+    def __init__(self, author, guild, http, modal_values=()):
+        self.author = author
+        self.user = author
+        self.guild = guild
+        self.interaction = FakeInteraction(author, guild, http, modal_values=modal_values)
+        self.response = self.interaction.response
+        self.followup = self.interaction.followup
+
+    async def respond(self, content=None, **kwargs):
+        if self.response.is_done():
+            await self.followup.send(content, **kwargs)
+        else:
+            await self.response.send_message(content, **kwargs)
+
+    async def send_modal(self, modal):
+        await self.response.send_modal(modal)
+
+    async def defer(self, **kwargs):
+        await self.response.defer(**kwargs)
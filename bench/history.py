@@ -0,0 +1,96 @@
+"""Fills a runs.db with synthetic run history for the benchmarks.
+
+Hosting and joining both follow a power law, as on a real server: a few regulars host and
+join most runs, and a long tail shows up a handful of times. Each run gets 0-7 attendees,
+more often close to full than empty, and a start time spread over the last --days days.
+The leaderboard counters are then rebuilt from the rows, so the database looks like one the
+bot has been writing to all along.
+
+    python bench/history.py runs.db --rows 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import migrate, rebuild_stats
+from runs import LADDER_LABELS, MAX_ATTENDEES, RUN_TYPE_LABELS
+
+FIRST_ID = 100_000_000_000_000_000  # member IDs look like Discord snowflakes
+ATTENDEE_WEIGHTS = (2, 2, 3, 4, 5, 6, 8, 10)  # relative odds of 0..MAX_ATTENDEES attendees
+CHUNK = 50_000
+
+
+def zipf_cum_weights(count, exponent):
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def generate(path, rows, seed=1, hosts=None, players=None, days=365, exponent=0.8):
+    """Appends rows synthetic runs, with their attendees, to the database at path.
+
+    hosts and players default to pools that grow with rows, so bigger histories also
+    have more distinct members. Returns the number of attendee rows written.
+    """
+    rng = random.Random(seed)
+    hosts = hosts or max(50, rows // 200)
+    players = players or max(500, rows // 20)
+    member_ids = [FIRST_ID + n for n in range(max(hosts, players))]
+    rng.shuffle(member_ids)  # hosts are mostly players too, but not the same top ranks
+    host_ids = member_ids[:hosts]
+    player_ids = sorted(member_ids[:players])
+    host_weights = zipf_cum_weights(hosts, exponent)
+    player_weights = zipf_cum_weights(players, exponent)
+    attendee_counts = list(range(MAX_ATTENDEES + 1))
+    now = int(time.time())
+
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    run_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM runs").fetchone()[0]
+    attendee_rows = 0
+    for start in range(0, rows, CHUNK):
+        size = min(CHUNK, rows - start)
+        runners = rng.choices(host_ids, cum_weights=host_weights, k=size)
+        runs = []
+        attendees = []
+        for runner_id in runners:
+            run_id += 1
+            start_time = now - int(rng.random() * days * 86400)
+            runs.append((run_id, runner_id, f"player{runner_id - FIRST_ID}", rng.choice(RUN_TYPE_LABELS),
+                         rng.choice(LADDER_LABELS), f"game-{run_id}", start_time))
+            count = rng.choices(attendee_counts, weights=ATTENDEE_WEIGHTS)[0]
+            for user_id in set(rng.choices(player_ids, cum_weights=player_weights, k=count)):
+                if user_id != runner_id:
+                    attendees.append((run_id, user_id, f"player{user_id - FIRST_ID}", start_time))
+        cursor.executemany("INSERT INTO runs (id, runner_id, runner_name, type, ladder, run_name, start_time) VALUES (?, ?, ?, ?, ?, ?, ?)", runs)
+        cursor.executemany("INSERT INTO run_attendees (run_id, user_id, user_name, joined_at) VALUES (?, ?, ?, ?)", attendees)
+        attendee_rows += len(attendees)
+    rebuild_stats(cursor)
+    cursor.execute("COMMIT")
+    conn.close()
+    return attendee_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=100_000, help="runs to add; 10k to 5M is the useful range")
+    parser.add_argument("--hosts", type=int, default=None)
+    parser.add_argument("--players", type=int, default=None)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    attendee_rows = generate(args.path, args.rows, args.seed, args.hosts, args.players, args.days)
+    print(f"{args.rows} runs and {attendee_rows} attendee rows in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Join, kick and rename latency as the runs table grows.
+
+Fills a scratch runs.db with synthetic history at each size, then times the statements a
+live run issues. "by id" is what Database does now (address the run's row by primary
+key); "latest by runner" is the old WHERE id = (SELECT id FROM runs WHERE runner_id = ?
+ORDER BY id DESC LIMIT 1) form, kept here for comparison. The live run is inserted before
+the synthetic history, which is the worst case for the old form: it has to walk back past
+every newer row. The by-id columns should stay flat from 10k to 1M rows.
+
+    python bench/history_scaling.py --sizes 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+LEGACY_RENAME = """
+    UPDATE runs SET run_name = ?
+    WHERE id = (SELECT id FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1)
+"""
+
+
+def fill_history(db, rows, hosts=2000):
+    db.cursor.execute("BEGIN")
+    db.cursor.execute("""
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO runs (runner_id, runner_name, type, ladder, run_name, start_time)
+        SELECT i % ?, 'host' || (i % ?), 'Baal', 'Ladder', 'game-' || i, CAST(strftime('%s', 'now') AS INTEGER) - (i % 365) * 86400
+        FROM n
+    """, (rows, hosts, hosts))
+    db.cursor.execute("COMMIT")
+
+
+def time_ops(db, run_id, runner_id, ops):
+    timings = {"join": [], "kick": [], "rename": [], "rename (latest by runner)": []}
+    db.cursor.execute("BEGIN")
+    now = int(time.time())
+    for i in range(ops):
+        user_id = 1_000_000 + i
+        start = time.perf_counter()
+        db._add_attendee(run_id, user_id, f"player{i}", now)
+        timings["join"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        db._remove_attendee(run_id, user_id)
+        timings["kick"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        db._update_run_name(run_id, f"bench-{i}")
+        timings["rename"].append(time.perf_counter() - start)
+    # Timed separately: the full scans would otherwise evict the pages the other statements use.
+    for i in range(ops):
+        start = time.perf_counter()
+        db.cursor.execute(LEGACY_RENAME, (f"bench-{i}", runner_id))
+        timings["rename (latest by runner)"].append(time.perf_counter() - start)
+    db.cursor.execute("ROLLBACK")
+    return timings
+
+
+async def measure(path, rows, ops):
+    db = Database(path)
+    runner_id = 999_999_999
+    run_id = await db.insert_run(runner_id, "bench", "Baal", "Ladder", "bench", [], int(time.time()))
+    await db.flush()
+    await db._run("fill_history", fill_history, db, rows)
+    timings = await db._run("time_ops", time_ops, db, run_id, runner_id, ops)
+    db.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--ops", type=int, default=200)
+    parser.add_argument("--dir", default=None, help="directory for the scratch databases (defaults to a temp dir)")
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} " + " ".join(f"{name:>27}" for name in ("join", "kick", "rename", "rename (latest by runner)")))
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for rows in args.sizes:
+            timings = asyncio.run(measure(os.path.join(tmp, f"history-{rows}.db"), rows, args.ops))
+            cells = [f"median {statistics.median(t) * 1e6:8.1f}us" for t in timings.values()]
+            print(f"{rows:>9} " + " ".join(f"{cell:>27}" for cell in cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Seeded replay of the join-button rush after a NEW RUN ALERT, against RunManager and Database.
+
+--runs alerts go out over the replay. After each, --clicks players press the run's join
+button within --spread ticks, as join_run does: join_or_wait under the run's lock, the
+ephemeral reply through Outbound at REPLY priority, then the attendee write. Over-capacity
+clicks fill the waitlist and the rest are refused. Some of the seated then leave and some
+get kicked by their runner, which promotes waiting players through on_seated as
+notify_seated does. The alerts go through Outbound to a fake rate-limited channel per realm;
+the replay doesn't wait for the ones still queued when it ends.
+
+Events are released on ticks of the event loop instead of wall-clock time and every lock
+holds for one loop turn, so a seed always gives the same sequence of lock acquisitions and
+the same final state; the digest printed at the end is a fingerprint of it to compare runs
+with. Wall-clock lock waits and throughput are reported alongside.
+
+Checked at the end, after the database has caught up: the RunManager invariants from
+run_stress.py (no run over MAX_ATTENDEES, no player in two runs, indexes consistent), every
+live run's run_attendees rows matching its attendees, and the participation counters
+matching run_attendees. Any violation exits with status 1.
+
+    python bench/join_burst.py --runs 50 --clicks 60 --seed 7
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from fake_discord import FakeChannel, FakeHTTP
+from jobs import Jobs
+from outbound import INTERACTION, REPLY, Outbound
+from run_stress import HeldLock, HeldLocks, violations
+from runs import REALMS, Ladder, Run, RunManager, RunType
+
+FIRST_ID = 10_000
+
+
+class Burst:
+    def __init__(self, manager, db, outbound, channels, jobs, counts):
+        self.manager = manager
+        self.db = db
+        self.outbound = outbound
+        self.channels = channels
+        self.jobs = jobs
+        self.alerts = Jobs()
+        self.counts = counts
+        self.latencies = []
+        manager.on_seated = lambda run, ids: jobs.spawn("queue", self.seated(run, ids))
+
+    async def reply(self):
+        await self.outbound.submit(INTERACTION, lambda: asyncio.sleep(0), REPLY)
+
+    async def host(self, runner_id, ladder, run_type):
+        run = Run(runner_id, ladder, run_type, f"game-{runner_id}", "pw")
+        try:
+            await self.manager.add_run(run)
+        except ValueError:
+            self.counts["host refused"] += 1
+            return
+        run.db_id = await self.db.insert_run(runner_id, f"player{runner_id}", run_type.label, ladder.label, run.run_name, [], run.start_time)
+        self.counts["host"] += 1
+        self.alerts.spawn("host", self.announce(run, f"**`NEW RUN ALERT!`**\nJoin {run_type.label} runs on {ladder.label}!"))
+
+    async def announce(self, run, content):
+        await self.outbound.send(self.channels[run.get_realm()], content)
+
+    async def join(self, runner_id, player_id):
+        started = time.perf_counter()
+        run = self.manager.active_runs.get(runner_id)
+        place = None if run is None else await self.manager.join_or_wait(runner_id, player_id)
+        if place == 0:
+            await self.db.add_attendee(run.db_id, player_id, f"player{player_id}")
+        await self.reply()
+        self.latencies.append(time.perf_counter() - started)
+        self.counts["join refused" if place is None else "waitlisted" if place else "join"] += 1
+
+    async def leave(self, player_id, kicked):
+        run = self.manager.get_run(player_id)
+        if run is None or run.runner_id == player_id:
+            return
+        if await self.manager.remove_attendee(run.runner_id, player_id):
+            await self.db.remove_attendee(run.db_id, player_id)
+            self.counts["kick" if kicked else "leave"] += 1
+
+    async def seated(self, run, player_ids):
+        for player_id in player_ids:
+            await self.db.add_attendee(run.db_id, player_id, f"player{player_id}")
+        self.counts["promoted"] += len(player_ids)
+
+
+def schedule(rng, runs, clicks, spread, players):
+    """(tick, kind, args) events: for each run an alert, its join rush, then leaves and kicks."""
+    events = []
+    pool = list(range(FIRST_ID + runs, FIRST_ID + runs + players))
+    for n in range(runs):
+        runner_id = FIRST_ID + n
+        alert = rng.randrange(runs * spread // 4 + 1)
+        events.append((alert, "host", (runner_id, rng.choice(list(Ladder)), rng.choice(list(RunType)))))
+        for player_id in rng.sample(pool, min(clicks, len(pool))):
+            events.append((alert + 1 + rng.randrange(spread), "join", (runner_id, player_id)))
+        for player_id in rng.sample(pool, min(clicks // 4, len(pool))):
+            events.append((alert + 1 + rng.randrange(2 * spread), "leave", (player_id, rng.random() < 0.5)))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+async def replay(events, burst, yields_per_tick):
+    tasks = []
+    index = 0
+    tick = 0
+    while index < len(events):
+        while index < len(events) and events[index][0] == tick:
+            _, kind, args = events[index]
+            if kind == "host":
+                tasks.append(asyncio.create_task(burst.host(*args)))
+            elif kind == "join":
+                tasks.append(asyncio.create_task(burst.join(*args)))
+            else:
+                tasks.append(asyncio.create_task(burst.leave(*args)))
+            index += 1
+        for _ in range(yields_per_tick):
+            await asyncio.sleep(0)
+        tick += 1
+    await asyncio.gather(*tasks)
+
+
+def database_violations(db, manager) -> list[str]:
+    problems = []
+    for run in manager.active_runs.values():
+        rows = {user_id for user_id, in db.cursor.execute("SELECT user_id FROM run_attendees WHERE run_id = ?", (run.db_id,))}
+        if rows != set(run.attendees):
+            problems.append(f"run {run.runner_id}: runs.db has {len(rows)} attendees, RunManager {len(run.attendees)}")
+    attendees, participated = db.cursor.execute(
+        "SELECT (SELECT COUNT(*) FROM run_attendees), (SELECT COALESCE(SUM(participated), 0) FROM user_stats)").fetchone()
+    if attendees != participated:
+        problems.append(f"run_attendees has {attendees} rows, participation counters add up to {participated}")
+    return problems
+
+
+def digest(manager) -> str:
+    state = sorted((run.runner_id, tuple(run.attendees), tuple(manager.waitlists.get(run.runner_id, ()))) for run in manager.active_runs.values())
+    return hashlib.sha256(repr(state).encode()).hexdigest()[:16]
+
+
+async def simulate(args, tmp):
+    HeldLock.hold = 0
+    HeldLock.waits = []
+    manager = RunManager(os.path.join(tmp, "active_runs.json"))
+    manager.registry_lock = HeldLock()
+    manager.locks = HeldLocks()
+    db = Database(os.path.join(tmp, "runs.db"))
+    outbound = Outbound()
+    jobs = Jobs()
+    counts = Counter()
+    http = FakeHTTP(latency=args.latency_ms / 1000)
+    burst = Burst(manager, db, outbound, {realm: FakeChannel(realm, http) for realm in REALMS}, jobs, counts)
+    events = schedule(random.Random(args.seed), args.runs, args.clicks, args.spread, args.players)
+
+    start = time.perf_counter()
+    await replay(events, burst, args.yields)
+    elapsed = time.perf_counter() - start
+    await jobs.drain()
+    await db.flush()
+    problems = violations(manager) + await db._run("violations", database_violations, db, manager)
+    counts["alerts posted"] = http.calls
+    result = (len(events), elapsed, counts, sorted(HeldLock.waits), sorted(burst.latencies), problems, digest(manager))
+    for task in burst.alerts.tasks:
+        task.cancel()
+    manager.expiry.close()
+    manager.queue.close()
+    if manager.snapshot.task:
+        manager.snapshot.task.cancel()
+    outbound.close()
+    db.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=50, help="NEW RUN ALERTs")
+    parser.add_argument("--clicks", type=int, default=60, help="join clicks per alert")
+    parser.add_argument("--spread", type=int, default=20, help="ticks the clicks on one alert arrive over")
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--yields", type=int, default=3, help="event loop turns per tick")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="fake channel round trip for the alerts")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        events, elapsed, counts, waits, latencies, problems, state = asyncio.run(simulate(args, tmp))
+    print(f"{events} events in {elapsed:.2f}s ({events / elapsed:.0f}/s)")
+    print("  " + ", ".join(f"{key} {value}" for key, value in sorted(counts.items())))
+    print(f"  lock wait p50={statistics.median(waits) * 1000:.2f}ms p99={waits[int(len(waits) * 0.99)] * 1000:.2f}ms max={waits[-1] * 1000:.2f}ms")
+    print(f"  join ack p50={statistics.median(latencies) * 1000:.2f}ms p99={latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+    for problem in problems[:10]:
+        print(f"  VIOLATION: {problem}")
+    print(f"  invariants {'broken' if problems else 'held'}, final state {state}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Cost of queueing, matching and cancelling with --waiting players in the matchmaking queue.
+
+Each player waits for 1-3 random run types on a random ladder. "match" pops the next player
+for a random kind of run, as a freed seat does; "cancel" takes a random player out, as
+/unqueue and joining elsewhere do. Times are per operation.
+
+    python bench/match_queue.py --waiting 100 1000 10000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matchmaking import MatchQueue
+from runs import Ladder, RunType
+
+
+async def measure(waiting, seed):
+    rng = random.Random(seed)
+    queue = MatchQueue()
+    players = [(player_id, rng.choice(list(Ladder)), rng.sample(list(RunType), rng.randint(1, 3))) for player_id in range(waiting)]
+    start = time.perf_counter()
+    for player in players:
+        queue.add(*player)
+    add = (time.perf_counter() - start) / waiting
+
+    kinds = [(rng.choice(list(Ladder)), rng.choice(list(RunType))) for _ in range(waiting // 4)]
+    start = time.perf_counter()
+    matched = sum(queue.pop(*kind) is not None for kind in kinds)
+    match = (time.perf_counter() - start) / len(kinds)
+
+    left = list(queue.entries)
+    rng.shuffle(left)
+    start = time.perf_counter()
+    for player_id in left:
+        queue.cancel(player_id)
+    cancel = (time.perf_counter() - start) / max(len(left), 1)
+    queue.close()
+    return add, match, matched, cancel
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--waiting", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'waiting':>8} {'add':>9} {'match':>9} {'cancel':>9}")
+    for waiting in args.waiting:
+        add, match, matched, cancel = await measure(waiting, args.seed)
+        print(f"{waiting:8d} {add * 1e6:7.2f}us {match * 1e6:7.2f}us {cancel * 1e6:7.2f}us   ({matched} matched)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""Finding an open run of a given kind: scanning every run vs the OpenRuns index.
+
+Fills --runs runs with a seeded 0-7 attendees each, spread over all ladder/type pairs, then
+times --lookups searches for the fullest open run of a random kind. "scan" walks the runs
+like /runs did; "index" asks OpenRuns.best().
+
+    python bench/open_slots.py --runs 1000 10000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from runs import MAX_ATTENDEES, Ladder, OpenRuns, Run, RunType
+
+
+def scan(runs, ladder, run_type):
+    best = None
+    for run in runs.values():
+        if run.ladder == ladder and run.type == run_type and not run.is_full:
+            if best is None or len(run.attendees) > len(best.attendees):
+                best = run
+    return best.runner_id if best else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'runs':>6} {'scan':>12} {'index':>12}")
+    for count in args.runs:
+        rng = random.Random(args.seed)
+        runs = {}
+        index = OpenRuns()
+        for runner_id in range(1, count + 1):
+            attendees = range(runner_id * 10, runner_id * 10 + rng.randint(0, MAX_ATTENDEES))
+            run = Run(runner_id, rng.choice(list(Ladder)), rng.choice(list(RunType)), "bench", "", attendees)
+            runs[runner_id] = run
+            index.update(run)
+        kinds = [(rng.choice(list(Ladder)), rng.choice(list(RunType))) for _ in range(args.lookups)]
+        timings, fills = [], []
+        for find in (lambda ladder, run_type: scan(runs, ladder, run_type), index.best):
+            start = time.perf_counter()
+            found = [find(ladder, run_type) for ladder, run_type in kinds]
+            timings.append((time.perf_counter() - start) / args.lookups)
+            fills.append([len(runs[runner_id].attendees) if runner_id else None for runner_id in found])
+        assert fills[0] == fills[1], "the index picked a run with a different fill level"
+        print(f"{count:6d} {timings[0] * 1e6:10.1f}us {timings[1] * 1e6:10.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""A burst of "Join Run" clicks against a fake, rate-limited Discord.
+
+Each click announces the join in the realm channel, refreshes that channel's board message
+and answers the member with the game info. "before" awaits each call inline, in that order,
+as /end, /rename and /change_runner did, and like py-cord sleeps through any 429 inside the
+handler. "after" hands the calls to Outbound and returns straight away. Reply latency is
+what the member waits for their game info; Discord drops interactions that haven't been
+answered within 3 seconds.
+
+    python bench/outbound_burst.py --clicks 60 --channels 4
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_discord import FakeChannel, FakeHTTP
+from outbound import ANNOUNCE, BOARD, REPLY, Outbound
+
+
+async def reply(http):
+    await asyncio.sleep(http.latency)  # interaction callbacks aren't under the channel limit
+
+
+async def retrying(call):
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def inline_click(http, channel, board, n):
+    start = time.perf_counter()
+    await retrying(lambda: channel.send(f"player {n} joined"))
+    await retrying(lambda: board.edit(content=f"board after {n}"))
+    await reply(http)
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed
+
+
+async def queued_click(outbound, http, channel, board, n):
+    start = time.perf_counter()
+    replied = outbound.submit(None, lambda: reply(http), REPLY)
+    outbound.send(channel, f"player {n} joined", ANNOUNCE)
+    outbound.edit(board, BOARD, content=f"board after {n}")
+    handled = time.perf_counter() - start
+    await replied
+    return time.perf_counter() - start, handled
+
+
+async def burst(mode, clicks, channel_count, spread, seed):
+    http = FakeHTTP()
+    channels = [FakeChannel(i, http) for i in range(channel_count)]
+    boards = [await channel.send("board") for channel in channels]
+    http.windows.clear()
+    outbound = Outbound()
+    rng = random.Random(seed)
+    start = time.perf_counter()
+
+    async def click(n):
+        await asyncio.sleep(rng.uniform(0, spread))
+        index = rng.randrange(channel_count)
+        if mode == "before":
+            return await inline_click(http, channels[index], boards[index], n)
+        return await queued_click(outbound, http, channels[index], boards[index], n)
+
+    results = await asyncio.gather(*(click(n) for n in range(clicks)))
+    while outbound.task and (outbound.calls or any(outbound.queues.values())):
+        await asyncio.sleep(0.01)
+    drained = time.perf_counter() - start
+    stats = outbound.stats()
+    outbound.close()
+    return results, drained, http, stats
+
+
+def report(mode, results, drained, http, stats):
+    replies = sorted(r[0] for r in results)
+    handlers = sorted(r[1] for r in results)
+    late = sum(1 for r in replies if r > 3)
+    print(f"{mode:>6}: reply p50={statistics.median(replies) * 1000:7.0f}ms max={replies[-1] * 1000:7.0f}ms  "
+          f"handler max={handlers[-1] * 1000:7.0f}ms  replies over 3s={late:3d}  "
+          f"API calls={http.calls:4d} 429s={http.limited:3d}  all sent after {drained:5.1f}s")
+    if mode == "after":
+        print(f"        merged={stats['merged']} dropped={stats['dropped']} waits(ms)="
+              + ", ".join(f"{name} p95 {w['p95']:.0f}" for name, w in stats["waits"].items()))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clicks", type=int, default=60)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--spread", type=float, default=2.0, help="seconds over which the clicks arrive")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for mode in ("before", "after"):
+        report(mode, *await burst(mode, args.clicks, args.channels, args.spread, args.seed))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
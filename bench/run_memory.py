@@ -0,0 +1,105 @@
+"""Memory held by live run state, per representation, at --runs simulated runs.
+
+"dict" is the free-form dict main.py kept per run, "class" the plain Run class main.oop.py
+had (Members, ladder/type strings, a datetime), "slotted" is runs.Run. Members are built
+before measuring, since discord.py's cache holds them either way; ladder, type, game name
+and password are fresh strings per run, as they arrive in each command's payload. Each run
+gets a seeded 0-7 attendees. tracemalloc counts what building the runs allocates.
+
+    python bench/run_memory.py --runs 1000 10000
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from runs import LADDER_LABELS, MAX_ATTENDEES, RUN_TYPE_LABELS, Ladder, Run, RunType
+
+
+class FakeMember:
+    # discord.Member has far more attributes; only the reference to it matters here
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class ClassRun:
+    """main.oop.py's Run before runs.py."""
+
+    def __init__(self, runner, ladder, run_type, run_name, password):
+        self.runner = runner
+        self.ladder = ladder
+        self.type = run_type
+        self.run_name = run_name
+        self.password = password
+        self.attendees = []
+        self.start_time = datetime.datetime.now(datetime.UTC)
+        self.db_id = None
+
+
+def payload(text):
+    return text.encode().decode()  # a fresh copy, like a string parsed out of an interaction
+
+
+def build_dict(spec):
+    runner, ladder, run_type, attendees, n = spec
+    return {'ladder': payload(LADDER_LABELS[ladder]), 'type': payload(RUN_TYPE_LABELS[run_type]), 'runner': runner,
+            'attendees': list(attendees), 'runs_num': n, 'runs_name': payload(f"game-{n}"),
+            'runs_password': payload("pw"), 'db_id': n}
+
+
+def build_class(spec):
+    runner, ladder, run_type, attendees, n = spec
+    run = ClassRun(runner, payload(LADDER_LABELS[ladder]), payload(RUN_TYPE_LABELS[run_type]), payload(f"game-{n}"), payload("pw"))
+    run.attendees.extend(attendees)
+    run.db_id = n
+    return run
+
+
+def build_slotted(spec):
+    runner, ladder, run_type, attendees, n = spec
+    return Run(runner.id, Ladder(ladder), RunType(run_type), payload(f"game-{n}"), payload("pw"),
+               [a.id for a in attendees], db_id=n)
+
+
+BUILDERS = {"dict": build_dict, "class": build_class, "slotted": build_slotted}
+
+
+def specs(count, seed):
+    rng = random.Random(seed)
+    members = [FakeMember(rng.getrandbits(63), f"member{i}") for i in range(count * (MAX_ATTENDEES + 1))]
+    for n in range(count):
+        group = members[n * (MAX_ATTENDEES + 1):(n + 1) * (MAX_ATTENDEES + 1)]
+        yield group[0], rng.randrange(len(LADDER_LABELS)), rng.randrange(len(RUN_TYPE_LABELS)), group[1:1 + rng.randint(0, MAX_ATTENDEES)], n
+
+
+def measure(build, count, seed):
+    inputs = list(specs(count, seed))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    runs = [build(spec) for spec in inputs]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del runs
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'runs':>6} {'representation':>14} {'total':>10} {'per run':>9}")
+    for count in args.runs:
+        for name, build in BUILDERS.items():
+            used = measure(build, count, args.seed)
+            print(f"{count:6d} {name:>14} {used / 1024:8.0f}KiB {used / count:7.0f}B")
+
+
+if __name__ == "__main__":
+    main()
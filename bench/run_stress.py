@@ -0,0 +1,211 @@
+"""Concurrent joins, waitlisting, quickjoins, queueing, leaves, transfers and ends against RunManager, checking its invariants.
+
+--workers coroutines each loop over --ops random operations on --runs runs spread across the
+four ladders, drawing players from a shared pool so they race for the same people and seats.
+Every lock holds for --hold-ms after it is acquired (0 still yields once), so other workers
+get to run while it is held and have to wait for it or re-check after it. "global" gives all
+runs one shared lock, as RunManager.lock did; "per-run" is RunManager's own locking.
+
+At the end every run must have at most MAX_ATTENDEES unique attendees, not counting its
+runner, the players and open-slot indexes must match the runs exactly, and no one may be
+queued for a kind of run that has a free seat, or be queued and seated at once. Waitlists
+must belong to full runs, hold at most MAX_WAITLIST players, none of them seated, and match
+the waitlisted index. Any violation exits with status 1.
+
+    python bench/run_stress.py --runs 200 --workers 200 --ops 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from runs import MAX_ATTENDEES, MAX_WAITLIST, Ladder, Run, RunLocks, RunManager, RunType
+
+
+class HeldLock(asyncio.Lock):
+    """Holds on for a while after acquiring, like a critical section with an await in it."""
+
+    hold = 0.0
+    waits = []
+
+    async def acquire(self):
+        start = time.perf_counter()
+        await super().acquire()
+        HeldLock.waits.append(time.perf_counter() - start)
+        await asyncio.sleep(HeldLock.hold)
+        return True
+
+
+class HeldLocks(RunLocks):
+    def __call__(self, runner_id):
+        lock = self.locks.get(runner_id)
+        if lock is None:
+            lock = self.locks[runner_id] = HeldLock()
+        return lock
+
+
+class SharedLock(RunLocks):
+    def __init__(self):
+        super().__init__()
+        self.lock = HeldLock()
+
+    def __call__(self, runner_id):
+        return self.lock
+
+
+class NoLock:
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+def manager(mode, path):
+    manager = RunManager(path)
+    if mode == "global":
+        # every path then takes the one shared lock exactly once
+        manager.registry_lock = NoLock()
+        manager.locks = SharedLock()
+    else:
+        manager.registry_lock = HeldLock()
+        manager.locks = HeldLocks()
+    return manager
+
+
+async def worker(manager, rng, players, ops, counts):
+    for _ in range(ops):
+        player = rng.choice(players)
+        roll = rng.random()
+        if roll < 0.4:
+            runner_id = rng.choice(list(manager.active_runs) or [None])
+            if runner_id is not None:
+                place = await manager.join_or_wait(runner_id, player)
+                counts["join refused" if place is None else "waitlist" if place else "join"] += 1
+        elif roll < 0.5:
+            counts["quickjoin" if await manager.quick_join(rng.choice(list(Ladder)), rng.choice(list(RunType)), player) else "quickjoin refused"] += 1
+        elif roll < 0.6:
+            if player in manager.queue or player in manager.waitlisted:
+                manager.queue.cancel(player)
+                manager.leave_waitlist(player)
+                counts["unqueue"] += 1
+            elif not await manager.is_player_in_run(player):
+                types = rng.sample(list(RunType), rng.randint(1, 3))
+                counts["enqueue seated" if await manager.enqueue(player, rng.choice(list(Ladder)), types) else "enqueue queued"] += 1
+        elif roll < 0.8:
+            run = manager.get_run(player)
+            if run and run.runner_id != player:
+                counts["leave" if await manager.remove_attendee(run.runner_id, player) else "leave refused"] += 1
+        elif roll < 0.88:
+            run = manager.get_run(player)
+            if run and run.attendees:
+                counts["transfer" if await manager.change_runner(run.runner_id, rng.choice(run.attendees)) else "transfer refused"] += 1
+        elif roll < 0.94:
+            if manager.is_runner(player):
+                await manager.remove_run(player)
+                counts["end"] += 1
+        elif not await manager.is_player_in_run(player):
+            try:
+                await manager.add_run(Run(player, rng.choice(list(Ladder)), rng.choice(list(RunType)), "stress", ""))
+                counts["host"] += 1
+            except ValueError:
+                counts["host refused"] += 1
+
+
+def violations(manager) -> list[str]:
+    problems = []
+    seen = {}
+    for runner_id, run in manager.active_runs.items():
+        if run.runner_id != runner_id:
+            problems.append(f"run filed under {runner_id} has runner {run.runner_id}")
+        if len(run.attendees) > MAX_ATTENDEES:
+            problems.append(f"run {runner_id} has {len(run.attendees)} attendees")
+        if len(set(run.attendees)) != len(run.attendees) or runner_id in run.attendees:
+            problems.append(f"run {runner_id} lists a member twice")
+        for member_id in run.members():
+            if member_id in seen:
+                problems.append(f"{member_id} is in runs {seen[member_id]} and {runner_id}")
+            seen[member_id] = runner_id
+    if seen != manager.players:
+        problems.append(f"players index has {len(manager.players)} entries, runs have {len(seen)} members")
+    both = set(manager.queue.entries) & set(manager.players)
+    if both:
+        problems.append(f"{len(both)} players are both queued and in a run")
+    for (ladder, run_type), fifo in manager.queue.waiting.items():
+        runner_id = manager.open.best(ladder, run_type)
+        if fifo and runner_id is not None:
+            problems.append(f"{len(fifo)} players wait for {ladder.label} {run_type.label} while run {runner_id} has a seat")
+    for runner_id, waitlist in manager.waitlists.items():
+        run = manager.active_runs.get(runner_id)
+        if run is None or not run.is_full or not waitlist or len(waitlist) > MAX_WAITLIST:
+            problems.append(f"run {runner_id} has a waitlist of {len(waitlist)} while {'full' if run and run.is_full else 'not full'}")
+        for player_id in waitlist:
+            if manager.waitlisted.get(player_id) != runner_id:
+                problems.append(f"{player_id} waits for {runner_id} but is indexed under {manager.waitlisted.get(player_id)}")
+            if player_id in manager.players:
+                problems.append(f"{player_id} waits for {runner_id} while seated in {manager.players[player_id]}")
+    if len(manager.waitlisted) != sum(map(len, manager.waitlists.values())):
+        problems.append(f"waitlisted index has {len(manager.waitlisted)} entries, waitlists have {sum(map(len, manager.waitlists.values()))}")
+    open_runs = {runner_id for runner_id, run in manager.active_runs.items() if not run.is_full}
+    if set(manager.open.where) != open_runs:
+        problems.append(f"open-slot index has {len(manager.open)} runs, {len(open_runs)} have a free seat")
+    for runner_id, level in manager.open.where.items():
+        run = manager.active_runs.get(runner_id)
+        if run and manager.open.buckets[(run.ladder, run.type)][len(run.attendees)] is not level:
+            problems.append(f"run {runner_id} is filed under the wrong fill level")
+    return problems
+
+
+async def stress(mode, runs, workers, ops, pool, seed):
+    rng = random.Random(seed)
+    HeldLock.waits = []
+    with tempfile.TemporaryDirectory() as tmp:
+        runs_manager = manager(mode, os.path.join(tmp, "active_runs.json"))
+        players = list(range(1, pool + 1))
+        for runner_id in rng.sample(players, runs):
+            await runs_manager.add_run(Run(runner_id, rng.choice(list(Ladder)), rng.choice(list(RunType)), "stress", ""))
+        counts = {key: 0 for key in ("join", "waitlist", "join refused", "quickjoin", "quickjoin refused", "enqueue seated", "enqueue queued", "unqueue", "leave", "leave refused", "transfer", "transfer refused", "end", "host", "host refused")}
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(runs_manager, random.Random(rng.random()), players, ops, counts) for _ in range(workers)))
+        elapsed = time.perf_counter() - start
+        problems = violations(runs_manager)
+        runs_manager.expiry.close()
+        runs_manager.queue.close()
+        if runs_manager.snapshot.task:
+            runs_manager.snapshot.task.cancel()
+    return elapsed, counts, sorted(HeldLock.waits), problems
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=20, help="operations per worker")
+    parser.add_argument("--players", type=int, default=3000)
+    parser.add_argument("--hold-ms", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    HeldLock.hold = args.hold_ms / 1000
+
+    failed = False
+    for mode in ("global", "per-run"):
+        elapsed, counts, waits, problems = await stress(mode, args.runs, args.workers, args.ops, args.players, args.seed)
+        total = sum(counts.values())
+        print(f"{mode:>8}: {total} ops in {elapsed:.2f}s ({total / elapsed:.0f}/s), lock wait "
+              f"p50={statistics.median(waits) * 1000:.1f}ms p99={waits[int(len(waits) * 0.99)] * 1000:.1f}ms")
+        print("          " + ", ".join(f"{key} {value}" for key, value in counts.items()))
+        for problem in problems[:10]:
+            print(f"          VIOLATION: {problem}")
+        print(f"          invariants {'broken' if problems else 'held'}")
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""/runs rendering at --runs concurrent runs: the old one-string listing vs cached, paged embeds.
+
+"string" rebuilds main.oop.py's old message, every run's header and mention list, on each
+call. "paged" is runlist.build_page() over RunFragments, with --changes runs invalidated
+between calls as joins and leaves would. Both render for a viewer in none of the runs,
+looking at the first page and at the last. Also reports the longest message or embed each
+produces, against Discord's 2000-character message and 6000-character embed limits.
+
+    python bench/runs_listing.py --runs 10 50 200 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from runlist import PAGE_SIZE, RunFragments, build_page
+from runs import MAX_ATTENDEES, Ladder, Run, RunType, mention
+
+MESSAGE_LIMIT = 2000
+EMBED_LIMIT = 6000
+
+
+def old_listing(runs):
+    message_parts = []
+    for run in runs:
+        msg = f"Runner: {mention(run.runner_id)}\n# {run.ladder.label}\nType: {run.type.label}\n"
+        msg += "Attendees:\n"
+        for attendee_id in run.attendees:
+            msg += f"{mention(attendee_id)}\n"
+        msg += "\n\n"
+        message_parts.append(msg)
+    return "".join(message_parts)
+
+
+def embed_length(page):
+    return len(page.title) + len(page.description) + len(page.footer) + sum(len(n) + len(v) for n, v in page.fields)
+
+
+def make_runs(count, rng):
+    runs = []
+    for n in range(count):
+        runner_id = rng.getrandbits(63)
+        attendees = [rng.getrandbits(63) for _ in range(rng.randint(0, MAX_ATTENDEES))]
+        runs.append(Run(runner_id, rng.choice(list(Ladder)), rng.choice(list(RunType)), f"game-{n}", "pw", attendees))
+    return runs
+
+
+def time_calls(render, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        render()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, nargs="+", default=[10, 50, 200, 1000])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--changes", type=int, default=2, help="runs changed between paged calls")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'runs':>6} {'string':>10} {'chars':>7} {'paged p1':>10} {'paged last':>11} {'chars':>6} {'hit rate':>9}")
+    for count in args.runs:
+        rng = random.Random(args.seed)
+        runs = make_runs(count, rng)
+        fragments = RunFragments({})
+        last_page = (count - 1) // PAGE_SIZE
+
+        def paged(page):
+            for run in rng.sample(runs, min(args.changes, count)):
+                fragments.discard(run.runner_id)
+            return build_page(runs, fragments, None, 0, page)
+
+        string_time = time_calls(lambda: old_listing(runs), args.calls)
+        first_time = time_calls(lambda: paged(0), args.calls)
+        last_time = time_calls(lambda: paged(last_page), args.calls)
+        longest = max(embed_length(build_page(runs, fragments, None, 0, page)) for page in range(last_page + 1))
+        hit_rate = fragments.hits / max(1, fragments.hits + fragments.misses)
+        over = "!" if len(old_listing(runs)) > MESSAGE_LIMIT else " "
+        print(f"{count:6d} {string_time * 1e6:8.1f}us {len(old_listing(runs)):6d}{over} {first_time * 1e6:8.1f}us "
+              f"{last_time * 1e6:9.1f}us {longest:6d} {hit_rate:8.1%}")
+        assert longest <= EMBED_LIMIT
+    print(f"! over Discord's {MESSAGE_LIMIT}-character message limit")
+
+
+if __name__ == "__main__":
+    main()
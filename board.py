@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import discord
+
+from buttons import JOIN, run_button, run_buttons
+from outbound import BOARD
+
+MAX_BUTTONS = 25  # five action rows of five
+
+
+class RunBoard:
+    """One pinned message per realm channel listing its runs, edited in place.
+
+    changed() marks a channel's board stale. The edit waits delay seconds so a burst of
+    joins becomes one edit, and never lands sooner than min_interval after the previous one
+    in that channel. It then goes through the Outbound queue at BOARD priority, behind any
+    replies to that channel and merged with any board update still waiting there.
+
+    render(channel_id) returns the board text and a list of (label, runner ID) join buttons.
+    """
+
+    def __init__(self, bot, render, outbound, delay=1.0, min_interval=2.0):
+        self.bot = bot
+        self.render = render
+        self.outbound = outbound
+        self.delay = delay
+        self.min_interval = min_interval
+        self.messages = {}  # channel ID -> board message
+        self.tasks = {}
+        self.bumps = set()
+        self.last_edit = {}
+
+    def changed(self, channel_id: int | None, bump=False):
+        """Schedules a board refresh; bump reposts it at the bottom of the channel instead."""
+        if channel_id is None:
+            return
+        if bump:
+            self.bumps.add(channel_id)
+        task = self.tasks.get(channel_id)
+        if task is None or task.done():
+            self.tasks[channel_id] = asyncio.create_task(self._update_later(channel_id))
+
+    async def _update_later(self, channel_id: int):
+        wait = max(self.delay, self.last_edit.get(channel_id, 0) + self.min_interval - time.monotonic())
+        await asyncio.sleep(wait)
+        del self.tasks[channel_id]  # changes from here on schedule another edit
+        try:
+            await self.outbound.submit(channel_id, lambda: self._publish(channel_id), BOARD, key=("board", channel_id))
+        except discord.HTTPException:
+            pass  # already logged by Outbound; the next change retries
+        self.last_edit[channel_id] = time.monotonic()
+
+    def _view(self, buttons) -> discord.ui.View | None:
+        if not buttons:
+            return None
+        return run_buttons(*(run_button(JOIN, runner_id, label) for label, runner_id in buttons[:MAX_BUTTONS]))
+
+    async def _publish(self, channel_id: int):
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return
+        content, buttons = self.render(channel_id)
+        view = self._view(buttons)
+        message = self.messages.get(channel_id) or await self._find(channel)
+        if message is not None and channel_id in self.bumps:
+            try:
+                await message.delete()
+            except discord.NotFound:
+                pass
+            message = None
+        self.bumps.discard(channel_id)
+        if message is not None:
+            try:
+                await message.edit(content=content, view=view, allowed_mentions=discord.AllowedMentions.none())
+            except discord.NotFound:
+                message = None
+        if message is None:
+            message = await channel.send(content, view=view, allowed_mentions=discord.AllowedMentions.none())
+            await message.pin()
+        self.messages[channel_id] = message
+
+    async def _find(self, channel) -> discord.Message | None:
+        """The board pinned by a previous session, so a restart keeps editing the same message."""
+        for message in await channel.pins():
+            if message.author == self.bot.user:
+                return message
+        return None
@@ -0,0 +1,70 @@
+import logging
+import time
+
+import discord
+
+import eventlog
+
+log = logging.getLogger("runs.buttons")
+
+JOIN = "runs:join"
+LEAVE = "runs:leave"
+PAGE = "runs:page"  # carries a runlist.page_state() instead of a runner ID
+
+
+def run_button(action: str, runner_id: int, label: str | None = None) -> discord.ui.Button:
+    if action == LEAVE:
+        return discord.ui.Button(style=discord.ButtonStyle.red, label=label or "Leave Run", custom_id=f"{LEAVE}:{runner_id}")
+    return discord.ui.Button(style=discord.ButtonStyle.green, label=(label or "Join Run")[:80], custom_id=f"{JOIN}:{runner_id}")
+
+
+def page_button(state: int | None, label: str) -> discord.ui.Button:
+    """A /runs page turner; None gives a disabled one, for the first and last page."""
+    # custom_ids must be unique within a message, so a disabled button gets the label instead
+    return discord.ui.Button(style=discord.ButtonStyle.grey, label=label, disabled=state is None,
+                             custom_id=f"{PAGE}:{state}" if state is not None else f"{PAGE}:{label}")
+
+
+def run_buttons(*buttons: discord.ui.Button) -> discord.ui.View:
+    """A view to send buttons with. It is built with store=False, so the client never keeps it
+    or times it out; clicks carry the runner ID in their custom_id and reach ButtonDispatcher,
+    which works the same for a message posted a minute ago or before the last restart."""
+    view = discord.ui.View(timeout=None, store=False)
+    for button in buttons:
+        view.add_item(button)
+    return view
+
+
+class ButtonDispatcher:
+    """Routes run button clicks to handler(interaction, runner_id) by custom_id prefix.
+
+    PAGE handlers get the page state in place of the runner ID. Each click gets its own
+    correlation context (see eventlog.begin) and is logged; given a metrics.Metrics, each
+    handler's time is recorded under its action.
+    """
+
+    def __init__(self, metrics=None):
+        self.handlers = {}
+        self.metrics = metrics
+
+    def register(self, action: str, handler):
+        self.handlers[action] = handler
+
+    async def dispatch(self, interaction: discord.Interaction) -> bool:
+        if interaction.type is not discord.InteractionType.component or not interaction.data:
+            return False
+        action, _, runner_id = interaction.data.get("custom_id", "").rpartition(":")
+        handler = self.handlers.get(action)
+        if handler is None or not runner_id.isdigit():
+            return False
+        name = action.removeprefix("runs:")
+        eventlog.begin(name, interaction.id)
+        started = time.perf_counter()
+        try:
+            await handler(interaction, int(runner_id))
+        finally:
+            elapsed = time.perf_counter() - started
+            log.info("button", extra={"action": name, "user": interaction.user.id, "target": int(runner_id), "ms": round(elapsed * 1000, 1)})
+            if self.metrics:
+                self.metrics.observe("runs_button_seconds", elapsed, action=name)
+        return True
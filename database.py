@@ -0,0 +1,484 @@
+import asyncio
+import concurrent.futures
+import datetime
+import logging
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import eventlog
+
+log = logging.getLogger("runs.db")
+
+
+# start_time and joined_at are UTC Unix timestamps in whole seconds.
+RUNS_TABLE = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        runner_id INTEGER,
+        runner_name TEXT,
+        type TEXT,
+        ladder TEXT,
+        run_name TEXT,
+        start_time INTEGER
+    );
+"""
+
+
+def create_tables(cursor):
+    cursor.execute(RUNS_TABLE.format(name="runs"))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_start_time ON runs(start_time)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS run_attendees (
+            run_id INTEGER NOT NULL REFERENCES runs(id),
+            user_id INTEGER NOT NULL,
+            user_name TEXT,
+            joined_at INTEGER,
+            PRIMARY KEY (run_id, user_id)
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_run_attendees_user ON run_attendees(user_id)")
+    # Attendees carried over from the old comma-joined column only had a name, so they get a
+    # negative placeholder ID until that player joins a run again (see Database.add_attendee).
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_run_attendees_legacy ON run_attendees(user_name) WHERE user_id < 0")
+    # Leaderboard counters, kept in step with runs/run_attendees by the Database write methods
+    # and regenerated from scratch by rebuild_stats. day is days since the Unix epoch (UTC) of
+    # the run's start_time.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            user_name TEXT,
+            hosted INTEGER NOT NULL DEFAULT 0,
+            participated INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_hosted ON user_stats(hosted)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_participated ON user_stats(participated)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            day INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            hosted INTEGER NOT NULL DEFAULT 0,
+            participated INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID;
+    """)
+
+
+def migrate_attendees(cursor):
+    # Names that have hosted a run can be mapped back to their real ID; later rows win.
+    known_ids = dict(cursor.execute("SELECT runner_name, runner_id FROM runs ORDER BY id").fetchall())
+    legacy_ids = {}
+    rows = []
+    for run_id, attendees, start_time in cursor.execute("SELECT id, attendees, start_time FROM runs WHERE attendees != ''").fetchall():
+        for name in attendees.split(","):
+            if not name:
+                continue
+            user_id = known_ids.get(name)
+            if user_id is None:
+                user_id = legacy_ids.setdefault(name, -(len(legacy_ids) + 1))
+            rows.append((run_id, user_id, name, start_time))
+    cursor.executemany("""
+        INSERT OR IGNORE INTO run_attendees (run_id, user_id, user_name, joined_at)
+        VALUES (?, ?, ?, ?)
+    """, rows)
+
+
+START_DAY = "start_time / 86400"
+
+
+def bump_stats(cursor, user_id, user_name, day, hosted=0, participated=0):
+    cursor.execute("""
+        INSERT INTO user_stats (user_id, user_name, hosted, participated) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            user_name = COALESCE(excluded.user_name, user_name),
+            hosted = hosted + excluded.hosted,
+            participated = participated + excluded.participated
+    """, (user_id, user_name, hosted, participated))
+    cursor.execute("""
+        INSERT INTO user_daily_stats (day, user_id, hosted, participated) VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, user_id) DO UPDATE SET
+            hosted = hosted + excluded.hosted,
+            participated = participated + excluded.participated
+    """, (day, user_id, hosted, participated))
+
+
+def rebuild_stats(cursor):
+    cursor.execute("DELETE FROM user_daily_stats")
+    cursor.execute("DELETE FROM user_stats")
+    cursor.execute(f"""
+        INSERT INTO user_daily_stats (day, user_id, hosted)
+        SELECT {START_DAY}, runner_id, COUNT(*) FROM runs GROUP BY 1, 2
+    """)
+    cursor.execute(f"""
+        INSERT INTO user_daily_stats (day, user_id, participated)
+        SELECT {START_DAY.replace('start_time', 'r.start_time')}, a.user_id, COUNT(*)
+        FROM run_attendees a JOIN runs r ON r.id = a.run_id
+        WHERE true
+        GROUP BY 1, 2
+        ON CONFLICT (day, user_id) DO UPDATE SET participated = excluded.participated
+    """)
+    cursor.execute("""
+        INSERT INTO user_stats (user_id, hosted, participated)
+        SELECT user_id, SUM(hosted), SUM(participated) FROM user_daily_stats GROUP BY user_id
+    """)
+    # Latest name seen for each user, hosting or joining, wins.
+    cursor.execute("""
+        UPDATE user_stats SET user_name = latest.user_name
+        FROM (
+            SELECT user_id, user_name, MAX(seen) FROM (
+                SELECT runner_id AS user_id, runner_name AS user_name, start_time AS seen FROM runs
+                UNION ALL
+                SELECT user_id, user_name, joined_at FROM run_attendees
+            ) GROUP BY user_id
+        ) AS latest
+        WHERE latest.user_id = user_stats.user_id
+    """)
+
+
+def migrate_start_time(cursor):
+    # sqlite3's default datetime adapter stored text like '2025-04-01 20:15:00.123456+00:00'.
+    # SQLite can't change a column's type in place, so copy runs into a fresh table, which
+    # also drops the attendees column that migrate_attendees already moved out.
+    to_epoch = "CASE typeof({0}) WHEN 'text' THEN CAST(strftime('%s', {0}) AS INTEGER) ELSE {0} END"
+    cursor.execute(RUNS_TABLE.format(name="runs_new"))
+    cursor.execute(f"""
+        INSERT INTO runs_new (id, runner_id, runner_name, type, ladder, run_name, start_time)
+        SELECT id, runner_id, runner_name, type, ladder, run_name, {to_epoch.format('start_time')} FROM runs
+    """)
+    cursor.execute("DROP TABLE runs")
+    cursor.execute("ALTER TABLE runs_new RENAME TO runs")
+    cursor.execute("CREATE INDEX idx_runs_start_time ON runs(start_time)")
+    cursor.execute(f"UPDATE run_attendees SET joined_at = {to_epoch.format('joined_at')}")
+    rebuild_stats(cursor)
+
+
+MIGRATIONS = [
+    migrate_attendees,
+    None,  # built the leaderboard counters; migrate_start_time rebuilds them now
+    migrate_start_time,
+]
+
+
+def migrate(conn):
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    fresh = not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'runs'").fetchone()
+    create_tables(cursor)
+    version = len(MIGRATIONS) if fresh else cursor.execute("PRAGMA user_version").fetchone()[0]
+    for migration in MIGRATIONS[version:]:
+        if migration:
+            migration(cursor)
+    cursor.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    cursor.execute("COMMIT")
+
+
+class Database:
+    """Async front for runs.db.
+
+    A single background thread owns the sqlite3 connection and runs every query, so slow
+    commits never block the event loop. Reads are coroutines that await the result of that
+    thread. Writes (insert_run, add_attendee, remove_attendee, update_runner and
+    update_run_name) are write-behind: they are queued and return straight away, and the
+    thread commits everything that arrives within commit_window seconds (or max_batch
+    writes) as one transaction. RunManager holds the live state, so the rows may trail it
+    by up to commit_window. Use flush() to wait for queued writes and close() on shutdown.
+
+    Run row IDs are handed out by insert_run before the row is written, so callers can
+    address later updates to that row by primary key straight away. This assumes this
+    process is the only writer to runs.db.
+
+    Given a metrics.Metrics, the thread records how long each call waited in the queue and
+    took to run, by method, and how long each commit took. While a profiler.Profiler is
+    attached (it sets profiler itself), every call also reports the SQL it ran.
+    """
+
+    def __init__(self, db_name="runs.db", commit_window=0.05, max_batch=100, metrics=None):
+        self.db_name = db_name
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self.metrics = metrics
+        self.profiler = None
+        self.adopted_ids = set()
+        self.write_version = 0  # bumped by every queued write; lets callers cache reads
+        self.queue = queue.Queue()
+        ready = concurrent.futures.Future()
+        self.thread = threading.Thread(target=self._worker, args=(ready,), name="runs-db", daemon=True)
+        self.thread.start()
+        ready.result()
+
+    def _connect(self):
+        self.conn = sqlite3.connect(self.db_name)
+        # Leaves the connection in autocommit mode; _commit_batch opens and commits transactions.
+        migrate(self.conn)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'runs'), 0), COALESCE(MAX(id), 0)) FROM runs")
+        self.last_run_id = self.cursor.fetchone()[0]
+
+    def _worker(self, ready):
+        try:
+            self._connect()
+        except BaseException as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(None)
+        pending = None
+        while True:
+            item = pending or self.queue.get()
+            op, fn, args, future, is_write, queued_at, context = item
+            pending = None
+            if fn is None:
+                self.conn.close()
+                future.set_result(None)
+                return
+            if not is_write:
+                eventlog.context.set(context)
+                started = self._started(op, queued_at)
+                try:
+                    future.set_result(self._execute(op, fn, args))
+                except Exception as e:
+                    future.set_exception(e)
+                self._finished(op, started)
+                continue
+            batch = [item]
+            deadline = time.monotonic() + self.commit_window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if not item[4]:
+                    # A read or close: commit what we have first so it sees every earlier write.
+                    pending = item
+                    break
+                batch.append(item)
+            self._commit_batch(batch)
+
+    def _started(self, op, queued_at) -> float:
+        started = time.perf_counter()
+        if self.metrics:
+            self.metrics.observe("runs_db_queue_seconds", started - queued_at, op=op)
+        return started
+
+    def _finished(self, op, started):
+        if self.metrics:
+            self.metrics.observe("runs_db_seconds", time.perf_counter() - started, op=op)
+
+    def _execute(self, op, fn, args):
+        profiler = self.profiler
+        if profiler is None:
+            return fn(*args)
+        statements = []
+        self.conn.set_trace_callback(statements.append)  # SQL with the parameters filled in
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.conn.set_trace_callback(None)
+            profiler.query(op, args, statements, time.perf_counter() - started)
+
+    def _commit_batch(self, batch):
+        results = []
+        self.cursor.execute("BEGIN")
+        for op, fn, args, future, _, queued_at, context in batch:
+            eventlog.context.set(context)  # so the write is logged under the interaction that made it
+            started = self._started(op, queued_at)
+            self.cursor.execute("SAVEPOINT write")
+            try:
+                results.append((future, self._execute(op, fn, args), None))
+                self.cursor.execute("RELEASE write")
+            except Exception as e:
+                self.cursor.execute("ROLLBACK TO write")
+                self.cursor.execute("RELEASE write")
+                log.error("database write failed", exc_info=e, extra={"op": op, "params": args})
+                results.append((future, None, e))
+                if self.metrics:
+                    self.metrics.inc("runs_db_errors_total", op=op)
+            else:
+                log.info("database write", extra={"op": op, "ms": round((time.perf_counter() - started) * 1000, 3)})
+            self._finished(op, started)
+        eventlog.context.set(None)
+        started = time.perf_counter()
+        try:
+            self._execute("commit", self.cursor.execute, ("COMMIT",))
+        except Exception as e:
+            self.cursor.execute("ROLLBACK")
+            log.error("commit failed, rolled back", exc_info=e, extra={"writes": len(batch)})
+            results = [(future, None, e) for future, _, _ in results]
+            if self.metrics:
+                self.metrics.inc("runs_db_errors_total", op="commit")
+        if self.metrics:
+            self.metrics.observe("runs_db_commit_seconds", time.perf_counter() - started)
+        for future, result, error in results:
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _submit(self, op, fn, args, is_write):
+        # op names the call in the metrics
+        future = concurrent.futures.Future()
+        self.queue.put((op, fn, args, future, is_write, time.perf_counter(), eventlog.current()))
+        return future
+
+    async def _run(self, op, fn, *args):
+        return await asyncio.wrap_future(self._submit(op, fn, args, False))
+
+    def _write(self, op, fn, *args):
+        self.write_version += 1
+        return self._submit(op, fn, args, True)
+
+    async def flush(self):
+        await self._run("flush", lambda: None)
+
+    def close(self):
+        self._submit("close", None, (), False).result()
+        self.thread.join()
+
+    async def insert_run(self, runner_id: int, runner_name: str, run_type: str, ladder: str, run_name: str,
+                         attendees: list[tuple[int, str | None]], start_time: int) -> int:
+        self.last_run_id += 1
+        self._write("insert_run", self._insert_run, self.last_run_id, runner_id, runner_name, run_type, ladder, run_name, attendees, start_time)
+        return self.last_run_id
+
+    def _insert_run(self, run_id, runner_id, runner_name, run_type, ladder, run_name, attendees, start_time):
+        self.cursor.execute("""
+            INSERT INTO runs (id, runner_id, runner_name, type, ladder, run_name, start_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (run_id, runner_id, runner_name, run_type, ladder, run_name, start_time))
+        self.cursor.executemany("""
+            INSERT OR IGNORE INTO run_attendees (run_id, user_id, user_name, joined_at)
+            VALUES (?, ?, ?, ?)
+        """, [(run_id, user_id, user_name, start_time) for user_id, user_name in attendees])
+        day = start_time // 86400
+        bump_stats(self.cursor, runner_id, runner_name, day, hosted=1)
+        for user_id, user_name in attendees:
+            bump_stats(self.cursor, user_id, user_name, day, participated=1)
+
+    def _run_day(self, run_id):
+        self.cursor.execute(f"SELECT {START_DAY} FROM runs WHERE id = ?", (run_id,))
+        return self.cursor.fetchone()[0]
+
+    async def update_run_name(self, run_id: int, run_name: str):
+        self._write("update_run_name", self._update_run_name, run_id, run_name)
+
+    def _update_run_name(self, run_id, run_name):
+        self.cursor.execute("UPDATE runs SET run_name = ? WHERE id = ?", (run_name, run_id))
+
+    async def add_attendee(self, run_id: int, attendee_id: int, attendee_name: str):
+        joined_at = int(time.time())
+        self._write("add_attendee", self._add_attendee, run_id, attendee_id, attendee_name, joined_at)
+
+    def _add_attendee(self, run_id, attendee_id, attendee_name, joined_at):
+        if attendee_id not in self.adopted_ids:
+            self._adopt_legacy_attendee(attendee_id, attendee_name)
+            self.adopted_ids.add(attendee_id)
+        self.cursor.execute("""
+            INSERT OR IGNORE INTO run_attendees (run_id, user_id, user_name, joined_at)
+            VALUES (?, ?, ?, ?)
+        """, (run_id, attendee_id, attendee_name, joined_at))
+        if self.cursor.rowcount:
+            bump_stats(self.cursor, attendee_id, attendee_name, self._run_day(run_id), participated=1)
+
+    def _adopt_legacy_attendee(self, attendee_id, attendee_name):
+        self.cursor.execute("SELECT user_id FROM run_attendees WHERE user_id < 0 AND user_name = ? LIMIT 1", (attendee_name,))
+        row = self.cursor.fetchone()
+        if not row:
+            return
+        legacy_id = row[0]
+        self.cursor.execute("UPDATE OR IGNORE run_attendees SET user_id = ? WHERE user_id = ?", (attendee_id, legacy_id))
+        self.cursor.execute("""
+            INSERT INTO user_daily_stats (day, user_id, hosted, participated)
+            SELECT day, ?, hosted, participated FROM user_daily_stats WHERE user_id = ?
+            ON CONFLICT (day, user_id) DO UPDATE SET
+                hosted = hosted + excluded.hosted,
+                participated = participated + excluded.participated
+        """, (attendee_id, legacy_id))
+        self.cursor.execute("""
+            INSERT INTO user_stats (user_id, user_name, hosted, participated)
+            SELECT ?, ?, hosted, participated FROM user_stats WHERE user_id = ?
+            ON CONFLICT (user_id) DO UPDATE SET
+                hosted = hosted + excluded.hosted,
+                participated = participated + excluded.participated
+        """, (attendee_id, attendee_name, legacy_id))
+        self.cursor.execute("DELETE FROM user_daily_stats WHERE user_id = ?", (legacy_id,))
+        self.cursor.execute("DELETE FROM user_stats WHERE user_id = ?", (legacy_id,))
+
+    async def remove_attendee(self, run_id: int, attendee_id: int):
+        self._write("remove_attendee", self._remove_attendee, run_id, attendee_id)
+
+    def _remove_attendee(self, run_id, attendee_id):
+        self.cursor.execute("DELETE FROM run_attendees WHERE run_id = ? AND user_id = ?", (run_id, attendee_id))
+        if self.cursor.rowcount:
+            bump_stats(self.cursor, attendee_id, None, self._run_day(run_id), participated=-1)
+
+    async def update_runner(self, run_id: int, new_runner_id: int, new_runner_name: str):
+        self._write("update_runner", self._update_runner, run_id, new_runner_id, new_runner_name)
+
+    def _update_runner(self, run_id, new_runner_id, new_runner_name):
+        self.cursor.execute(f"SELECT runner_id, {START_DAY} FROM runs WHERE id = ?", (run_id,))
+        old_runner_id, day = self.cursor.fetchone()
+        self.cursor.execute("UPDATE runs SET runner_id = ?, runner_name = ? WHERE id = ?", (new_runner_id, new_runner_name, run_id))
+        bump_stats(self.cursor, old_runner_id, None, day, hosted=-1)
+        bump_stats(self.cursor, new_runner_id, new_runner_name, day, hosted=1)
+
+    async def rebuild_stats(self):
+        await asyncio.wrap_future(self._write("rebuild_stats", rebuild_stats, self.cursor))
+
+    @staticmethod
+    def _since_day(days, since):
+        # The counters are bucketed by UTC day, so windows are whole days ending today.
+        if since is not None:
+            return int(since.timestamp()) // 86400
+        if days is not None:
+            return int(time.time()) // 86400 - days
+        return None
+
+    async def get_top_hosts(self, days: int | None = None, since: datetime.datetime | None = None):
+        return await self._run("top_hosts", self._top_stats, "hosted", self._since_day(days, since))
+
+    async def get_top_participants(self, days: int | None = None, since: datetime.datetime | None = None):
+        return await self._run("top_participants", self._top_stats, "participated", self._since_day(days, since))
+
+    async def get_leaderboard(self, days: int = 30):
+        """Top hosts and participants over the last `days` days and all-time, in one trip."""
+        return await self._run("leaderboard", self._leaderboard, self._since_day(days, None))
+
+    def _leaderboard(self, since_day):
+        return (self._top_stats("hosted", since_day), self._top_stats("hosted", None),
+                self._top_stats("participated", since_day), self._top_stats("participated", None))
+
+    def _top_stats(self, column, since_day):
+        if since_day is None:
+            self.cursor.execute(f"""
+                SELECT user_name, {column} FROM user_stats
+                WHERE {column} > 0
+                ORDER BY {column} DESC
+                LIMIT 10
+            """)
+        else:
+            self.cursor.execute(f"""
+                SELECT s.user_name, d.total
+                FROM (
+                    SELECT user_id, SUM({column}) AS total FROM user_daily_stats
+                    WHERE day >= ?
+                    GROUP BY user_id
+                    HAVING total > 0
+                    ORDER BY total DESC
+                    LIMIT 10
+                ) AS d
+                JOIN user_stats s ON s.user_id = d.user_id
+                ORDER BY d.total DESC
+            """, (since_day,))
+        return self.cursor.fetchall()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild-stats":
+        sys.exit("usage: python3 database.py rebuild-stats [runs.db]")
+    db = Database(sys.argv[2] if len(sys.argv) > 2 else "runs.db")
+    asyncio.run(db.rebuild_stats())
+    db.close()
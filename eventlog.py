@@ -0,0 +1,95 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+
+# Fraction of interactions of a kind whose info-level events are written; warnings and
+# errors always are. Join clicks come in bursts of dozens after every NEW RUN ALERT.
+SAMPLE_RATES = {"join": 0.1, "page": 0.1}
+
+# (correlation ID, whether this interaction's info events are kept) for the interaction
+# being handled. Tasks copy it when they are created, so jobs spawned by a command carry
+# it; Database and Outbound capture it when a call is queued and restore it when it runs.
+context: contextvars.ContextVar[tuple[str, bool] | None] = contextvars.ContextVar("eventlog_context", default=None)
+
+# Attributes every LogRecord has; anything else on a record came in through extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "correlation_id"}
+
+
+def begin(kind: str, interaction_id: int):
+    """Starts the correlation context for one command or button click, keyed by the interaction's ID."""
+    context.set((f"{kind}-{interaction_id}", random.random() < SAMPLE_RATES.get(kind, 1.0)))
+
+
+def current() -> tuple[str, bool] | None:
+    return context.get()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread with no formatting on the event loop.
+
+    Only the message's %-args are merged. The queue never leaves this process, so the
+    record keeps its exc_info and the traceback is formatted by the writer thread.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _Correlate(logging.Filter):
+    """Stamps records with the current correlation ID and drops sampled-out info events."""
+
+    def filter(self, record):
+        ctx = context.get()
+        if ctx is None:
+            record.correlation_id = None
+            return True
+        record.correlation_id = ctx[0]
+        return ctx[1] or record.levelno >= logging.WARNING
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, correlation ID, then any extra= fields."""
+
+    def format(self, record):
+        event = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", None):
+            event["correlation_id"] = record.correlation_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                event[key] = value
+        if record.exc_info:
+            event["exc"] = self.formatException(record.exc_info)
+        return json.dumps(event, default=repr)
+
+
+def setup(path="logs/bot.jsonl", level=logging.INFO, max_bytes=10_000_000, backups=5) -> logging.handlers.QueueListener:
+    """Sends the "runs" loggers to path as JSON lines, written and rotated by a background thread.
+
+    Returns the listener; stop() it on shutdown to write out what is still queued. Until
+    this is called, warnings and errors go to stderr through logging's last-resort handler.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(_Correlate())
+    logger = logging.getLogger("runs")
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(records, file_handler)
+    listener.start()
+    return listener
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+
+log = logging.getLogger("runs.jobs")
+
+
+class Jobs:
+    """Side effects that run after a command has answered the member.
+
+    spawn() starts the coroutine as a task and keeps a reference to it until it finishes, so
+    it can't be garbage collected mid-flight. A job that raises is logged under its name,
+    with the traceback and the correlation ID of whatever spawned it, and counted in failures.
+    """
+
+    def __init__(self):
+        self.tasks = set()
+        self.failures = defaultdict(int)
+
+    def spawn(self, name: str, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            self.failures[task.get_name()] += 1
+            log.error("background job failed", exc_info=e, extra={"job": task.get_name()})
+
+    async def drain(self):
+        """Waits for the jobs still running, e.g. before shutting down."""
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+class AckTimings:
+    """How long each command takes from its handler starting to the member getting an answer.
+
+    Commands call record(name, started) right after their ack, with started taken from
+    time.perf_counter() on entry. The last window acks per command are kept.
+    """
+
+    def __init__(self, window=1000):
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, name: str, started: float):
+        self.samples[name].append(time.perf_counter() - started)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """p50, p99 and max ack latency per command, in ms."""
+        summary = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            summary[name] = {
+                "count": len(ordered),
+                "p50": ordered[len(ordered) // 2] * 1000,
+                "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+                "max": ordered[-1] * 1000,
+            }
+        return summary
@@ -0,0 +1,46 @@
+import time
+
+
+def render_hosts(rows):
+    return "".join(f"`{index}. {runner}: Hosted {total_runs} Runs`\n" for index, (runner, total_runs) in enumerate(rows, start=1))
+
+
+def render_participants(rows):
+    return "".join(f"`{index}. {participant}: Participated in {count} Runs`\n" for index, (participant, count) in enumerate(rows, start=1))
+
+
+class LeaderboardCache:
+    """Rendered leaderboard sections, shared by /leaderboard and the /top_* commands.
+
+    The sections are fetched from the database in one trip and kept until a run or attendee
+    write bumps Database.write_version. The ttl bounds how long the 30-day sections can go
+    stale on a quiet day, when old runs age out of the window without any write.
+    """
+
+    def __init__(self, db, ttl=300):
+        self.db = db
+        self.ttl = ttl
+        self.version = None
+        self.expires = 0
+        self.sections = None
+
+    async def get(self) -> dict[str, str]:
+        if self.version == self.db.write_version and time.monotonic() < self.expires:
+            return self.sections
+        version = self.db.write_version
+        monthly_hosts, all_time_hosts, monthly_participants, all_time_participants = await self.db.get_leaderboard()
+        self.sections = {
+            "monthly_hosts": render_hosts(monthly_hosts),
+            "all_time_hosts": render_hosts(all_time_hosts),
+            "monthly_participants": render_participants(monthly_participants),
+            "all_time_participants": render_participants(all_time_participants),
+        }
+        self.sections["leaderboard"] = (
+            "**Top Hosts for the Last 30 Days:**\n" + self.sections["monthly_hosts"]
+            + "\n**Top Hosts All-Time:**\n" + self.sections["all_time_hosts"]
+            + "\n**Top Participants in the Last 30 Days:**\n" + self.sections["monthly_participants"]
+            + "\n**Top Participants All-Time:**\n" + self.sections["all_time_participants"]
+        )
+        self.version = version
+        self.expires = time.monotonic() + self.ttl
+        return self.sections
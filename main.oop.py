@@ -1,331 +1,134 @@
 import asyncio
+import logging
+import signal
 import discord
-import re
-import sqlite3
 from discord.ext import commands
 from discord.commands import Option
-from collections import Counter
-import datetime
-
-class Run:
-    def __init__(self, runner: discord.Member, ladder: str, run_type: str, run_name: str, password: str):
-        self.runner = runner
-        self.ladder = ladder
-        self.type = run_type
-        self.run_name = run_name
-        self.password = password
-        self.attendees = []
-        self.start_time = datetime.datetime.now(datetime.UTC)
-
-    def get_realm(self) -> int | None:
-        HARDCORE_LAD = 1356339382323249312
-        HARDCORE_NONLAD = 1337609082290573404
-        SOFTCORE_LAD = 1337608997997510732
-        SOFTCORE_NONLAD = 1337608670661316678
-        if self.ladder == "Non-Ladder":
-            return SOFTCORE_NONLAD
-        elif self.ladder == "Ladder":
-            return SOFTCORE_LAD
-        elif self.ladder == "Non-Ladder Hardcore":
-            return HARDCORE_NONLAD
-        elif self.ladder == "Ladder Hardcore":
-            return HARDCORE_LAD
-        else:
-            return None
-
-class Database:
-    def __init__(self, db_name="runs.db"):
-        self.conn = sqlite3.connect(db_name)
-        self.cursor = self.conn.cursor()
-        self.lock = asyncio.Lock()
-        self.create_table()
-
-    def create_table(self):
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS runs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                runner_id INTEGER,
-                runner_name TEXT,
-                type TEXT,
-                ladder TEXT,
-                run_name TEXT,
-                attendees TEXT,
-                start_time TIMESTAMP
-            );
-        """)
-        self.conn.commit()
-
-    async def insert_run(self, run: Run):
-        attendees_str = ",".join([a.name for a in run.attendees])
-        async with self.lock:
-            self.cursor.execute("""
-                INSERT INTO runs (runner_id, runner_name, type, ladder, run_name, attendees, start_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (run.runner.id, run.runner.name, run.type, run.ladder, run.run_name, attendees_str, run.start_time))
-            self.conn.commit()
-
-    async def update_run_name(self, runner_id: int, run_name: str):
-        async with self.lock:
-            self.cursor.execute("""
-                UPDATE runs
-                SET run_name = ?
-                WHERE id = (SELECT id FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1)
-            """, (run_name, runner_id))
-            self.conn.commit()
-
-    async def add_attendee(self, runner_id: int, attendee_name: str):
-        async with self.lock:
-            self.cursor.execute("SELECT attendees FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1", (runner_id,))
-            result = self.cursor.fetchone()
-            if result:
-                attendees = result[0].split(",") if result[0] else []
-                if attendee_name not in attendees:
-                    attendees.append(attendee_name)
-                    attendees_str = ",".join(attendees)
-                    self.cursor.execute("""
-                        UPDATE runs
-                        SET attendees = ?
-                        WHERE id = (SELECT id FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1)
-                    """, (attendees_str, runner_id))
-                    self.conn.commit()
-
-    async def remove_attendee(self, runner_id: int, attendee_name: str):
-        async with self.lock:
-            self.cursor.execute("SELECT attendees FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1", (runner_id,))
-            result = self.cursor.fetchone()
-            if result:
-                attendees = result[0].split(",") if result[0] else []
-                if attendee_name in attendees:
-                    attendees.remove(attendee_name)
-                    attendees_str = ",".join(attendees)
-                    self.cursor.execute("""
-                        UPDATE runs
-                        SET attendees = ?
-                        WHERE id = (SELECT id FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1)
-                    """, (attendees_str, runner_id))
-                    self.conn.commit()
-
-    async def update_runner(self, old_runner_id: int, new_runner_id: int, new_runner_name: str):
-        async with self.lock:
-            self.cursor.execute("""
-                UPDATE runs
-                SET runner_id = ?, runner_name = ?
-                WHERE id = (SELECT id FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1)
-            """, (new_runner_id, new_runner_name, old_runner_id))
-            self.conn.commit()
-
-    async def get_top_hosts(self, last_month: bool = False):
-        query = """
-            SELECT runner_name, COUNT(*) as total_runs
-            FROM runs
-            GROUP BY runner_id
-            ORDER BY total_runs DESC
-            LIMIT 10
-        """
-        if last_month:
-            query = query.replace("FROM runs", "FROM runs WHERE start_time >= DATE('now', '-1 month')")
-        async with self.lock:
-            self.cursor.execute(query)
-            return self.cursor.fetchall()
-
-    async def get_all_attendees_strings(self, last_month: bool = False):
-        query = "SELECT attendees FROM runs"
-        if last_month:
-            query += " WHERE start_time >= DATE('now', '-1 month')"
-        async with self.lock:
-            self.cursor.execute(query)
-            return [row[0] for row in self.cursor.fetchall()]
-
-async def get_top_participants(db: Database, last_month: bool = False):
-    all_attendees_str = await db.get_all_attendees_strings(last_month)
-    all_users = []
-    for s in all_attendees_str:
-        all_users.extend(s.split(",") if s else [])
-    counted = Counter([u for u in all_users if u])
-    return counted.most_common(10)
-
-class RunManager:
-    def __init__(self):
-        self.active_runs: dict[discord.Member, Run] = {}
-        self.timeouts: dict[discord.Member, asyncio.Task] = {}
-        self.lock = asyncio.Lock()
-        self.timeouts_lock = asyncio.Lock()
-
-    async def add_run(self, run: Run):
-        async with self.lock:
-            if run.runner in self.active_runs:
-                raise ValueError("Runner already hosting a run")
-            self.active_runs[run.runner] = run
-        timeout_task = asyncio.create_task(self._remove_after_timeout(run.runner))
-        async with self.timeouts_lock:
-            self.timeouts[run.runner] = timeout_task
-
-    async def _remove_after_timeout(self, runner: discord.Member):
-        await asyncio.sleep(2 * 60 * 60)  # 2 hours
-        await self.remove_run(runner)
-
-    async def remove_run(self, runner: discord.Member):
-        async with self.lock:
-            self.active_runs.pop(runner, None)
-        async with self.timeouts_lock:
-            task = self.timeouts.pop(runner, None)
-            if task:
-                task.cancel()
-
-    async def reset_timeout(self, runner: discord.Member):
-        async with self.timeouts_lock:
-            task = self.timeouts.get(runner)
-            if task:
-                task.cancel()
-            timeout_task = asyncio.create_task(self._remove_after_timeout(runner))
-            self.timeouts[runner] = timeout_task
-
-    def get_run(self, player: discord.Member) -> Run | None:
-        if player in self.active_runs:
-            return self.active_runs[player]
-        for run in self.active_runs.values():
-            if player in run.attendees:
-                return run
-        return None
-
-    async def get_runner_for_player(self, player: discord.Member) -> discord.Member | None:
-        if player in self.active_runs:
-            return player
-        async with self.lock:
-            for runner, run in self.active_runs.items():
-                if player in run.attendees:
-                    return runner
-        return None
-
-    async def is_player_in_run(self, player: discord.Member) -> bool:
-        if player in self.active_runs:
-            return True
-        async with self.lock:
-            for run in self.active_runs.values():
-                if player in run.attendees:
-                    return True
-        return False
-
-    async def add_attendee(self, runner: discord.Member, attendee: discord.Member) -> bool:
-        async with self.lock:
-            run = self.active_runs.get(runner)
-            if run and len(run.attendees) < 7 and attendee not in run.attendees:
-                run.attendees.append(attendee)
-                return True
-        return False
-
-    async def remove_attendee(self, runner: discord.Member, attendee: discord.Member) -> bool:
-        async with self.lock:
-            run = self.active_runs.get(runner)
-            if run and attendee in run.attendees:
-                run.attendees.remove(attendee)
-                return True
-        return False
-
-    async def change_runner(self, old_runner: discord.Member, new_runner: discord.Member):
-        async with self.lock:
-            run = self.active_runs.pop(old_runner, None)
-            if run:
-                run.runner = new_runner
-                if new_runner in run.attendees:
-                    run.attendees.remove(new_runner)
-                self.active_runs[new_runner] = run
-        async with self.timeouts_lock:
-            task = self.timeouts.pop(old_runner, None)
-            if task:
-                task.cancel()
-            timeout_task = asyncio.create_task(self._remove_after_timeout(new_runner))
-            self.timeouts[new_runner] = timeout_task
-
-    async def increment_run_name(self, runner: discord.Member) -> str | None:
-        async with self.lock:
-            run = self.active_runs.get(runner)
-            if run:
-                run_name = run.run_name
-                matches = re.findall(r"[0-9]*$", run_name)
-                match = matches[0]
-                if match == "":
-                    run_name += "-1"
-                else:
-                    new_match = str(int(match) + 1).zfill(len(match))
-                    run_name = re.sub(r"[0-9]*$", new_match, run_name)
-                run.run_name = run_name
-                return run_name
-        return None
-
-class JoinRunView(discord.ui.View):
-    def __init__(self, runner: discord.Member, timeout=850):
-        super().__init__(timeout=timeout)
-        self.runner = runner
-        self.message = None
-        join_button = discord.ui.Button(style=discord.ButtonStyle.green, label="Join Run")
-        join_button.callback = self.join_callback
-        self.add_item(join_button)
-
-    async def join_callback(self, interaction: discord.Interaction):
-        run = run_manager.get_run(self.runner)
-        if not run:
-            await interaction.response.send_message("The run no longer exists.", ephemeral=True)
-            return
-        user = interaction.user
-        if await run_manager.is_player_in_run(user):
-            await interaction.response.send_message("You are already in a run or hosting one.", ephemeral=True)
-            return
-        if await run_manager.add_attendee(self.runner, user):
-            await db.add_attendee(self.runner.id, user.name)
-            available_spots = 7 - len(run.attendees)
-            game_info_message = f"Game Name: {run.run_name}\nGame Password: {run.password}"
+import time
+from database import Database
+import eventlog
+from leaderboard import LeaderboardCache
+from board import RunBoard
+from buttons import JOIN, LEAVE, PAGE, ButtonDispatcher, page_button, run_button, run_buttons
+from outbound import INTERACTION, REPLY, Outbound
+from jobs import AckTimings, Jobs
+from metrics import Metrics, add_service_gauges, report, timed_locks
+from profiler import Profiler
+from runlist import RunFragments, RunsPage, build_page, parse_page_state
+from runs import LADDER_LABELS, MAX_ATTENDEES, MAX_WAITLIST, RUN_TYPE_LABELS, Ladder, Run, RunLocks, RunManager, RunType, member_name, mention
+
+log = logging.getLogger("runs.bot")
+
+def attendee_names(run: Run, guild: discord.Guild | None) -> list[tuple[int, str | None]]:
+    """(ID, cached name) for each attendee, for a new runs row; None keeps the name runs.db already has."""
+    return [(a, member_name(guild, a)) for a in run.attendees]
+
+async def join_run(interaction: discord.Interaction, runner_id: int):
+    started = time.perf_counter()
+    run = run_manager.active_runs.get(runner_id)
+    if not run:
+        await interaction.response.send_message("The run no longer exists.", ephemeral=True)
+        return
+    user = interaction.user
+    if await run_manager.is_player_in_run(user.id):
+        await interaction.response.send_message("You are already in a run or hosting one.", ephemeral=True)
+        return
+    place = await run_manager.join_or_wait(run.runner_id, user.id)
+    if place == 0:
+        # Queued before the reply is awaited, so a leave or kick meanwhile is written after it
+        await db.add_attendee(run.db_id, user.id, user.name)
+        game_info_message = f"Game Name: {run.run_name}\nGame Password: {run.password}"
+        await outbound.submit(INTERACTION, lambda: interaction.response.send_message(content=game_info_message, ephemeral=True), REPLY)
+        ack_timings.record("join", started)
+    elif place:
+        await interaction.response.send_message(f"The run is full, so you're #{place} on its waitlist. You'll get a DM with the game info when a seat opens; /unqueue to stop waiting.", ephemeral=True)
+        ack_timings.record("join", started)
+    else:
+        await interaction.response.send_message("The run and its waitlist are full.", ephemeral=True)
+
+async def leave_run(interaction: discord.Interaction, runner_id: int):
+    run = run_manager.active_runs.get(runner_id)
+    if not run:
+        await interaction.response.send_message("The run no longer exists.", ephemeral=True)
+        return
+    user = interaction.user
+    if user.id in run.attendees:
+        if await run_manager.remove_attendee(run.runner_id, user.id):
+            await db.remove_attendee(run.db_id, user.id)
+            game_info_message = f"Run has been left!"
             await interaction.response.send_message(content=game_info_message, ephemeral=True)
-            channel = bot.get_channel(run.get_realm())
-            if available_spots > 0:
-                view = JoinRunView(runner=run.runner, timeout=850)
-                message = await channel.send(f"{user.mention} has been added to {run.runner.mention}'s {run.ladder} {run.type} run. There are {available_spots} spots left.", view=view)
-                view.message = message
-            else:
-                await channel.send(f"{user.mention} has been added to {run.runner.mention}'s {run.ladder} {run.type} run. There are {available_spots} spots left.")
-        else:
-            await interaction.response.send_message("The run is full.", ephemeral=True)
-
-    async def on_timeout(self):
-        for item in self.children:
-            item.disabled = True
-        if self.message:
-            await self.message.edit(view=self)
-
-
-class LeaveRunView(discord.ui.View):
-    def __init__(self, runner: discord.Member, timeout=850):
-        super().__init__(timeout=timeout)
-        self.runner = runner
-        self.message = None
-        leave_button = discord.ui.Button(style=discord.ButtonStyle.red, label="Leave Run")
-        leave_button.callback = self.leave_callback
-        self.add_item(leave_button)
-
-    async def leave_callback(self, interaction: discord.Interaction):
-        run = run_manager.get_run(self.runner)
-        if not run:
-            await interaction.response.send_message("The run no longer exists.", ephemeral=True)
-            return
-        user = interaction.user
-        if user in run.attendees:
-            if await run_manager.remove_attendee(self.runner, user):
-                await db.remove_attendee(self.runner.id, user.name)
-                game_info_message = f"Run has been left!"
-                await interaction.response.send_message(content=game_info_message, ephemeral=True)
-                available_spots = 7 - len(run.attendees)
-                channel = bot.get_channel(run.get_realm())
-                view = JoinRunView(runner=run.runner, timeout=850)
-                message = await channel.send(f"{user.mention} has left {run.runner.mention}'s {run.ladder} {run.type} run. There are {available_spots} spots left.", view=view)
-                view.message = message
-        else:
-            await interaction.response.send_message("You aren't currently in this run. If you are the runner, use /end instead.", ephemeral=True)
-
-    async def on_timeout(self):
-        for item in self.children:
-            item.disabled = True
-        if self.message:
-            await self.message.edit(view=self)
+        else:  # left, was kicked or the run ended while waiting for the lock
+            await interaction.response.send_message("You aren't in this run.", ephemeral=True)
+    else:
+        await interaction.response.send_message("You aren't currently in this run. If you are the runner, use /end instead.", ephemeral=True)
+
+async def announce(channel_id: int | None, content: str, **kwargs):
+    """Posts to a realm channel through the outbound queue and waits, so a failed send fails the job that made it."""
+    await outbound.send(bot.get_channel(channel_id), content, **kwargs)
+
+async def direct_message(member_id: int, content: str):
+    """DMs a member through the outbound queue; members who don't take DMs from the server are skipped."""
+    user = bot.get_user(member_id) or await bot.fetch_user(member_id)
+    try:
+        await outbound.submit(None, lambda: user.send(content), REPLY)
+    except discord.Forbidden:
+        pass
+
+def seated_from_queue(run: Run, player_ids: list[int]):
+    jobs.spawn("queue", notify_seated(run, player_ids))
+
+async def notify_seated(run: Run, player_ids: list[int]):
+    guild = bot.get_guild(guild_ids[0])
+    for player_id in player_ids:
+        await db.add_attendee(run.db_id, player_id, member_name(guild, player_id))
+        await direct_message(player_id, f"A seat opened up for you in {mention(run.runner_id)}'s {run.ladder.label} {run.type.label} run!\n"
+                                        f"Game Name: {run.run_name}\nGame Password: {run.password}")
+
+async def queue_expired(player_id: int):
+    await direct_message(player_id, "No seat opened up in time, so you've been taken out of the queue. Use /queue to wait again.")
+
+def runs_message(page: RunsPage) -> tuple[discord.Embed, discord.ui.View]:
+    embed = discord.Embed(title=page.title, description=page.description or None)
+    for name, value in page.fields:
+        embed.add_field(name=name, value=value, inline=False)
+    embed.set_footer(text=page.footer)
+    buttons = [run_button(JOIN, runner_id, label) for label, runner_id in page.join]
+    if page.leave is not None:
+        buttons.append(run_button(LEAVE, page.leave))
+    buttons += [page_button(page.prev_state, "Previous"), page_button(page.next_state, "Next")]
+    return embed, run_buttons(*buttons)
+
+def runs_page(member_id: int, page: int, ladder: Ladder | None, run_type: RunType | None) -> tuple[discord.Embed, discord.ui.View]:
+    return runs_message(build_page(run_manager.active_runs.values(), run_manager.fragments, run_manager.get_run(member_id),
+                                   member_id, page, ladder, run_type))
+
+async def turn_runs_page(interaction: discord.Interaction, state: int):
+    embed, view = runs_page(interaction.user.id, *parse_page_state(state))
+    await interaction.response.edit_message(embed=embed, view=view)
+
+run_buttons_dispatcher = ButtonDispatcher()
+run_buttons_dispatcher.register(JOIN, join_run)
+run_buttons_dispatcher.register(LEAVE, leave_run)
+run_buttons_dispatcher.register(PAGE, turn_runs_page)
+
+def render_board(channel_id: int) -> tuple[str, list]:
+    runs = [run for run in run_manager.active_runs.values() if run.get_realm() == channel_id]
+    if not runs:
+        return "There are no current runs. Use /host to start one!", []
+    guild = bot.get_guild(guild_ids[0])
+    lines = ["**Current Runs:**"]
+    buttons = []
+    for index, run in enumerate(runs):
+        waiting = len(run_manager.waitlists.get(run.runner_id, ()))
+        line = f"{mention(run.runner_id)} - {run.type.label} - {len(run.attendees)}/{MAX_ATTENDEES}" + (f" (full, {waiting} waiting)" if run.is_full else "")
+        if sum(len(l) + 1 for l in lines) + len(line) > 1900:
+            lines.append(f"...and {len(runs) - index} more, see /runs")
+            break
+        lines.append(line)
+        if waiting < MAX_WAITLIST:
+            runner_name = member_name(guild, run.runner_id) or "run"
+            buttons.append((f"{'Wait for' if run.is_full else 'Join'} {runner_name} ({run.type.label})", run.runner_id))
+    return "\n".join(lines), buttons
 
 class MyModal(discord.ui.Modal):
     def __init__(self, *args, **kwargs) -> None:
@@ -342,29 +145,65 @@ class MyModal(discord.ui.Modal):
         self.stop()
 
 guild_ids = [1106132569914867776]
+METRICS_PORT = 9108  # Prometheus scrapes http://127.0.0.1:9108/metrics
 
 class RunsCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.restored = False
+        self.command_starts = {}  # interaction ID -> perf_counter() when the command started
+
+    @commands.Cog.listener()
+    async def on_connect(self):
+        if not self.restored:
+            self.restored = True
+            log.info("restored runs", extra={"runs": run_manager.restore()})
+            try:
+                await metrics.serve(port=METRICS_PORT)
+            except OSError as e:
+                log.warning("metrics endpoint not started", extra={"error": str(e)})
+            # kill -USR1 <pid> turns profiling on and off without Discord
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, lambda: jobs.spawn("profile", self.toggle_profiler()))
+
+    async def toggle_profiler(self):
+        log.info(await profiler.toggle())
+
+    async def cog_before_invoke(self, ctx):
+        # Runs in the command's own task, so its DB writes, jobs and sends all carry this context
+        eventlog.begin(ctx.command.qualified_name, ctx.interaction.id)
+        self.command_starts[ctx.interaction.id] = time.perf_counter()
+
+    async def cog_after_invoke(self, ctx):
+        started = self.command_starts.pop(ctx.interaction.id, None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            log.info("command", extra={"command": ctx.command.qualified_name, "user": ctx.author.id, "ms": round(elapsed * 1000, 1)})
+            metrics.observe("runs_command_seconds", elapsed, command=ctx.command.qualified_name)
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction):
+        await run_buttons_dispatcher.dispatch(interaction)
 
     @commands.Cog.listener()
     async def on_ready(self):
-        print('Ready!')
+        log.info("ready")
 
     @commands.slash_command(name="dynasty", description="Get a list of the commands for the Runs bot", guild_ids=guild_ids)
     async def dynasty(self, ctx):
         commands_string = '''
-These are the commands: /host /ng /runs /end /leave /add /kick /change_runner /advertise /rename /top_runners /top_participants /top_monthly_runners /top_monthly_participants /leaderboard
+These are the commands: /host /ng /runs /quickjoin /queue /unqueue /end /leave /add /kick /change_runner /advertise /rename /top_runners /top_participants /top_monthly_runners /top_monthly_participants /leaderboard
 /host starts a new game with a few options
 /broadcast will create a chat message tagging everyone in a game allowing you to send info
 /ng creates a new game
-/runs will show available and non-available runs with join buttons depending and YOUR game's info if you're joined
+/runs lists the current runs ten to a page, optionally just one ladder or run type, with join buttons and YOUR game's info if you're joined
+/quickjoin puts you in the fullest open run of the ladder and type you pick
+/queue waits for a seat in a run of up to three types and DMs you the game info when one opens; joining a full run puts you on its waitlist the same way; /unqueue stops waiting
 /end will close out an instance of a run and is for the host's use
 /leave will make you leave a tracked game only if you are a participant
 /add will allow you to add someone from the server to your run
 /kick will allow you to kick someone from your run except for the host
 /change_runner will allow the host to choose a new runner
-/advertise will show a join button dialogue in chat for your run
+/advertise will move the run board, with its join buttons, to the bottom of the channel
 /rename allows you to update your run name and password
 /top_hosts and top_participants are self explanatory
 /top_monthly_hosts /top_monthly_participants pull the top ten entries respectively from the last 30 days
@@ -374,27 +213,25 @@ These are the commands: /host /ng /runs /end /leave /add /kick /change_runner /a
 
     @commands.slash_command(name="advertise", description="Advertise your game.", guild_ids=guild_ids)
     async def advertise(self, ctx):
-        run = run_manager.get_run(ctx.author)
+        run = run_manager.get_run(ctx.author.id)
         if run:
-            view = JoinRunView(runner=run.runner, timeout=850)
-            channel = self.bot.get_channel(run.get_realm())
-            message = await channel.send(f"Join {run.type} runs on {run.ladder} hosted by {run.runner.mention}!", view=view)
-            view.message = message
+            run_manager.board.changed(run.get_realm(), bump=True)
+            await ctx.respond("Your run will be at the bottom of the run board in a moment.", ephemeral=True)
         else:
             await ctx.respond("You are not currently in a run.", ephemeral=True)
 
     @commands.slash_command(name="add", description="Add a player to your game.", guild_ids=guild_ids)
     async def add(self, ctx, player: Option(discord.Member, "Select a player to add.")):
-        run = run_manager.get_run(ctx.author)
-        if run and run.runner == ctx.author:
-            if await run_manager.is_player_in_run(player):
+        run = run_manager.get_run(ctx.author.id)
+        if run and run.runner_id == ctx.author.id:
+            if await run_manager.is_player_in_run(player.id):
                 await ctx.respond(f"{player.mention} is already in a run or hosting one.", ephemeral=True)
                 return
             if player == ctx.author:
                 await ctx.respond("You can't add yourself to your own run.", ephemeral=True)
                 return
-            if await run_manager.add_attendee(run.runner, player):
-                await db.add_attendee(run.runner.id, player.name)
+            if await run_manager.add_attendee(run.runner_id, player.id):
+                await db.add_attendee(run.db_id, player.id, player.name)
                 await ctx.respond(f"{player.mention} has been added to your run.", ephemeral=True)
             else:
                 await ctx.respond("Your run is full.", ephemeral=True)
@@ -403,42 +240,55 @@ These are the commands: /host /ng /runs /end /leave /add /kick /change_runner /a
 
     @commands.slash_command(name="rename", description="Change the game name and password of your run.", guild_ids=guild_ids)
     async def rename(self, ctx):
-        run = run_manager.get_run(ctx.author)
-        if not run or run.runner != ctx.author:
+        started = time.perf_counter()
+        run = run_manager.get_run(ctx.author.id)
+        if not run or run.runner_id != ctx.author.id:
             await ctx.respond("You are not currently hosting a run.", ephemeral=True)
             return
         modal = MyModal(title="Input for run")
         await ctx.send_modal(modal)
+        ack_timings.record("rename", started)
         await modal.wait()
-        run.run_name = modal.run_name
-        run.password = modal.password
-        await db.update_run_name(ctx.author.id, modal.run_name)
-        channel = self.bot.get_channel(run.get_realm())
-        await channel.send(f"{ctx.author.mention}'s game name and password have been updated!")
+        async with run_manager.locks(ctx.author.id):
+            if run_manager.active_runs.get(ctx.author.id) is not run:  # ended or handed over while the form was open
+                return
+            run.run_name = modal.run_name
+            run.password = modal.password
+        run_manager.snapshot.changed()
+        jobs.spawn("rename", self.renamed(run, ctx.author))
+
+    async def renamed(self, run: Run, runner: discord.Member):
+        await db.update_run_name(run.db_id, run.run_name)
+        await announce(run.get_realm(), f"{runner.mention}'s game name and password have been updated!")
 
     @commands.slash_command(name="change_runner", description="Transfer ownership of your run to another player.", guild_ids=guild_ids)
     async def change_runner(self, ctx, new_runner: Option(discord.Member, "Select a new runner.")):
-        if ctx.author not in run_manager.active_runs:
+        started = time.perf_counter()
+        if not run_manager.is_runner(ctx.author.id):
             await ctx.respond("You are not currently hosting a run.", ephemeral=True)
             return
         old_runner = ctx.author
-        run = run_manager.active_runs[old_runner]
-        await run_manager.change_runner(old_runner, new_runner)
-        await db.update_runner(old_runner.id, new_runner.id, new_runner.name)
-        if new_runner in run.attendees:
-            await db.remove_attendee(new_runner.id, new_runner.name)
-        channel = self.bot.get_channel(run.get_realm())
-        await channel.send(f"{old_runner.mention}'s run has been transferred! {new_runner.mention} is now the new host.")
+        run = run_manager.active_runs[old_runner.id]
+        was_attendee = new_runner.id in run.attendees
+        if not await run_manager.change_runner(old_runner.id, new_runner.id):
+            await ctx.respond(f"{new_runner.mention} is already in another run.", ephemeral=True)
+            return
+        await db.update_runner(run.db_id, new_runner.id, new_runner.name)
+        if was_attendee:
+            await db.remove_attendee(run.db_id, new_runner.id)
+        await ctx.respond(f"{new_runner.mention} is now the host of your run.", ephemeral=True)
+        ack_timings.record("change_runner", started)
+        jobs.spawn("change_runner", announce(run.get_realm(), f"{old_runner.mention}'s run has been transferred! {new_runner.mention} is now the new host."))
 
     @commands.slash_command(name="kick", description="Kick a player from your game.", guild_ids=guild_ids)
     async def kick(self, ctx, player: Option(discord.Member, "Select a player to kick.")):
-        run = run_manager.get_run(ctx.author)
-        if run and run.runner == ctx.author:
+        run = run_manager.get_run(ctx.author.id)
+        if run and run.runner_id == ctx.author.id:
             if player == ctx.author:
                 await ctx.respond("You can't kick yourself.", ephemeral=True)
                 return
-            if await run_manager.remove_attendee(run.runner, player):
-                await db.remove_attendee(run.runner.id, player.name)
+            if await run_manager.remove_attendee(run.runner_id, player.id):
+                await db.remove_attendee(run.db_id, player.id)
                 await ctx.respond(f"{player.mention} has been kicked from your run.", ephemeral=True)
             else:
                 await ctx.respond(f"{player.mention} is not in your run.", ephemeral=True)
@@ -447,172 +297,230 @@ These are the commands: /host /ng /runs /end /leave /add /kick /change_runner /a
 
     @commands.slash_command(name="host", description="Host a new game", guild_ids=guild_ids)
     async def host(self, ctx,
-                   ladder: Option(str, "Ladder or non-ladder", choices=["Non-Ladder", "Ladder", "Non-Ladder Hardcore", "Ladder Hardcore"], required=True),
-                   run_type: Option(str, "What type of run is this?", choices=["Baal", "Pre-Tele Baal", "Chaos-Full Clear", "Chaos-Seal Pop", "Cows", "Tombs", "Split-Tombs", "TZ", "GRush"], required=True)):
-        if await run_manager.is_player_in_run(ctx.author):
+                   ladder: Option(str, "Ladder or non-ladder", choices=list(LADDER_LABELS), required=True),
+                   run_type: Option(str, "What type of run is this?", choices=list(RUN_TYPE_LABELS), required=True)):
+        started = time.perf_counter()
+        if await run_manager.is_player_in_run(ctx.author.id):
             await ctx.respond("You are already hosting or in a run!", ephemeral=True)
             return
         modal = MyModal(title="Input for run")
         await ctx.send_modal(modal)
+        ack_timings.record("host", started)
         await modal.wait()
-        run = Run(ctx.author, ladder, run_type, modal.run_name, modal.password)
-        await run_manager.add_run(run)
-        await db.insert_run(run)
-        view = JoinRunView(runner=ctx.author, timeout=850)
-        channel = self.bot.get_channel(run.get_realm())
-        message = await channel.send(f"**`NEW RUN ALERT!`**\nJoin {run.type} runs on {run.ladder} hosted by {ctx.author.mention}!", view=view)
-        view.message = message
+        run = Run(ctx.author.id, Ladder.parse(ladder), RunType.parse(run_type), modal.run_name, modal.password)
+        try:
+            await run_manager.add_run(run)
+        except ValueError:  # joined a run while the form was open
+            await ctx.followup.send("You are already in a run!", ephemeral=True)
+            return
+        # insert_run only queues the write; the row ID comes back at once, before any
+        # notify_seated job for players add_run just seated from the queue gets to run
+        run.db_id = await db.insert_run(ctx.author.id, ctx.author.name, run.type.label, run.ladder.label, run.run_name, [], run.start_time)
+        view = run_buttons(run_button(JOIN, ctx.author.id))
+        jobs.spawn("host", announce(run.get_realm(), f"**`NEW RUN ALERT!`**\nJoin {run.type.label} runs on {run.ladder.label} hosted by {ctx.author.mention}!", view=view))
 
     @commands.slash_command(name="end", description="End a run", guild_ids=guild_ids)
     async def end(self, ctx):
-        if ctx.author in run_manager.active_runs:
-            channel = self.bot.get_channel(run_manager.active_runs[ctx.author].get_realm())
-            await run_manager.remove_run(ctx.author)
-            await channel.send(f"{ctx.author.mention} has ended the run.")
+        started = time.perf_counter()
+        # None when it expired, was handed over or ended while waiting for the locks
+        run = await run_manager.remove_run(ctx.author.id) if run_manager.is_runner(ctx.author.id) else None
+        if run:
+            await ctx.respond("Your run has ended.", ephemeral=True)
+            ack_timings.record("end", started)
+            jobs.spawn("end", announce(run.get_realm(), f"{ctx.author.mention} has ended the run."))
         else:
             await ctx.respond("You are not hosting a run.", ephemeral=True)
 
     @commands.slash_command(name="broadcast", description="Send a message tagging all your attendees.", guild_ids=guild_ids)
     async def broadcast(self, ctx, message: str):
-        run = run_manager.get_run(ctx.author)
+        run = run_manager.get_run(ctx.author.id)
         if run:
-            player_list = run.attendees.copy()
-            player_list.append(run.runner)
-            mention_list = [x.mention for x in player_list]
+            mention_list = [mention(member_id) for member_id in [*run.attendees, run.runner_id]]
             await ctx.respond(f"Broadcast to {','.join(mention_list)}\n\n{message}")
         else:
             await ctx.respond("You are not currently in a run.", ephemeral=True)
 
     @commands.slash_command(name="runs", description="Show current runs.", guild_ids=guild_ids)
-    async def runs(self, ctx):
+    async def runs(self, ctx,
+                   ladder: Option(str, "Only runs on this ladder", choices=list(LADDER_LABELS), required=False),
+                   run_type: Option(str, "Only runs of this type", choices=list(RUN_TYPE_LABELS), required=False)):
         if not run_manager.active_runs:
             await ctx.respond("There are no current runs.", ephemeral=True)
             return
-        message_parts = []
-        has_view = False
-        view = None
-        for runner, run in list(run_manager.active_runs.items()):
-            has_available_spots = len(run.attendees) < 7
-            if ctx.author in run.attendees or ctx.author == run.runner:
-                msg = f"Game Name: {run.run_name}\nGame Password: {run.password}\nRunner: {run.runner.name}\n# {run.ladder}\nType: {run.type}\n"
-            else:
-                msg = f"Runner: {run.runner.mention}\n# {run.ladder}\nType: {run.type}\n"
-            msg += "Attendees:\n"
-            for attendee in run.attendees:
-                msg += f"{attendee.mention}\n"
-            msg += "\n\n"
-            message_parts.append(msg)
-            if has_available_spots and not has_view:
-                view = JoinRunView(runner=runner, timeout=850)
-            if ctx.author in run.attendees and ctx.user is not runner:
-                view = LeaveRunView(runner=runner, timeout=850)
-        full_message = "".join(message_parts)
-        if view:
-            response = await ctx.respond(full_message, view=view, ephemeral=True)
-            view.message = response
+        embed, view = runs_page(ctx.author.id, 0, Ladder.parse(ladder) if ladder else None, RunType.parse(run_type) if run_type else None)
+        await ctx.respond(embed=embed, view=view, ephemeral=True)
+
+    @commands.slash_command(name="quickjoin", description="Join the fullest open run of a kind.", guild_ids=guild_ids)
+    async def quickjoin(self, ctx,
+                        ladder: Option(str, "Ladder or non-ladder", choices=list(LADDER_LABELS), required=True),
+                        run_type: Option(str, "What type of run?", choices=list(RUN_TYPE_LABELS), required=True)):
+        started = time.perf_counter()
+        if await run_manager.is_player_in_run(ctx.author.id):
+            await ctx.respond("You are already in a run or hosting one.", ephemeral=True)
+            return
+        run = await run_manager.quick_join(Ladder.parse(ladder), RunType.parse(run_type), ctx.author.id)
+        if run is None:
+            await ctx.respond(f"There are no open {run_type} runs on {ladder}. Use /host to start one!", ephemeral=True)
+            return
+        await db.add_attendee(run.db_id, ctx.author.id, ctx.author.name)
+        await ctx.respond(f"You joined {mention(run.runner_id)}'s run.\nGame Name: {run.run_name}\nGame Password: {run.password}", ephemeral=True)
+        ack_timings.record("quickjoin", started)
+
+    @commands.slash_command(name="queue", description="Wait for a seat in a run of one of the types you pick.", guild_ids=guild_ids)
+    async def queue(self, ctx,
+                    ladder: Option(str, "Ladder or non-ladder", choices=list(LADDER_LABELS), required=True),
+                    run_type: Option(str, "What type of run?", choices=list(RUN_TYPE_LABELS), required=True),
+                    second_type: Option(str, "Another type you'd take", choices=list(RUN_TYPE_LABELS), required=False),
+                    third_type: Option(str, "Another type you'd take", choices=list(RUN_TYPE_LABELS), required=False)):
+        started = time.perf_counter()
+        if await run_manager.is_player_in_run(ctx.author.id):
+            await ctx.respond("You are already in a run or hosting one.", ephemeral=True)
+            return
+        run_types = [RunType.parse(t) for t in (run_type, second_type, third_type) if t]
+        run = await run_manager.enqueue(ctx.author.id, Ladder.parse(ladder), run_types)
+        if run is None:
+            ahead = run_manager.queue.position(ctx.author.id) or 0
+            await ctx.respond(f"You're in the queue with {ahead} ahead of you. You'll get a DM with the game info when a seat opens; /unqueue to stop waiting.", ephemeral=True)
+            ack_timings.record("queue", started)
+            return
+        await db.add_attendee(run.db_id, ctx.author.id, ctx.author.name)
+        await ctx.respond(f"You joined {mention(run.runner_id)}'s run.\nGame Name: {run.run_name}\nGame Password: {run.password}", ephemeral=True)
+        ack_timings.record("queue", started)
+
+    @commands.slash_command(name="unqueue", description="Stop waiting for a seat.", guild_ids=guild_ids)
+    async def unqueue(self, ctx):
+        queued = run_manager.queue.cancel(ctx.author.id)
+        if run_manager.leave_waitlist(ctx.author.id) or queued:
+            await ctx.respond("You've stopped waiting for a seat.", ephemeral=True)
         else:
-            await ctx.respond(full_message, ephemeral=True)
+            await ctx.respond("You aren't waiting for a seat.", ephemeral=True)
 
     @commands.slash_command(name="leave", description="Leave a run.", guild_ids=guild_ids)
     async def leave(self, ctx):
-        run = run_manager.get_run(ctx.author)
+        run = run_manager.get_run(ctx.author.id)
         if not run:
             await ctx.respond("You are not part of any runs.", ephemeral=True)
             return
-        if run.runner == ctx.author:
+        if run.runner_id == ctx.author.id:
             await ctx.respond("You are the runner of this game! Use /end to end the game instead.", ephemeral=True)
             return
-        await run_manager.remove_attendee(run.runner, ctx.author)
-        await db.remove_attendee(run.runner.id, ctx.author.name)
-        spots_available = 7 - len(run.attendees)
-        view = JoinRunView(runner=run.runner, timeout=850)
-        channel = self.bot.get_channel(run.get_realm())
-        message = await channel.send(f"{ctx.author.mention} has left the {run.ladder} {run.type} run. There are {spots_available} spots available in {run.runner.mention}'s runs.", view=view)
-        view.message = message
+        if await run_manager.remove_attendee(run.runner_id, ctx.author.id):
+            await db.remove_attendee(run.db_id, ctx.author.id)
+            await ctx.respond(f"You have left {mention(run.runner_id)}'s {run.ladder.label} {run.type.label} run.", ephemeral=True)
+        else:  # the run changed hands or ended in the meantime
+            await ctx.respond("You are not part of any runs.", ephemeral=True)
 
     @commands.slash_command(name="ng", description="Increment your run", guild_ids=guild_ids)
     async def ng(self, ctx):
-        run = run_manager.get_run(ctx.author)
+        started = time.perf_counter()
+        run = run_manager.get_run(ctx.author.id)
         if not run:
             await ctx.respond("You are not in a run.", ephemeral=True)
             return
-        await run_manager.reset_timeout(run.runner)
-        new_name = await run_manager.increment_run_name(run.runner)
+        await run_manager.reset_timeout(run.runner_id)
+        new_name = await run_manager.increment_run_name(run.runner_id)
         if new_name:
-            run.start_time = datetime.datetime.now(datetime.UTC)
-            await db.insert_run(run)
+            run.start_time = int(time.time())
+            run.db_id = await db.insert_run(run.runner_id, member_name(ctx.guild, run.runner_id), run.type.label, run.ladder.label, new_name, attendee_names(run, ctx.guild), run.start_time)
             await ctx.respond(f"New run at: {new_name}", ephemeral=True)
+            ack_timings.record("ng", started)
         else:
             await ctx.respond("Failed to increment run name.", ephemeral=True)
 
     @commands.slash_command(name="top_hosts", description="Get top players who hosted the most runs", guild_ids=guild_ids)
     async def top_hosts(self, ctx):
-        result = await db.get_top_hosts()
-        if not result:
+        sections = await leaderboard_cache.get()
+        if not sections["all_time_hosts"]:
             await ctx.respond("No one has hosted any runs yet.", ephemeral=True)
             return
-        message = "**Top Hosts:**\n"
-        for index, (runner, total_runs) in enumerate(result, start=1):
-            message += f"`{index}. {runner}: Hosted {total_runs} Runs`\n"
-        await ctx.respond(message, ephemeral=True)
+        await ctx.respond("**Top Hosts:**\n" + sections["all_time_hosts"], ephemeral=True)
 
     @commands.slash_command(name="top_monthly_hosts", description="Get top players who hosted the most runs this past month.", guild_ids=guild_ids)
     async def top_monthly_hosts(self, ctx):
-        result = await db.get_top_hosts(last_month=True)
-        if not result:
+        sections = await leaderboard_cache.get()
+        if not sections["monthly_hosts"]:
             await ctx.respond("No one has hosted any runs yet.", ephemeral=True)
             return
-        message = "**Top Hosts for the Last 30 Days:**\n"
-        for index, (runner, total_runs) in enumerate(result, start=1):
-            message += f"`{index}. {runner}: Hosted {total_runs} Runs`\n"
-        await ctx.respond(message, ephemeral=True)
+        await ctx.respond("**Top Hosts for the Last 30 Days:**\n" + sections["monthly_hosts"], ephemeral=True)
 
     @commands.slash_command(name="top_participants", description="Get top players who participated in the most runs", guild_ids=guild_ids)
     async def top_participants(self, ctx):
-        result = await get_top_participants(db)
-        if not result:
+        sections = await leaderboard_cache.get()
+        if not sections["all_time_participants"]:
             await ctx.respond("No one has participated in any runs yet.", ephemeral=True)
             return
-        message = "**Top Participants:**\n"
-        for index, (participant, count) in enumerate(result, start=1):
-            message += f"`{index}. {participant}: Participated in {count} Runs`\n"
-        await ctx.respond(message, ephemeral=True)
+        await ctx.respond("**Top Participants:**\n" + sections["all_time_participants"], ephemeral=True)
 
     @commands.slash_command(name="top_monthly_participants", description="Get top players who participated in the most runs this month", guild_ids=guild_ids)
     async def top_monthly_participants(self, ctx):
-        result = await get_top_participants(db, last_month=True)
-        if not result:
+        sections = await leaderboard_cache.get()
+        if not sections["monthly_participants"]:
             await ctx.respond("No one has participated in any runs yet.", ephemeral=True)
             return
-        message = "**Top Participants in the Last 30 Days:**\n"
-        for index, (participant, count) in enumerate(result, start=1):
-            message += f"`{index}. {participant}: Participated in {count} Runs`\n"
-        await ctx.respond(message, ephemeral=True)
+        await ctx.respond("**Top Participants in the Last 30 Days:**\n" + sections["monthly_participants"], ephemeral=True)
+
+    @commands.slash_command(name="rebuild_stats", description="Regenerate the leaderboard counters from the full run history.", guild_ids=guild_ids)
+    @discord.default_permissions(administrator=True)
+    async def rebuild_stats(self, ctx):
+        await ctx.defer(ephemeral=True)
+        await db.rebuild_stats()
+        await ctx.respond("Leaderboard stats rebuilt.", ephemeral=True)
 
     @commands.slash_command(name="leaderboard", description="Get top players who participated in/hosted the most runs this month and all-time", guild_ids=guild_ids)
     async def leaderboard(self, ctx):
-        monthly_hosts = await db.get_top_hosts(last_month=True)
-        all_time_hosts = await db.get_top_hosts()
-        monthly_participants = await get_top_participants(db, last_month=True)
-        all_time_participants = await get_top_participants(db)
-        message = "**Top Hosts for the Last 30 Days:**\n"
-        for index, (runner, total_runs) in enumerate(monthly_hosts, start=1):
-            message += f"`{index}. {runner}: Hosted {total_runs} Runs`\n"
-        message += "\n**Top Hosts All-Time:**\n"
-        for index, (runner, total_runs) in enumerate(all_time_hosts, start=1):
-            message += f"`{index}. {runner}: Hosted {total_runs} Runs`\n"
-        message += "\n**Top Participants in the Last 30 Days:**\n"
-        for index, (participant, count) in enumerate(monthly_participants, start=1):
-            message += f"`{index}. {participant}: Participated in {count} Runs`\n"
-        message += "\n**Top Participants All-Time:**\n"
-        for index, (participant, count) in enumerate(all_time_participants, start=1):
-            message += f"`{index}. {participant}: Participated in {count} Runs`\n"
-        await ctx.respond(message, ephemeral=True)
-
-db = Database()
+        sections = await leaderboard_cache.get()
+        await ctx.respond(sections["leaderboard"], ephemeral=True)
+
+    @commands.slash_command(name="botstats", description="Show the bot's live counts and its slowest commands, locks and queries.", guild_ids=guild_ids)
+    @discord.default_permissions(administrator=True)
+    async def botstats(self, ctx):
+        await ctx.respond(report(metrics), ephemeral=True)
+
+    @commands.slash_command(name="profile", description="Start or stop profiling the bot's event loop, threads and queries.", guild_ids=guild_ids)
+    @discord.default_permissions(administrator=True)
+    async def profile(self, ctx, action: Option(str, "start or stop", choices=["start", "stop"], required=True)):
+        if action == "start":
+            profiler.start()
+            await ctx.respond(f"Profiling until /profile stop. Blocks of the event loop over {profiler.block_threshold * 1000:.0f}ms "
+                              f"and queries over {profiler.slow_query_threshold * 1000:.0f}ms are kept.", ephemeral=True)
+        else:
+            await ctx.defer(ephemeral=True)
+            await ctx.respond(await profiler.stop() or "The profiler isn't running.", ephemeral=True)
+
+metrics = Metrics()
+db = Database(metrics=metrics)
+profiler = Profiler(db)
+outbound = Outbound()
+jobs = Jobs()
+ack_timings = AckTimings()
+leaderboard_cache = LeaderboardCache(db)
 run_manager = RunManager()
+run_manager.registry_lock = timed_locks(metrics, "registry")()
+run_manager.locks = RunLocks(timed_locks(metrics, "run"))
 TOKEN = "..."
 intents = discord.Intents.all()
 bot = commands.Bot(intents=intents)
+run_manager.board = RunBoard(bot, render_board, outbound)
+run_manager.fragments = RunFragments(run_manager.waitlists)
+run_manager.on_seated = seated_from_queue
+run_manager.queue.on_expire = queue_expired
+run_buttons_dispatcher.metrics = metrics
+add_service_gauges(metrics, db, outbound, jobs, ack_timings)
+metrics.gauge("runs_active_runs", "Live runs", lambda: len(run_manager.active_runs))
+metrics.gauge("runs_seated_players", "Runners and attendees of live runs", lambda: len(run_manager.players))
+metrics.gauge("runs_waitlisted_players", "Players on a full run's waitlist", lambda: len(run_manager.waitlisted))
+metrics.gauge("runs_queued_players", "Players in the matchmaking queue", lambda: len(run_manager.queue))
+metrics.gauge("runs_pending_timers", "Scheduled run expiries, queue expiries and board edits", lambda: {
+    "run_expiry": len(run_manager.expiry), "queue_expiry": len(run_manager.queue.expiry), "board_edit": len(run_manager.board.tasks)}, label="kind")
+# Run buttons are stateless (see buttons.run_buttons), so this is mostly the /host and /rename forms still open
+metrics.gauge("runs_live_views", "Views and modals the client is still listening on", lambda: {
+    "view": len(bot._connection._view_store._views), "message_view": len(bot._connection._view_store._synced_message_views),
+    "modal": len(bot._connection._modal_store._modals)}, label="kind")
 bot.add_cog(RunsCog(bot))
-bot.run(TOKEN)
+
+if __name__ == "__main__":  # bench/bot_suite.py imports the cog without connecting
+    log_writer = eventlog.setup()
+    bot.run(TOKEN)
+    run_manager.snapshot.save()
+    db.close()
+    log_writer.stop()
@@ -1,63 +1,35 @@
 import asyncio
+import logging
+import signal
 import discord
-import re
-import functools
-import sqlite3
 from discord.ext import commands
 from discord.commands import Option
-from collections import Counter
-import datetime
-
-conn = sqlite3.connect("runs.db")
-cursor = conn.cursor()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS runs (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    runner_id INTEGER,
-    runner_name TEXT,
-    type TEXT,
-    ladder TEXT,
-    run_name TEXT,
-    attendees TEXT,
-    start_time TIMESTAMP
-);
-""")
-
-def get_realm(run):
-    HARDCORE_LAD = 1356339382323249312
-    HARDCORE_NONLAD = 1337609082290573404
-    SOFTCORE_LAD = 1337608997997510732
-    SOFTCORE_NONLAD = 1337608670661316678
-
-    if run['ladder'] == "Non-Ladder":
-        return SOFTCORE_NONLAD
-    elif run['ladder'] == "Ladder":
-        return SOFTCORE_LAD
-    elif run['ladder'] == "Non-Ladder Hardcore":
-        return HARDCORE_NONLAD
-    elif run['ladder'] == "Ladder Hardcore":
-        return HARDCORE_LAD
-    else:
-        return False
-
-conn.commit()
-
-class JoinRunView(discord.ui.View):
-    def __init__(self, run_id, timeout=850):  # Max timeout = 15 minutes
-        super().__init__(timeout=timeout)
-        self.run_id = run_id
-        self.message = None  # Store the message reference
-
-        join_button = discord.ui.Button(style=discord.ButtonStyle.green, label="Join Run")
-        join_button.callback = functools.partial(join_run_callback, run_id=self.run_id)
-        self.add_item(join_button)
-
-    async def on_timeout(self):
-        for item in self.children:
-            item.disabled = True  # Disable buttons
-        if self.message:
-            await self.message.edit(view=self)
+import time
+from database import Database
+import eventlog
+from leaderboard import LeaderboardCache
+from scheduler import ExpiryScheduler
+from board import RunBoard
+from buttons import JOIN, PAGE, ButtonDispatcher, page_button, run_button, run_buttons
+from outbound import INTERACTION, REPLY, Outbound
+from jobs import AckTimings, Jobs
+from metrics import Metrics, add_service_gauges, report, timed_locks
+from profiler import Profiler
+from snapshot import Snapshot
+from matchmaking import MatchQueue
+from runlist import RunFragments, build_page, parse_page_state
+from runs import LADDER_LABELS, MAX_ATTENDEES, MAX_WAITLIST, RUN_TYPE_LABELS, SNAPSHOT_FORMAT, Ladder, OpenRuns, Run, RunLocks, RunType, member_name, mention, next_run_name
+
+log = logging.getLogger("runs.bot")
+log_writer = eventlog.setup()
+metrics = Metrics()
+db = Database(metrics=metrics)
+profiler = Profiler(db)
+outbound = Outbound()
+jobs = Jobs()
+ack_timings = AckTimings()
+add_service_gauges(metrics, db, outbound, jobs, ack_timings)
+leaderboard_cache = LeaderboardCache(db)
 
 class MyModal(discord.ui.Modal):
     def __init__(self, *args, **kwargs) -> None:
@@ -77,77 +49,268 @@ class MyModal(discord.ui.Modal):
         await interaction.response.send_message('Run Info Established!')
         self.stop()
 
-active_runs = {}
-runs_num = 0
-run_timeouts = {}
-cursor_lock = asyncio.Lock()
-active_runs_lock = asyncio.Lock()
-run_timeouts_lock = asyncio.Lock()
+active_runs = {}  # runner ID -> Run
+player_runs = {}  # runner or attendee ID -> runner ID of their run
+active_runs_lock = timed_locks(metrics, "registry")()  # creating, ending and transferring runs
+run_locks = RunLocks(timed_locks(metrics, "run"))  # attendee and name changes, one lock per runner ID
+open_runs = OpenRuns()  # runs with a free seat, for /quickjoin
+waitlists = {}  # runner ID -> player IDs waiting for a seat in that full run, in order
+waitlisted = {}  # player ID -> runner ID of the run they wait for
+run_fragments = RunFragments(waitlists)  # /runs text per run, dropped by runs_changed
 
 TOKEN = "..."
 intents = discord.Intents.all()
 bot = commands.Bot(intents=intents)
 guild_ids = [1106132569914867776]
-
-async def remove_run_after_timeout(run_owner):
-    await asyncio.sleep(2 * 60 * 60)  # 1.5 hours
-#    await asyncio.sleep(10)  # 10 seconds
-    async with active_runs_lock:
-        if run_owner in active_runs:
-            del active_runs[run_owner]
-            if run_owner in run_timeouts:
-                del run_timeouts[run_owner]
+METRICS_PORT = 9108  # Prometheus scrapes http://127.0.0.1:9108/metrics
+
+async def remove_run_after_timeout(runner_id):
+    async with active_runs_lock, run_locks(runner_id):
+        if runner_id in active_runs:
+            run_info = drop_run(runner_id)
+            runs_changed(run_info)
+
+run_timeouts = ExpiryScheduler(remove_run_after_timeout)  # keyed by runner ID, 2 hours after the last activity
+
+def dump_runs():
+    now = time.time()
+    return {'format': SNAPSHOT_FORMAT,
+            'runs': [{**run_info.to_dict(), 'waitlist': list(waitlists.get(runner_id, ())),
+                      'expires_at': now + (run_timeouts.remaining(runner_id) or 0)}
+                     for runner_id, run_info in active_runs.items()]}
+
+run_snapshot = Snapshot(dump_runs)
+
+def restore_runs():
+    # Reload the runs saved by the last snapshot, dropping any that expired while the bot was down
+    data = run_snapshot.load()
+    if not data or data.get('format') != SNAPSHOT_FORMAT:
+        return 0
+    now = time.time()
+    for saved in data['runs']:
+        if saved['expires_at'] <= now:
+            continue
+        run_info = Run.from_dict(saved)
+        active_runs[run_info.runner_id] = run_info
+        for member_id in run_info.members():
+            player_runs[member_id] = run_info.runner_id
+        for player_id in saved.get('waitlist', ()):
+            waitlists.setdefault(run_info.runner_id, {})[player_id] = None
+            waitlisted[player_id] = run_info.runner_id
+        open_runs.update(run_info)
+        run_timeouts.touch(run_info.runner_id, saved['expires_at'] - now)
+        run_board.changed(run_info.get_realm())
+    return len(active_runs)
+
+def drop_run(runner_id):
+    run_info = active_runs.pop(runner_id)
+    for member_id in run_info.members():
+        player_runs.pop(member_id, None)
+    for player_id in waitlists.pop(runner_id, ()):
+        del waitlisted[player_id]
+    open_runs.discard(runner_id)
+    run_locks.discard(runner_id)
+    return run_info
+
+def claim(member_id, runner_id):
+    # The member was just seated in or given this run; drop whatever else they were waiting for
+    player_runs[member_id] = runner_id
+    match_queue.cancel(member_id)
+    leave_waitlist(member_id)
+
+def leave_waitlist(member_id):
+    runner_id = waitlisted.pop(member_id, None)
+    if runner_id is None:
+        return False
+    waitlist = waitlists[runner_id]
+    del waitlist[member_id]
+    if not waitlist:
+        del waitlists[runner_id]
+    runs_changed(active_runs[runner_id])
+    return True
+
+async def add_to_run(run_info, member_id):
+    # Claims the player under the run's lock; False if meanwhile the run ended or was transferred,
+    # filled up, or the player joined another run
+    runner_id = run_info.runner_id
+    async with run_locks(runner_id):
+        if active_runs.get(runner_id) is not run_info or member_id in player_runs or not run_info.add(member_id):
+            return False
+        claim(member_id, runner_id)
+        open_runs.update(run_info)
+        run_timeouts.touch(runner_id)
+        runs_changed(run_info)
+    return True
+
+async def join_or_wait(run_info, member_id):
+    # Like add_to_run, but a full run takes the member onto the back of its waitlist instead.
+    # 0 if they were seated, their place on the waitlist if they wait, None if the run is gone,
+    # they joined another run, or the waitlist is full.
+    runner_id = run_info.runner_id
+    async with run_locks(runner_id):
+        if active_runs.get(runner_id) is not run_info or member_id in player_runs:
+            return None
+        if run_info.add(member_id):
+            claim(member_id, runner_id)
+            open_runs.update(run_info)
+            run_timeouts.touch(runner_id)
+            runs_changed(run_info)
+            return 0
+        waitlist = waitlists.get(runner_id, {})
+        if member_id not in waitlist:
+            if not run_info.is_full or len(waitlist) >= MAX_WAITLIST:
+                return None
+            leave_waitlist(member_id)
+            waitlists[runner_id] = waitlist
+            waitlist[member_id] = None
+            waitlisted[member_id] = runner_id
+            runs_changed(run_info)
+        return list(waitlist).index(member_id) + 1
+
+async def remove_from_run(run_info, member_id):
+    runner_id = run_info.runner_id
+    async with run_locks(runner_id):
+        if active_runs.get(runner_id) is not run_info or not run_info.discard(member_id):
+            return False
+        del player_runs[member_id]
+        open_runs.update(run_info)
+        seat_waiting(run_info)
+        runs_changed(run_info)
+    return True
+
+async def join_fullest(ladder, run_types, member_id):
+    # add_to_run claims the seat under the run's lock; if the run filled up or ended while
+    # we waited for it, the index has moved on and the next best run is tried
+    while member_id not in player_runs:
+        found = [runner_id for runner_id in (open_runs.best(ladder, run_type) for run_type in run_types) if runner_id is not None]
+        if not found:
+            return None
+        run_info = active_runs[max(found, key=lambda r: len(active_runs[r].attendees))]
+        if await add_to_run(run_info, member_id):
+            return run_info
+    return None
+
+def seat_waiting(run_info):
+    # Fills free seats from the run's waitlist, then from the matchmaking queue; called with
+    # the run's lock held right after it gained one. The players seated get the game info by DM.
+    seated = []
+    waitlist = waitlists.get(run_info.runner_id, ())
+    while not run_info.is_full:
+        player_id = next(iter(waitlist), None)
+        if player_id is None:
+            player_id = match_queue.pop(run_info.ladder, run_info.type)
+        if player_id is None:
+            break
+        run_info.add(player_id)
+        claim(player_id, run_info.runner_id)
+        seated.append(player_id)
+    if seated:
+        open_runs.update(run_info)
+        run_timeouts.touch(run_info.runner_id)
+        jobs.spawn('queue', notify_seated(run_info, seated))
+
+async def direct_message(member_id, content):
+    # DMs through the outbound queue; members who don't take DMs from the server are skipped
+    user = bot.get_user(member_id) or await bot.fetch_user(member_id)
+    try:
+        await outbound.submit(None, lambda: user.send(content), REPLY)
+    except discord.Forbidden:
+        pass
+
+async def notify_seated(run_info, player_ids):
+    guild = bot.get_guild(guild_ids[0])
+    for player_id in player_ids:
+        await db.add_attendee(run_info.db_id, player_id, member_name(guild, player_id))
+        await direct_message(player_id, f"A seat opened up for you in {mention(run_info.runner_id)}'s {run_info.ladder.label} {run_info.type.label} run!\n"
+                                        f"Game Name: {run_info.run_name}\nGame Password: {run_info.password}")
+
+async def queue_expired(player_id):
+    await direct_message(player_id, "No seat opened up in time, so you've been taken out of the queue. Use /queue to wait again.")
+
+match_queue = MatchQueue(queue_expired)  # players waiting for a seat, 30 minutes at most
+
+def attendee_names(run_info, guild):
+    # (ID, cached name) for each attendee; None keeps the name runs.db already has
+    return [(a, member_name(guild, a)) for a in run_info.attendees]
+
+async def announce(run_info, content, **kwargs):
+    # Posts through the outbound queue and waits, so a failed send fails the job that made it
+    await outbound.send(bot.get_channel(run_info.get_realm()), content, **kwargs)
+
+def runs_changed(run_info):
+    run_snapshot.changed()
+    run_fragments.discard(run_info.runner_id)
+    run_board.changed(run_info.get_realm())
+
+def render_board(channel_id):
+    runs = [run_info for run_info in active_runs.values() if run_info.get_realm() == channel_id]
+    if not runs:
+        return "There are no current runs. Use /host to start one!", []
+    guild = bot.get_guild(guild_ids[0])
+    lines = ["**Current Runs:**"]
+    buttons = []
+    for index, run_info in enumerate(runs):
+        waiting = len(waitlists.get(run_info.runner_id, ()))
+        line = f"{mention(run_info.runner_id)} - {run_info.type.label} - {len(run_info.attendees)}/{MAX_ATTENDEES}" + (f" (full, {waiting} waiting)" if run_info.is_full else "")
+        if sum(len(l) + 1 for l in lines) + len(line) > 1900:
+            lines.append(f"...and {len(runs) - index} more, see /runs")
+            break
+        lines.append(line)
+        if waiting < MAX_WAITLIST:
+            buttons.append((f"{'Wait for' if run_info.is_full else 'Join'} {member_name(guild, run_info.runner_id) or 'run'} ({run_info.type.label})", run_info.runner_id))
+    return "\n".join(lines), buttons
+
+run_board = RunBoard(bot, render_board, outbound)
+
+restored = False
+
+@bot.listen('on_connect')
+async def restore_on_connect():
+    global restored
+    if not restored:
+        restored = True
+        log.info("restored runs", extra={"runs": restore_runs()})
+        try:
+            await metrics.serve(port=METRICS_PORT)
+        except OSError as e:
+            log.warning("metrics endpoint not started", extra={"error": str(e)})
+        # kill -USR1 <pid> turns profiling on and off without Discord
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, lambda: jobs.spawn("profile", toggle_profiler()))
+
+async def toggle_profiler():
+    log.info(await profiler.toggle())
+
+command_starts = {}  # interaction ID -> perf_counter() when the command started
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    # Runs in the command's own task, so its DB writes, jobs and sends all carry this context
+    eventlog.begin(ctx.command.qualified_name, ctx.interaction.id)
+    command_starts[ctx.interaction.id] = time.perf_counter()
+
+@bot.after_invoke
+async def record_command_time(ctx):
+    started = command_starts.pop(ctx.interaction.id, None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        log.info("command", extra={"command": ctx.command.qualified_name, "user": ctx.author.id, "ms": round(elapsed * 1000, 1)})
+        metrics.observe("runs_command_seconds", elapsed, command=ctx.command.qualified_name)
 
 @bot.event
 async def on_ready():
-    print('Ready!')
-
-def add_player_to_run_db(runner_id, attendee):
-    global conn
-    cursor.execute("SELECT * FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1", (runner_id,))
-    db_result = cursor.fetchone()
-    if db_result:
-        my_attendees = db_result[6].split(",")
-    else:
-        my_attendees = []
-    my_attendees.append(attendee)
-    my_attendees = ",".join(my_attendees)
-#    print(my_attendees)
-    cursor.execute("""
-        UPDATE runs
-        SET attendees = ?
-        WHERE id = (SELECT id FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1)
-    """, (my_attendees, runner_id))
-
-    conn.commit()
-    return
-
-def del_player_from_run_db(runner_id, attendee):
-    global conn
-    cursor.execute("SELECT * FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1", (runner_id,))
-    db_result = cursor.fetchone()
-    if db_result:
-        my_attendees = db_result[6].split(",")
-        my_attendees.remove(attendee)
-        my_attendees = ",".join(my_attendees)
-        cursor.execute("""
-            UPDATE runs
-            SET attendees = ?
-            WHERE id = (SELECT id FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1)
-        """, (my_attendees, runner_id))
-
-        conn.commit()
-    return
+    log.info("ready")
 
 @bot.slash_command(name="command_help", description="Get a list of the commands for the Runs bot", guild_ids=guild_ids)
 async def command_help(ctx):
     commands_string = '''
-These are the commands: /host /ng /runs /end /leave /add /kick /change_runner /rename /top_runners /top_participants /top_monthly_runners /top_monthly_participants /leaderboard
+These are the commands: /host /ng /runs /quickjoin /queue /unqueue /end /leave /add /kick /change_runner /rename /top_runners /top_participants /top_monthly_runners /top_monthly_participants /leaderboard
 
 /host starts a new game with a few options
 /broadcast will create a chat message tagging everyone in a game allowing you to send info
 /ng creates a new game
-/runs will show available and non-available runs with join buttons depending and YOUR game's info if you're joined
+/runs lists the current runs ten to a page, optionally just one ladder or run type, with join buttons and YOUR game's info if you're joined
+/quickjoin puts you in the fullest open run of the ladder and type you pick
+/queue waits for a seat in a run of up to three types and DMs you the game info when one opens; joining a full run puts you on its waitlist the same way; /unqueue stops waiting
 /end will close out an instance of a run and is for the host's use
 /leave will make you leave a tracked game only if you are a participant
 /add will allow you to add someone from the server to your run
@@ -167,10 +330,8 @@ async def advertise(ctx):
     player = ctx.author
     run = return_run(player)
     if run:
-        view = JoinRunView(run_id=ctx.author, timeout=850)
-        channel = bot.get_channel(get_realm(active_runs[run['runner']]))
-        message = await channel.send(f"Join {run['type']} runs on {run['ladder']} hosted by {run['runner'].mention}!", view=view)
-        view.message = message
+        run_board.changed(run.get_realm(), bump=True)
+        await ctx.respond("Your run will be at the bottom of the run board in a moment.", ephemeral=True)
     else:
         await ctx.respond("You are not currently in a run.", ephemeral=True)
 
@@ -178,311 +339,342 @@ async def advertise(ctx):
 async def add(ctx, player: Option(discord.Member, "Select a player to add.")):
     global active_runs
     user = ctx.author
-    if user in active_runs.keys():
-        run_info = active_runs[user]
-        if len(run_info['attendees']) < 7:
-            if player != user and player not in run_info['attendees'] and player not in active_runs.keys():
-                async with active_runs_lock:
-                    run_info['attendees'].append(player)
-                async with cursor_lock:
-                    add_player_to_run_db(user.id, player.name)
-                await ctx.respond(f"{player.mention} has been added to your run.", ephemeral=True)
+    if user.id in active_runs.keys():
+        run_info = active_runs[user.id]
+        if not run_info.is_full:
+            if player != user and player.id not in player_runs:
+                if await add_to_run(run_info, player.id):
+                    await db.add_attendee(run_info.db_id, player.id, player.name)
+                    await ctx.respond(f"{player.mention} has been added to your run.", ephemeral=True)
+                else:
+                    await ctx.respond(f"{player.mention} couldn't be added; the run is full or they just joined another.", ephemeral=True)
             elif player == user:
                 try:
                     await ctx.respond("You can't add yourself to your own run.", ephemeral=True)
                 except:
                     await ctx.followup.send("You can't add yourself to your own run.", ephemeral=True)
             else:
-                await ctx.respond(f"{player.mention} is already in your run.", ephemeral=True)
+                await ctx.respond(f"{player.mention} is already in a run.", ephemeral=True)
         else:
             await ctx.respond("Your run is already full.", ephemeral=True)
+    elif user.id in player_runs:
+        runner_id = player_runs[user.id]
+        run_info = active_runs[runner_id]
+        if run_info.is_full:
+            await ctx.respond(f"Run is full.", ephemeral=True)
+        elif player.id in player_runs:
+            await ctx.respond(f"{player.mention} is already in a run.", ephemeral=True)
+        elif await add_to_run(run_info, player.id):
+            await db.add_attendee(run_info.db_id, player.id, player.name)
+            await ctx.respond(f"{player.mention} has been added to your run.", ephemeral=True)
+        else:
+            await ctx.respond(f"{player.mention} couldn't be added; the run is full or they just joined another.", ephemeral=True)
     else:
-        for run in active_runs.keys():
-            run_info = active_runs[run]
-            if len(run_info['attendees']) < 7:
-               if ctx.author in run_info['attendees'] and player not in run_info['attendees']:
-                    async with active_runs_lock:
-                        run_info['attendees'].append(player)
-                    async with cursor_lock:
-                        add_player_to_run_db(run.id, player.name)
-                    await ctx.respond(f"{player.mention} has been added to your run.", ephemeral=True)
-               else:
-                   await ctx.respond(f"{player.mention} is already in a run.", ephemeral=True)
-            else:
-                await ctx.respond(f"Run is full.", ephemeral=True)
+        await ctx.respond("You are not currently in a run.", ephemeral=True)
 
 
 @bot.slash_command(name="rename", description="Change the game name and password of your run.", guild_ids=guild_ids)
 async def rename(ctx):
     global active_runs
 
+    started = time.perf_counter()
     user = ctx.author
 
     # Check if the user is hosting a run
-    if user not in active_runs:
+    if user.id not in active_runs:
         await ctx.respond("You are not currently hosting a run.", ephemeral=True)
         return
 
     modal = MyModal(title="Input for run")
     await ctx.send_modal(modal)
+    ack_timings.record('rename', started)
     await modal.wait()
     # Update the run information in active_runs
-    async with active_runs_lock:
-        active_runs[user]['runs_name'] = modal.run_name
-        active_runs[user]['runs_password'] = modal.password
+    async with run_locks(user.id):
+        run_info = active_runs.get(user.id)
+        if run_info is None:  # ended or handed over while the form was open
+            return
+        run_info.run_name = modal.run_name
+        run_info.password = modal.password
+        runs_changed(run_info)
 
     # Update the database
-    async with cursor_lock:
-        cursor.execute("""
-            UPDATE runs
-            SET run_name = ?
-            WHERE runner_id = (SELECT runner_id FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1)
-        """, (modal.run_name, user.id))  # Reset attendees list if needed
-        conn.commit()
-
-    channel = bot.get_channel(get_realm(active_runs[user]))
+    await db.update_run_name(run_info.db_id, modal.run_name)
 
     # Send a confirmation message
-    await channel.send(f"{user.mention}'s game name and password have been updated!")
+    jobs.spawn('rename', announce(run_info, f"{user.mention}'s game name and password have been updated!"))
 
 @bot.slash_command(name="change_runner", description="Transfer ownership of your run to another player.", guild_ids=guild_ids)
 async def change_runner(ctx, 
                         new_runner: Option(discord.Member, "Select a new runner.")):
     global active_runs
+    started = time.perf_counter()
 
     user = ctx.author  # Current runner
 
     # Check if the user is hosting a run
-    if user not in active_runs.keys():
+    if user.id not in active_runs.keys():
         await ctx.respond("You are not currently hosting a run.", ephemeral=True)
         return
 
-    run_info = active_runs[user]
-
-    async with active_runs_lock:
-        active_runs[new_runner] = run_info  # Copy the run details to the new runner
-        del active_runs[user]  # Remove the old runner entry
-        active_runs[new_runner]['runner'] = new_runner  # Update the runner info
-        run_timeouts[ctx.author].cancel()
-        timeout_task = asyncio.create_task(remove_run_after_timeout(new_runner))
-        run_timeouts[new_runner] = timeout_task
-
-    async with cursor_lock:
-        cursor.execute("""
-            UPDATE runs
-            SET runner_id = ?, runner_name = ?
-            WHERE id = (SELECT id FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1)
-        """, (new_runner.id, new_runner.name, user.id))
-        conn.commit()
-
-    if new_runner in run_info['attendees']:
-        async with active_runs_lock:
-            run_info['attendees'].remove(new_runner)  # Remove old runner from attendees
+    async with active_runs_lock, run_locks(user.id):
+        run_info = active_runs.get(user.id)
+        if run_info is None:  # expired or ended while waiting for the locks
+            refusal = "You are not currently hosting a run."
+        elif player_runs.get(new_runner.id, user.id) != user.id:
+            refusal = f"{new_runner.mention} is already in another run."
+        else:
+            refusal = None
+            del active_runs[user.id]  # Remove the old runner entry
+            del player_runs[user.id]
+            open_runs.discard(user.id)
+            was_attendee = run_info.discard(new_runner.id)  # Remove new runner from attendees
+            run_info.runner_id = new_runner.id  # Update the runner info
+            active_runs[new_runner.id] = run_info
+            for member_id in run_info.members():
+                player_runs[member_id] = new_runner.id
+            waitlist = waitlists.pop(user.id, None)
+            if waitlist:
+                waitlists[new_runner.id] = waitlist
+                for player_id in waitlist:
+                    waitlisted[player_id] = new_runner.id
+            claim(new_runner.id, new_runner.id)
+            seat_waiting(run_info)  # the new runner's seat, if they were an attendee
+            open_runs.update(run_info)
+            run_locks.move(user.id, new_runner.id)
+            run_timeouts.cancel(user.id)
+            run_timeouts.touch(new_runner.id)
+            run_fragments.discard(user.id)
+            runs_changed(run_info)
+
+    if refusal is not None:
+        await ctx.respond(refusal, ephemeral=True)
+        return
 
-        async with cursor_lock:
-            del_player_from_run_db(new_runner.id, new_runner.name)  # Remove from DB attendees
+    await db.update_runner(run_info.db_id, new_runner.id, new_runner.name)
+    if was_attendee:
+        await db.remove_attendee(run_info.db_id, new_runner.id)  # Remove from DB attendees
 
-    channel = bot.get_channel(get_realm(run_info))
+    await ctx.respond(f"{new_runner.mention} is now the host of your run.", ephemeral=True)
+    ack_timings.record('change_runner', started)
 
-    await channel.send(f"{user.mention}'s run has been transferred! {new_runner.mention} is now the new host.")
+    jobs.spawn('change_runner', announce(run_info, f"{user.mention}'s run has been transferred! {new_runner.mention} is now the new host."))
 
 @bot.slash_command(name="kick", description="Kick a player from your game.", guild_ids=guild_ids)
 async def kick(ctx, player: Option(discord.Member, "Select a player to kick.")):
     global active_runs
     user = ctx.author
-    if user in active_runs.keys():
-        run_info = active_runs[user]
-        if player in run_info['attendees']:
-            async with active_runs_lock:
-                run_info['attendees'].remove(player)
-            async with cursor_lock:
-                del_player_from_run_db(user.id, player.name)
+    if user.id in active_runs.keys():
+        run_info = active_runs[user.id]
+        if await remove_from_run(run_info, player.id):
+            await db.remove_attendee(run_info.db_id, player.id)
             await ctx.respond(f"{player.mention} has been kicked from your run.", ephemeral=True)
             return
         else:
             await ctx.respond(f"{player.mention} is not in your run.", ephemeral=True)
             return
-    else:
-        for run in active_runs.keys():
-            run_info = active_runs[run]
-            if ctx.author in run_info['attendees'] and player in run_info['attendees']:
-                async with active_runs_lock:
-                    run_info['attendees'].remove(player)
-                async with cursor_lock:
-                    del_player_from_run_db(run.id, player.name)
-                await ctx.respond(f"{player.mention} has been kicked from your run.", ephemeral=True)
-                return
+    elif user.id in player_runs and player_runs.get(player.id) == player_runs[user.id] and player.id != player_runs[user.id]:
+        run_info = active_runs[player_runs[user.id]]
+        if await remove_from_run(run_info, player.id):
+            await db.remove_attendee(run_info.db_id, player.id)
+            await ctx.respond(f"{player.mention} has been kicked from your run.", ephemeral=True)
+            return
     await ctx.respond("Player is not in game.", ephemeral=True)
 
 @bot.slash_command(name="host", description="Host a new game", guild_ids=guild_ids)
 async def host(ctx,
-               ladder: Option(str, "Ladder or non-ladder", choices=["Non-Ladder", "Ladder", "Non-Ladder Hardcore", "Ladder Hardcore"], required=True),
-               type: Option(str, "What type of run is this?", choices=["Baal", "Pre-Tele Baal", "Chaos-Full Clear", "Chaos-Seal Pop", "Cows", "Tombs", "Split-Tombs", "TZ", "GRush"], required=True)):
+               ladder: Option(str, "Ladder or non-ladder", choices=list(LADDER_LABELS), required=True),
+               type: Option(str, "What type of run is this?", choices=list(RUN_TYPE_LABELS), required=True)):
     global active_runs
-    global runs_num
-    in_run = False
-    for runner in active_runs.values():
-        if ctx.author in runner['attendees']:
-            in_run = True
-    if ctx.author not in active_runs.keys() and in_run == False:
-        if runs_num > 999:
-            runs_num = 0
-        runs_num += 1
+    started = time.perf_counter()
+    if ctx.author.id not in player_runs:
         modal = MyModal(title="Input for run")
         await ctx.send_modal(modal)
+        ack_timings.record('host', started)
         await modal.wait()
+        run_info = Run(ctx.author.id, Ladder.parse(ladder), RunType.parse(type), modal.run_name, modal.password)
         async with active_runs_lock:
-            active_runs[ctx.author] = { 'ladder': ladder, 'type': type, 'runner': ctx.author,
-                                        'attendees': [], 'runs_num': runs_num,
-                                        'runs_name': modal.run_name, 'runs_password': modal.password, }
-        timeout_task = asyncio.create_task(remove_run_after_timeout(ctx.author))
-        async with run_timeouts_lock:
-            run_timeouts[ctx.author] = timeout_task
-
-        async with cursor_lock:
-            cursor.execute("""
-                INSERT INTO runs (runner_id, runner_name, type, ladder, run_name, attendees, start_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (ctx.author.id, ctx.author.name, type, ladder, modal.run_name, "", datetime.datetime.now(datetime.UTC)))
-
-            conn.commit()
-
-        view = JoinRunView(run_id=ctx.author, timeout=850)
-        channel = bot.get_channel(get_realm(active_runs[ctx.author]))
-        message = await channel.send(f"**`NEW RUN ALERT!`**\nJoin {type} runs on {ladder} hosted by {ctx.author.mention}!", view=view)
-        view.message = message
+            joined = ctx.author.id in player_runs  # joined a run while the form was open
+            if not joined:
+                active_runs[ctx.author.id] = run_info
+                claim(ctx.author.id, ctx.author.id)
+                open_runs.update(run_info)
+                run_timeouts.touch(ctx.author.id)
+                seat_waiting(run_info)
+                runs_changed(run_info)
+        if joined:
+            await ctx.followup.send("You are already in a run!", ephemeral=True)
+            return
+
+        # insert_run only queues the write; the row ID comes back at once, before any
+        # notify_seated job for players seat_waiting just seated gets to run
+        run_info.db_id = await db.insert_run(ctx.author.id, ctx.author.name, type, ladder, modal.run_name, [], run_info.start_time)
+
+        view = run_buttons(run_button(JOIN, ctx.author.id))
+        jobs.spawn('host', announce(run_info, f"**`NEW RUN ALERT!`**\nJoin {type} runs on {ladder} hosted by {ctx.author.mention}!", view=view))
     else:
         await ctx.respond("You are already hosting a run!", ephemeral=True)
 
 @bot.slash_command(name="end", description="End a run", guild_ids=guild_ids)
 async def end(ctx):
     global active_runs
-    global run_timeouts
-    if ctx.author in active_runs.keys():
-        channel = bot.get_channel(get_realm(active_runs[ctx.author]))
-        async with active_runs_lock:
-            del active_runs[ctx.author]
-        if ctx.author in run_timeouts:
-            async with run_timeouts_lock:
-                run_timeouts[ctx.author].cancel()
-                del run_timeouts[ctx.author]
-        await channel.send(f"{ctx.author.mention} has ended the run.")
+    started = time.perf_counter()
+    if ctx.author.id in active_runs.keys():
+        async with active_runs_lock, run_locks(ctx.author.id):
+            if ctx.author.id not in active_runs:  # expired, handed over or ended while waiting for the locks
+                run_info = None
+            else:
+                run_info = drop_run(ctx.author.id)
+                run_timeouts.cancel(ctx.author.id)
+                runs_changed(run_info)
+        if run_info is None:
+            await ctx.respond("No runs exist under your user.", ephemeral=True)
+            return
+        await ctx.respond("Your run has ended.", ephemeral=True)
+        ack_timings.record('end', started)
+        jobs.spawn('end', announce(run_info, f"{ctx.author.mention} has ended the run."))
         return
     else:
         await ctx.respond("No runs exist under your user.", ephemeral=True)
         return
 
 def return_run(player):
-    global active_runs
-    if player in active_runs.keys():
-        return active_runs[player]
-    for run in active_runs.values():
-        if player in run['attendees']:
-            return run
-    return False
+    runner_id = player_runs.get(player.id)
+    if runner_id is None:
+        return False
+    return active_runs[runner_id]
+
+def return_run_by_id(member_id):
+    return active_runs.get(player_runs.get(member_id))
 
 @bot.slash_command(name="broadcast", description="Send a message tagging all your attendees.", guild_ids=guild_ids)
 async def broadcast(ctx, message: str):
     player = ctx.author
     run = return_run(player)
     if run:
-        player_list = run['attendees'].copy()
-        player_list.append(run['runner'])
-        mention_list = [x.mention for x in player_list]
+        mention_list = [mention(member_id) for member_id in [*run.attendees, run.runner_id]]
         await ctx.respond(f"Broadcast to {(',').join(mention_list)}\n\n{message}")
     else:
         await ctx.respond("You are not currently in a run.", ephemeral=True)
 
-async def join_run_callback(interaction: discord.Interaction, run_id):
-    async with active_runs_lock:
-        run_info = active_runs.get(run_id)
-    channel = bot.get_channel(get_realm(run_info))
+async def join_run_callback(interaction: discord.Interaction, runner_id):
+    started = time.perf_counter()
+    run_info = active_runs.get(runner_id)
     if run_info:
-        has_available_spots = len(run_info['attendees']) < 7
-        available_spots = 7 - len(run_info['attendees'])
         user = interaction.user
-        existing_run = None
-        for run in active_runs.values():
-            if user in run['attendees']:
-                existing_run = run
-                break
-        if user in active_runs.keys():
-            existing_run = run
-        if existing_run:
-            await interaction.response.send_message(content=f"{user.mention} you are already in a game!", ephemeral=True)
-        if user in active_runs.keys():
+        existing_run = return_run(user)
+        if user.id in active_runs.keys():
             await interaction.response.send_message(content="You can't host and join at the same time.", ephemeral=True)
-        elif len(run_info['attendees']) < 7 and not existing_run:
-            if user not in run_info['attendees']:
-                async with active_runs_lock:
-                   run_info['attendees'].append(user)
-                async with cursor_lock:
-                    add_player_to_run_db(run_id.id, user.name)
-                available_spots = 7 - len(run_info['attendees'])
-                game_info_message = f"Game Name: {run_info['runs_name']}\nGame Password: {run_info['runs_password']}"
-                await interaction.response.send_message(content=game_info_message, ephemeral=True)  # Send game details privately to the joining user
-            if available_spots > 0:
-                view = JoinRunView(run_id=run_info['runner'], timeout=850)
-                message = await channel.send(content=f"{user.mention} has been added to {run_info['runner'].mention}'s {run_info['ladder']} {run_info['type']} run. There are {available_spots} spots left.", view=view)
-                view.message = message
-            else:
-                await channel.send(content=f"{user.mention} has been added to {run_info['runner'].mention}'s {run_info['ladder']} {run_info['type']} run. There are {available_spots} spots left.")
+        elif existing_run:
+            await interaction.response.send_message(content=f"{user.mention} you are already in a game!", ephemeral=True)
+        elif (place := await join_or_wait(run_info, user.id)) == 0:
+            # Queued before the reply is awaited, so a leave or kick meanwhile is written after it
+            await db.add_attendee(run_info.db_id, user.id, user.name)
+            game_info_message = f"Game Name: {run_info.run_name}\nGame Password: {run_info.password}"
+            await outbound.submit(INTERACTION, lambda: interaction.response.send_message(content=game_info_message, ephemeral=True), REPLY)  # Send game details privately to the joining user
+            ack_timings.record('join', started)
+        elif place:
+            await interaction.response.send_message(content=f"The run is full, so you're #{place} on its waitlist. You'll get a DM with the game info when a seat opens; /unqueue to stop waiting.", ephemeral=True)
+            ack_timings.record('join', started)
         else:
-            await interaction.response.send_message(content="You are already in a run, or the run is full.", ephemeral=True)
+            await interaction.response.send_message(content="You are already in a run, or the run and its waitlist are full.", ephemeral=True)
     else:
         await interaction.response.send_message(content="The run no longer exists.", ephemeral=True)
 
+def runs_page(member_id, page, ladder, run_type):
+    # One /runs page as an embed, with join buttons for its runs and Previous/Next
+    runs_page = build_page(active_runs.values(), run_fragments, return_run_by_id(member_id), member_id, page, ladder, run_type)
+    embed = discord.Embed(title=runs_page.title, description=runs_page.description or None)
+    for name, value in runs_page.fields:
+        embed.add_field(name=name, value=value, inline=False)
+    embed.set_footer(text=runs_page.footer)
+    buttons = [run_button(JOIN, runner_id, label) for label, runner_id in runs_page.join]
+    buttons += [page_button(runs_page.prev_state, "Previous"), page_button(runs_page.next_state, "Next")]
+    return embed, run_buttons(*buttons)
+
+async def turn_runs_page(interaction: discord.Interaction, state):
+    embed, view = runs_page(interaction.user.id, *parse_page_state(state))
+    await interaction.response.edit_message(embed=embed, view=view)
+
+run_buttons_dispatcher = ButtonDispatcher(metrics)
+run_buttons_dispatcher.register(JOIN, join_run_callback)
+run_buttons_dispatcher.register(PAGE, turn_runs_page)
+
+@bot.listen('on_interaction')
+async def dispatch_run_buttons(interaction):
+    await run_buttons_dispatcher.dispatch(interaction)
+
 @bot.slash_command(name="runs", description="Show current runs.", guild_ids=guild_ids)
-async def runs(ctx):
+async def runs(ctx,
+               ladder: Option(str, "Only runs on this ladder", choices=list(LADDER_LABELS), required=False),
+               type: Option(str, "Only runs of this type", choices=list(RUN_TYPE_LABELS), required=False)):
     if len(active_runs) > 0:
-        for run in active_runs.keys():
-            run_info = active_runs[run]
-            has_available_spots = len(run_info['attendees']) < 7
-            run_num = str(active_runs[run]['runs_num'])
-            runner = run
-            ladder = active_runs[run]['ladder']
-            type = active_runs[run]['type']
-            name = active_runs[run]['runs_name']
-            password = active_runs[run]['runs_password']
-            attendees = active_runs[run]['attendees']
-            if ctx.author in attendees:
-                message = f"Game Name: {str(name)}\nGame Password: {password}\nRunner: {runner.name}\n# {ladder}\nType: {type}\n"
-            elif ctx.author.id == runner.id:
-                message = f"Game Name: {str(name)}\nGame Password: {password}\nRunner: {runner.name}\n# {ladder}\nType: {type}\n"
-            else:
-                message = f"Runner: {runner.mention}\n# {ladder}\nType: {type}\n"
-            message += "Attendees:\n"
-            for attendee in attendees:
-                message += f"{attendee.mention}\n"
-            message += "\n\n"
-            if has_available_spots:
-                view = JoinRunView(run_id=runner, timeout=850)
-                message = await ctx.respond(message, view=view, ephemeral=True)
-                view.message = message
-            else:
-                await ctx.respond(message, ephemeral=True)
+        embed, view = runs_page(ctx.author.id, 0, Ladder.parse(ladder) if ladder else None, RunType.parse(type) if type else None)
+        await ctx.respond(embed=embed, view=view, ephemeral=True)
     else:
         await ctx.respond("There are no current runs.", ephemeral=True)
 
+@bot.slash_command(name="quickjoin", description="Join the fullest open run of a kind.", guild_ids=guild_ids)
+async def quickjoin(ctx,
+                    ladder: Option(str, "Ladder or non-ladder", choices=list(LADDER_LABELS), required=True),
+                    type: Option(str, "What type of run?", choices=list(RUN_TYPE_LABELS), required=True)):
+    started = time.perf_counter()
+    if ctx.author.id in player_runs:
+        await ctx.respond("You are already in a run or hosting one.", ephemeral=True)
+        return
+    run_info = await join_fullest(Ladder.parse(ladder), [RunType.parse(type)], ctx.author.id)
+    if run_info is None:
+        await ctx.respond(f"There are no open {type} runs on {ladder}. Use /host to start one!", ephemeral=True)
+        return
+    await db.add_attendee(run_info.db_id, ctx.author.id, ctx.author.name)
+    await ctx.respond(f"You joined {mention(run_info.runner_id)}'s run.\nGame Name: {run_info.run_name}\nGame Password: {run_info.password}", ephemeral=True)
+    ack_timings.record('quickjoin', started)
+
+@bot.slash_command(name="queue", description="Wait for a seat in a run of one of the types you pick.", guild_ids=guild_ids)
+async def queue(ctx,
+                ladder: Option(str, "Ladder or non-ladder", choices=list(LADDER_LABELS), required=True),
+                type: Option(str, "What type of run?", choices=list(RUN_TYPE_LABELS), required=True),
+                second_type: Option(str, "Another type you'd take", choices=list(RUN_TYPE_LABELS), required=False),
+                third_type: Option(str, "Another type you'd take", choices=list(RUN_TYPE_LABELS), required=False)):
+    started = time.perf_counter()
+    if ctx.author.id in player_runs:
+        await ctx.respond("You are already in a run or hosting one.", ephemeral=True)
+        return
+    run_types = [RunType.parse(t) for t in (type, second_type, third_type) if t]
+    run_info = await join_fullest(Ladder.parse(ladder), run_types, ctx.author.id)
+    if run_info is None:
+        if ctx.author.id not in player_runs:  # no await since join_fullest last looked at open_runs
+            match_queue.add(ctx.author.id, Ladder.parse(ladder), run_types)
+        ahead = match_queue.position(ctx.author.id) or 0
+        await ctx.respond(f"You're in the queue with {ahead} ahead of you. You'll get a DM with the game info when a seat opens; /unqueue to stop waiting.", ephemeral=True)
+        ack_timings.record('queue', started)
+        return
+    await db.add_attendee(run_info.db_id, ctx.author.id, ctx.author.name)
+    await ctx.respond(f"You joined {mention(run_info.runner_id)}'s run.\nGame Name: {run_info.run_name}\nGame Password: {run_info.password}", ephemeral=True)
+    ack_timings.record('queue', started)
+
+@bot.slash_command(name="unqueue", description="Stop waiting for a seat.", guild_ids=guild_ids)
+async def unqueue(ctx):
+    queued = match_queue.cancel(ctx.author.id)
+    if leave_waitlist(ctx.author.id) or queued:
+        await ctx.respond("You've stopped waiting for a seat.", ephemeral=True)
+    else:
+        await ctx.respond("You aren't waiting for a seat.", ephemeral=True)
+
 @bot.slash_command(name="leave", description="Leave a run.", guild_ids=guild_ids)
 async def leave(ctx):
     global active_runs
 
     # Check if the user is the runner of any game
-    if ctx.author in active_runs:
+    if ctx.author.id in active_runs:
         await ctx.respond("You are the runner of this game! Use /end to end the game instead.", ephemeral=True)
         return
-    for runner in active_runs.keys():
-        if ctx.author in active_runs[runner]['attendees']:
-            async with active_runs_lock:
-                active_runs[runner]['attendees'].remove(ctx.author)
-            spots_available = 7 - len(active_runs[runner]['attendees'])
-            view = JoinRunView(run_id=runner, timeout=850)
-            async with cursor_lock:
-                del_player_from_run_db(runner.id, ctx.author.name)
-            channel = bot.get_channel(get_realm(active_runs[runner]))
-            message = await channel.send(f"{ctx.author.mention} has left the {active_runs[runner]['ladder']} {active_runs[runner]['type']} run. There are {spots_available} spots available in {runner.mention}'s runs.", view=view)
-            view.message = message
+    runner_id = player_runs.get(ctx.author.id)
+    if runner_id is not None:
+        run_info = active_runs[runner_id]
+        if await remove_from_run(run_info, ctx.author.id):
+            await db.remove_attendee(run_info.db_id, ctx.author.id)
+            await ctx.respond(f"You have left {mention(runner_id)}'s {run_info.ladder.label} {run_info.type.label} run.", ephemeral=True)
             return
 
     await ctx.respond("You are not part of any runs.", ephemeral=True)
@@ -490,223 +682,119 @@ async def leave(ctx):
 @bot.slash_command(name="ng", description="Increment your run", guild_ids=guild_ids)
 async def ng(ctx):
     global active_runs
-    async with run_timeouts_lock:
-        if ctx.author in run_timeouts:
-            run_timeouts[ctx.author].cancel()
-            timeout_task = asyncio.create_task(remove_run_after_timeout(ctx.author))
-            run_timeouts[ctx.author] = timeout_task
-        else:
-            for runner in active_runs.keys():
-                for attendee in active_runs[runner]['attendees']:
-                    if attendee == ctx.author:
-                        my_run = active_runs[runner]
-                        run_timeouts[runner].cancel()
-                        timeout_task = asyncio.create_task(remove_run_after_timeout(runner))
-                        run_timeouts[runner] = timeout_task
-
-    if ctx.author in active_runs.keys():
-        async with active_runs_lock:
-            my_run = active_runs[ctx.author]
-            run_name = my_run['runs_name']
-            matches = re.findall("[0-9]*$", run_name)
-            match = matches[0]
-            if match == "":
-                run_name = run_name + "-1"
+    started = time.perf_counter()
+    if ctx.author.id in player_runs:
+        run_timeouts.touch(player_runs[ctx.author.id])
+
+    if ctx.author.id in active_runs.keys():
+        my_run = active_runs[ctx.author.id]
+        async with run_locks(ctx.author.id):
+            if active_runs.get(ctx.author.id) is not my_run:  # ended or handed over while waiting for the lock
+                run_name = None
             else:
-                new_match = str(int(match) + 1).zfill(len(match))
-                run_name = run_name.replace(match, new_match)
-            active_runs[ctx.author]['runs_name'] = run_name
-        async with cursor_lock:
-            cursor.execute("SELECT * FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1", (ctx.author.id,))
-            db_result = cursor.fetchone()
-            cursor.execute("""
-                INSERT INTO runs (runner_id, runner_name, type, ladder, run_name, attendees, start_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (ctx.author.id, ctx.author.name, db_result[3], db_result[4], db_result[5], db_result[6], datetime.datetime.now(datetime.UTC)))
-
-            conn.commit()
+                run_name = next_run_name(my_run.run_name)
+                my_run.run_name = run_name
+                run_snapshot.changed()
+        if run_name is None:
+            await ctx.respond("You are not part of any runs.", ephemeral=True)
+            return
+        my_run.start_time = int(time.time())
+        my_run.db_id = await db.insert_run(ctx.author.id, ctx.author.name, my_run.type.label, my_run.ladder.label, run_name,
+                            attendee_names(my_run, ctx.guild), my_run.start_time)
         await ctx.respond(f"New run at: {run_name}", ephemeral=True)
-    else:
-        for runner in active_runs.keys():
-            for attendee in active_runs[runner]['attendees']:
-                if attendee == ctx.author:
-                    my_run = active_runs[runner]
-                    run_name = my_run['runs_name']
-                    matches = re.findall("[0-9]*$", run_name)
-                    match = matches[0]
-                    if match == "":
-                        run_name = run_name + "-1"
-                    else:
-                        new_match = str(int(match) + 1).zfill(len(match))
-                        run_name = run_name.replace(match, new_match)
-                    async with active_runs_lock:
-                        active_runs[runner]['runs_name'] = run_name
-                    async with cursor_lock:
-                        cursor.execute("SELECT * FROM runs WHERE runner_id = ? ORDER BY id DESC LIMIT 1", (runner.id,))
-                        db_result = cursor.fetchone()
-                        cursor.execute("""
-                            INSERT INTO runs (runner_id, runner_name, type, ladder, run_name, attendees, start_time)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        """, (runner.id, runner.name, db_result[3], db_result[4], db_result[5], db_result[6], datetime.datetime.now(datetime.UTC)))
-                        conn.commit()
-                    await ctx.respond(f"New run at: {run_name}", ephemeral=True)
-
-def get_top_runners_last_month():
-    cursor.execute("""
-        SELECT runner_name, COUNT(*) as total_runs
-        FROM runs
-        WHERE start_time >= DATE('now', '-1 month')
-        GROUP BY runner_id
-        ORDER BY total_runs DESC
-        LIMIT 10
-    """)
-    return cursor.fetchall()
+        ack_timings.record('ng', started)
+    elif ctx.author.id in player_runs:
+        runner_id = player_runs[ctx.author.id]
+        my_run = active_runs[runner_id]
+        async with run_locks(runner_id):
+            if active_runs.get(runner_id) is not my_run:  # ended or handed over while waiting for the lock
+                run_name = None
+            else:
+                run_name = next_run_name(my_run.run_name)
+                my_run.run_name = run_name
+                run_snapshot.changed()
+        if run_name is None:
+            await ctx.respond("You are not part of any runs.", ephemeral=True)
+            return
+        my_run.start_time = int(time.time())
+        my_run.db_id = await db.insert_run(runner_id, member_name(ctx.guild, runner_id), my_run.type.label, my_run.ladder.label, run_name,
+                            attendee_names(my_run, ctx.guild), my_run.start_time)
+        await ctx.respond(f"New run at: {run_name}", ephemeral=True)
+        ack_timings.record('ng', started)
 
 @bot.slash_command(name="top_hosts", description="Get top players who hosted the most runs", guild_ids=guild_ids)
 async def top_hosts(ctx):
-    async with cursor_lock:
-        cursor.execute("""
-            SELECT runner_name, COUNT(*) as total_runs FROM runs 
-            GROUP BY runner_id ORDER BY total_runs DESC LIMIT 10
-        """)
-        result = cursor.fetchall()
-
-    if not result:
+    sections = await leaderboard_cache.get()
+    if not sections["all_time_hosts"]:
         await ctx.respond("No one has hosted any runs yet.", ephemeral=True)
         return
-
-    message = "**Top Hosts:**\n"
-    for index, (runner, total_runs) in enumerate(result, start=1):
-        message += f"`{index}. {runner}: Hosted {total_runs} Runs`\n"
-
-    await ctx.respond(message, ephemeral=True)
+    await ctx.respond("**Top Hosts:**\n" + sections["all_time_hosts"], ephemeral=True)
 
 @bot.slash_command(name="top_monthly_hosts", description="Get top players who hosted the most runs this past month.", guild_ids=guild_ids)
 async def top_monthly_hosts(ctx):
-    async with cursor_lock:
-        result = get_top_runners_last_month()
-    if not result:
+    sections = await leaderboard_cache.get()
+    if not sections["monthly_hosts"]:
         await ctx.respond("No one has hosted any runs yet.", ephemeral=True)
         return
-
-    message = "**Top Hosts for the Last 30 Days:**\n"
-    for index, (runner, total_runs) in enumerate(result, start=1):
-        message += f"`{index}. {runner}: Hosted {total_runs} Runs`\n"
-    await ctx.respond(message, ephemeral=True)
+    await ctx.respond("**Top Hosts for the Last 30 Days:**\n" + sections["monthly_hosts"], ephemeral=True)
 
 @bot.slash_command(name="top_participants", description="Get top players who participated in the most runs", guild_ids=guild_ids)
 async def top_participants(ctx):
-    async with cursor_lock:
-        cursor.execute("""
-            SELECT * FROM runs
-        """)
-        results = cursor.fetchall()
-    all_users = []
-    if not results:
+    sections = await leaderboard_cache.get()
+    if not sections["all_time_participants"]:
         await ctx.respond("No one has hosted any runs yet.", ephemeral=True)
         return
-    for result in results:
-        all_users.extend(result[6].split(","))
-#    print(all_users)
-    counted = Counter(all_users)
-    sorted_dict = dict(sorted(counted.most_common(11)))
-    sorted_list_sanitized = [(v, k) for k, v in sorted_dict.items() if k != '']
-    sorted_list_sanitized = sorted(sorted_list_sanitized, reverse=True)
-    message = "**Top Participants:**\n"
-    i = 1
-    for v, k in sorted_list_sanitized:
-        if i == 11:
-            break
-        message += f"`{i}. {k}: Participated in {v} Runs`\n"
-        i += 1
-    await ctx.respond(message, ephemeral=True)
+    await ctx.respond("**Top Participants:**\n" + sections["all_time_participants"], ephemeral=True)
 
 @bot.slash_command(name="top_monthly_participants", description="Get top players who participated in the most runs this month", guild_ids=guild_ids)
 async def top_monthly_participants(ctx):
-    async with cursor_lock:
-        cursor.execute("""
-            SELECT * FROM runs
-            WHERE start_time >= DATE('now', '-1 month')
-        """)
-        results = cursor.fetchall()
-    all_users = []
-    if not results:
+    sections = await leaderboard_cache.get()
+    if not sections["monthly_participants"]:
         await ctx.respond("No one has hosted any runs yet.", ephemeral=True)
         return
-    for result in results:
-        all_users.extend(result[6].split(","))
-#    print(all_users)
-    counted = Counter(all_users)
-    sorted_dict = dict(sorted(counted.most_common(11)))
-    sorted_list_sanitized = [(v, k) for k, v in sorted_dict.items() if k != '']
-    sorted_list_sanitized = sorted(sorted_list_sanitized, reverse=True)
-    message = "**Top Participants in the Last 30 Days:**\n"
-    i = 1
-    for v, k in sorted_list_sanitized:
-        if i == 11:
-            break
-        message += f"`{i}. {k}: Participated in {v} Runs`\n"
-        i += 1
-    await ctx.respond(message, ephemeral=True)
+    await ctx.respond("**Top Participants in the Last 30 Days:**\n" + sections["monthly_participants"], ephemeral=True)
+
+@bot.slash_command(name="rebuild_stats", description="Regenerate the leaderboard counters from the full run history.", guild_ids=guild_ids)
+@discord.default_permissions(administrator=True)
+async def rebuild_stats(ctx):
+    await ctx.defer(ephemeral=True)
+    await db.rebuild_stats()
+    await ctx.respond("Leaderboard stats rebuilt.", ephemeral=True)
 
 @bot.slash_command(name="leaderboard", description="Get top players who participated in/hosted the most runs this month and all-time", guild_ids=guild_ids)
 async def leaderboard(ctx):
-    result = get_top_runners_last_month()
-    message = "**Top Hosts for the Last 30 Days:**\n"
-    for index, (runner, total_runs) in enumerate(result, start=1):
-        message += f"`{index}. {runner}: Hosted {total_runs} Runs`\n"
-
-    async with cursor_lock:
-        cursor.execute("""
-            SELECT runner_name, COUNT(*) as total_runs FROM runs
-            GROUP BY runner_id ORDER BY total_runs DESC LIMIT 10
-        """)
-        result = cursor.fetchall()
-
-    message += "\n**Top Hosts All-Time:**\n"
-    for index, (runner, total_runs) in enumerate(result, start=1):
-        message += f"`{index}. {runner}: Hosted {total_runs} Runs`\n"
-
-    async with cursor_lock:
-        cursor.execute("""
-            SELECT * FROM runs
-            WHERE start_time >= DATE('now', '-1 month')
-        """)
-        results = cursor.fetchall()
-    all_users = []
-    for result in results:
-        all_users.extend(result[6].split(","))
-    counted = Counter(all_users)
-    sorted_dict = dict(sorted(counted.most_common(11)))
-    sorted_list_sanitized = [(v, k) for k, v in sorted_dict.items() if k != '']
-    sorted_list_sanitized = sorted(sorted_list_sanitized, reverse=True)
-    message += "\n**Top Participants in the Last 30 Days:**\n"
-    i = 1
-    for v, k in sorted_list_sanitized:
-            if i == 11:
-                break
-            message += f"`{i}. {k}: Participated in {v} Runs`\n"
-            i += 1
-
-    async with cursor_lock:
-        cursor.execute("""
-            SELECT * FROM runs
-        """)
-        results = cursor.fetchall()
-    all_users = []
-    for result in results:
-        all_users.extend(result[6].split(","))
-    counted = Counter(all_users)
-    sorted_dict = dict(sorted(counted.most_common(11)))
-    sorted_list_sanitized = [(v, k) for k, v in sorted_dict.items() if k != '']
-    sorted_list_sanitized = sorted(sorted_list_sanitized, reverse=True)
-    message += "\n**Top Participants All-Time:**\n"
-    i = 1
-    for v, k in sorted_list_sanitized:
-            if i == 11:
-                break
-            message += f"`{i}. {k}: Participated in {v} Runs`\n"
-            i += 1
-    await ctx.respond(message, ephemeral=True)
+    sections = await leaderboard_cache.get()
+    await ctx.respond(sections["leaderboard"], ephemeral=True)
+
+@bot.slash_command(name="botstats", description="Show the bot's live counts and its slowest commands, locks and queries.", guild_ids=guild_ids)
+@discord.default_permissions(administrator=True)
+async def botstats(ctx):
+    await ctx.respond(report(metrics), ephemeral=True)
+
+@bot.slash_command(name="profile", description="Start or stop profiling the bot's event loop, threads and queries.", guild_ids=guild_ids)
+@discord.default_permissions(administrator=True)
+async def profile(ctx, action: Option(str, "start or stop", choices=["start", "stop"], required=True)):
+    if action == "start":
+        profiler.start()
+        await ctx.respond(f"Profiling until /profile stop. Blocks of the event loop over {profiler.block_threshold * 1000:.0f}ms "
+                          f"and queries over {profiler.slow_query_threshold * 1000:.0f}ms are kept.", ephemeral=True)
+    else:
+        await ctx.defer(ephemeral=True)
+        await ctx.respond(await profiler.stop() or "The profiler isn't running.", ephemeral=True)
+
+metrics.gauge("runs_active_runs", "Live runs", lambda: len(active_runs))
+metrics.gauge("runs_seated_players", "Runners and attendees of live runs", lambda: len(player_runs))
+metrics.gauge("runs_waitlisted_players", "Players on a full run's waitlist", lambda: len(waitlisted))
+metrics.gauge("runs_queued_players", "Players in the matchmaking queue", lambda: len(match_queue))
+metrics.gauge("runs_pending_timers", "Scheduled run expiries, queue expiries and board edits", lambda: {
+    "run_expiry": len(run_timeouts), "queue_expiry": len(match_queue.expiry), "board_edit": len(run_board.tasks)}, label="kind")
+# Run buttons are stateless (see buttons.run_buttons), so this is mostly the /host and /rename forms still open
+metrics.gauge("runs_live_views", "Views and modals the client is still listening on", lambda: {
+    "view": len(bot._connection._view_store._views), "message_view": len(bot._connection._view_store._synced_message_views),
+    "modal": len(bot._connection._modal_store._modals)}, label="kind")
 
 bot.run(TOKEN)
+run_snapshot.save()
+
+db.close()
+log_writer.stop()
@@ -0,0 +1,70 @@
+from scheduler import ExpiryScheduler
+
+
+class MatchQueue:
+    """Players waiting for a seat, first come first served per (ladder, run type).
+
+    A player can wait for several run types on one ladder. They sit in each of those FIFOs,
+    and the first seat to open in any of them takes them out of all of them. Each FIFO is an
+    insertion-ordered dict, so adding, cancelling and taking the next player cost O(number
+    of types a player waits for). Entries expire ttl seconds after they were added through
+    an ExpiryScheduler, so nothing polls. on_expire(player_id) is awaited for each expiry.
+    """
+
+    def __init__(self, on_expire=None, ttl=30 * 60):
+        self.waiting: dict[tuple[int, int], dict[int, None]] = {}  # (ladder, run type) -> player IDs in order
+        self.entries: dict[int, tuple[int, tuple[int, ...]]] = {}  # player ID -> (ladder, run types)
+        self.on_expire = on_expire
+        self.expiry = ExpiryScheduler(self._expire, ttl)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, player_id):
+        return player_id in self.entries
+
+    def add(self, player_id: int, ladder: int, run_types, ttl=None):
+        """Queues the player, replacing any entry they already had and sending them to the back."""
+        self.cancel(player_id)
+        run_types = tuple(dict.fromkeys(run_types))
+        self.entries[player_id] = (ladder, run_types)
+        for run_type in run_types:
+            self.waiting.setdefault((ladder, run_type), {})[player_id] = None
+        self.expiry.touch(player_id, ttl)
+
+    def cancel(self, player_id: int) -> bool:
+        entry = self.entries.pop(player_id, None)
+        if entry is None:
+            return False
+        ladder, run_types = entry
+        for run_type in run_types:
+            fifo = self.waiting[(ladder, run_type)]
+            del fifo[player_id]
+            if not fifo:
+                del self.waiting[(ladder, run_type)]
+        self.expiry.cancel(player_id)
+        return True
+
+    def pop(self, ladder: int, run_type: int) -> int | None:
+        """Takes the longest-waiting player for this kind of run out of the queue."""
+        fifo = self.waiting.get((ladder, run_type))
+        if not fifo:
+            return None
+        player_id = next(iter(fifo))
+        self.cancel(player_id)
+        return player_id
+
+    def position(self, player_id: int) -> int | None:
+        """How many players are ahead of this one in the shortest of their FIFOs."""
+        entry = self.entries.get(player_id)
+        if entry is None:
+            return None
+        ladder, run_types = entry
+        return min(list(self.waiting[(ladder, run_type)]).index(player_id) for run_type in run_types)
+
+    async def _expire(self, player_id: int):
+        if self.cancel(player_id) and self.on_expire:
+            await self.on_expire(player_id)
+
+    def close(self):
+        self.expiry.close()
@@ -0,0 +1,228 @@
+import asyncio
+import bisect
+import os
+import time
+from collections import defaultdict
+
+# Upper bounds in seconds, from a fast in-memory critical section to a slow Discord call
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# HELP text for the histograms and counters; gauges bring their own
+HELP = {
+    "runs_command_seconds": "Slash command handler time, start to return; for host and rename that includes filling in the modal",
+    "runs_button_seconds": "Run button handler time, start to return",
+    "runs_lock_wait_seconds": "Time waiting to acquire a RunManager lock",
+    "runs_lock_hold_seconds": "Time a RunManager lock was held",
+    "runs_db_queue_seconds": "Time a query or write waited for the database thread",
+    "runs_db_seconds": "Time the database thread spent running one query or write",
+    "runs_db_commit_seconds": "Time to commit one batch of writes",
+    "runs_db_errors_total": "Database writes rolled back, and failed commits",
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense.
+
+    Each series is only ever observed from one thread (the event loop, or the database
+    thread for the runs_db_* ones), so there is no lock; a scrape may see one observation
+    in count and not yet in sum, which Prometheus tolerates.
+    """
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimated from the buckets by linear interpolation, like Prometheus' histogram_quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """Counters, histograms and callback gauges for the bot, rendered in Prometheus text format.
+
+    Series are keyed by metric name and a sorted tuple of label pairs and made on first use.
+    Gauges are functions called at scrape time, so nothing has to be kept up to date: each
+    returns a number, or a {label value: number} dict for a gauge registered with a label.
+    """
+
+    def __init__(self):
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.counters: dict[tuple[str, tuple], float] = defaultdict(float)
+        self.gauges: dict[str, tuple[str, str | None, object]] = {}  # name -> (help, label, fn)
+        self.server = None
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        return histogram
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def gauge(self, name: str, help: str, fn, label: str | None = None):
+        self.gauges[name] = (help, label, fn)
+
+    def read_gauges(self) -> dict[str, object]:
+        return {name: fn() for name, (_, _, fn) in self.gauges.items()}
+
+    def render(self) -> str:
+        lines = []
+        typed = set()
+
+        def header(name, kind, help):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            header(name, "histogram", HELP.get(name, name))
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for (name, labels), value in sorted(self.counters.items()):
+            header(name, "counter", HELP.get(name, name))
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for name, (help, label, fn) in self.gauges.items():
+            header(name, "gauge", help)
+            value = fn()
+            if label is None:
+                lines.append(f"{name} {value}")
+            else:
+                lines.extend(f"{name}{_labels((), **{label: key})} {v}" for key, v in value.items())
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9108):
+        """Answers GET /metrics on host:port for Prometheus to scrape. Local only by default."""
+        self.server = await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # headers
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+
+def _labels(labels, **extra) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class TimedLock(asyncio.Lock):
+    """An asyncio.Lock that records how long it was waited for and held."""
+
+    def __init__(self, wait: Histogram, hold: Histogram):
+        super().__init__()
+        self.wait = wait
+        self.hold = hold
+        self.acquired_at = 0.0
+
+    async def acquire(self):
+        start = time.perf_counter()
+        await super().acquire()
+        self.acquired_at = time.perf_counter()
+        self.wait.observe(self.acquired_at - start)
+        return True
+
+    def release(self):
+        self.hold.observe(time.perf_counter() - self.acquired_at)
+        super().release()
+
+
+def timed_locks(metrics: Metrics, name: str):
+    """A factory for RunLocks and registry_lock: locks whose timings go under lock=name."""
+    wait = metrics.histogram("runs_lock_wait_seconds", lock=name)
+    hold = metrics.histogram("runs_lock_hold_seconds", lock=name)
+    return lambda: TimedLock(wait, hold)
+
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def add_service_gauges(metrics: Metrics, db, outbound, jobs, ack_timings):
+    """Gauges for the parts both bots share: the database, the outbound queue, jobs and acks."""
+    metrics.gauge("runs_db_queue_depth", "Queries and writes waiting for the database thread", db.queue.qsize)
+    metrics.gauge("runs_db_file_bytes", "Size of runs.db", lambda: file_size(db.db_name))
+    metrics.gauge("runs_outbound_queue_depth", "Outbound calls waiting, per channel", lambda: outbound.stats()["depth"], label="channel")
+    metrics.gauge("runs_outbound_calls", "Outbound calls since start, by outcome", lambda: {
+        outcome: count for outcome, count in outbound.stats().items() if outcome in ("sent", "merged", "dropped", "rate_limited")}, label="outcome")
+    metrics.gauge("runs_outbound_wait_p95_seconds", "95th percentile wait in the outbound queue, per priority, over the recent calls",
+                  lambda: {priority: waits["p95"] / 1000 for priority, waits in outbound.stats()["waits"].items()}, label="priority")
+    metrics.gauge("runs_background_jobs", "Background jobs still running", lambda: len(jobs.tasks))
+    metrics.gauge("runs_job_failures", "Background jobs that raised since start, per job", lambda: dict(jobs.failures), label="job")
+    metrics.gauge("runs_ack_p99_seconds", "99th percentile time to answer, per command, over the recent acks",
+                  lambda: {command: acks["p99"] / 1000 for command, acks in ack_timings.summary().items()}, label="command")
+
+
+def report(metrics: Metrics) -> str:
+    """A short plain-text summary for /botstats: the gauges, then the slowest series by p99."""
+    lines = []
+    for (name, labels), value in sorted(metrics.counters.items()):
+        what = " ".join([name.removeprefix("runs_"), *(f"{key}={v}" for key, v in labels)])
+        lines.append(f"{what}: {value:g}")
+    for name, value in metrics.read_gauges().items():
+        if isinstance(value, dict):
+            value = ", ".join(f"{key} {v:g}" for key, v in sorted(value.items(), key=lambda item: -item[1])[:5]) or "none"
+        lines.append(f"{name.removeprefix('runs_')}: {value}")
+    slowest = sorted(((histogram.quantile(0.99), name, labels, histogram) for (name, labels), histogram in list(metrics.histograms.items())
+                      if histogram.count), reverse=True)
+    if slowest:
+        lines.append("\nSlowest p99 (p50, count):")
+    for p99, name, labels, histogram in slowest[:12]:
+        what = " ".join([name.removeprefix("runs_").removesuffix("_seconds"), *(str(value) for _, value in labels)])
+        lines.append(f"{what}: {p99 * 1000:.1f}ms "
+                     f"({histogram.quantile(0.5) * 1000:.1f}ms, {histogram.count})")
+    text = "\n".join(lines)
+    return text if len(text) <= 1900 else text[:1900] + "\n..."
@@ -0,0 +1,255 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+
+import eventlog
+
+log = logging.getLogger("runs.outbound")
+
+# Lower goes first. Replies carry game info someone is waiting on; announcements can wait.
+REPLY = 0
+BOARD = 1
+ANNOUNCE = 2
+
+PRIORITY_NAMES = {REPLY: "reply", BOARD: "board", ANNOUNCE: "announce"}
+
+# channel_id for interaction responses. Discord doesn't count them against the global limit,
+# and a click or command not answered within 3 seconds fails, so they never wait on a bucket.
+INTERACTION = "interaction"
+
+
+class Bucket:
+    """Discord-style rate limit: rate calls per window of per seconds, reset when the window ends."""
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.remaining = rate
+        self.reset_at = 0.0
+
+    def delay(self, now) -> float:
+        """Seconds until a call may go out, 0 if one may go out now."""
+        if now >= self.reset_at or self.remaining > 0:
+            return 0.0
+        return self.reset_at - now
+
+    def take(self, now):
+        if now >= self.reset_at:
+            self.remaining = self.rate
+            self.reset_at = now + self.per
+        self.remaining -= 1
+
+    def block(self, retry_after, now):
+        """Discord answered 429: nothing goes out on this bucket for retry_after seconds."""
+        self.remaining = 0
+        self.reset_at = now + retry_after
+
+
+class _Item:
+    __slots__ = ("priority", "seq", "channel_id", "op", "key", "deadline", "queued_at", "future", "context")
+
+    def __init__(self, priority, seq, channel_id, op, key, deadline, future):
+        self.priority = priority
+        self.seq = seq
+        self.channel_id = channel_id
+        self.op = op
+        self.key = key
+        self.deadline = deadline
+        self.queued_at = time.monotonic()
+        self.future = future
+        self.context = eventlog.current()  # logged with the call, which runs in Outbound's own task
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Outbound:
+    """Sends and edits queued per channel, paced to Discord's rate limits.
+
+    Command handlers submit a coroutine function instead of awaiting the HTTP call, so a 429
+    stalls the queue rather than the interaction. Each channel runs one call at a time, in
+    priority order and FIFO within a priority, under its own bucket (Discord allows about 5
+    messages per 5s per channel) and a shared global one. Submitting with a key replaces an
+    older call with the same key that hasn't started yet, so stale edits are merged away.
+    A ttl drops the call if it couldn't start in time. Calls with channel_id None (DMs) skip
+    the channel bucket and run as soon as the global bucket allows; INTERACTION calls skip
+    both.
+
+    py-cord sleeps through a 429 inside the HTTP call itself, which is what used to hold up the
+    handlers; here that sleep only holds up the channel's queue. A call that fails with an
+    exception carrying retry_after (as the fake HTTP layer in bench/ raises) blocks its bucket
+    for that long and is retried.
+    """
+
+    def __init__(self, channel_rate=(5, 5.0), global_rate=(50, 1.0), max_retries=3, window=1000):
+        self.channel_rate = channel_rate
+        self.global_bucket = Bucket(*global_rate)
+        self.max_retries = max_retries
+        self.queues = {}  # channel ID -> heap of _Item
+        self.buckets = {}
+        self.busy = set()  # channels with a call in flight
+        self.keyed = {}  # merge key -> queued _Item
+        self.seq = 0
+        self.waits = {priority: deque(maxlen=window) for priority in PRIORITY_NAMES}
+        self.sent = 0
+        self.dropped = 0
+        self.merged = 0
+        self.rate_limited = 0
+        self.wake = asyncio.Event()
+        self.task = None
+        self.calls = set()
+
+    def submit(self, channel_id, op, priority=ANNOUNCE, key=None, ttl=None) -> asyncio.Future:
+        """Queues op() for channel_id; the future resolves with its result, or None if dropped."""
+        item = self.keyed.get(key) if key is not None else None
+        if item is not None:
+            item.op = op
+            item.context = eventlog.current()
+            item.deadline = time.monotonic() + ttl if ttl is not None else None
+            self.merged += 1
+            return item.future
+        self.seq += 1
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve)
+        item = _Item(priority, self.seq, channel_id, op, key, time.monotonic() + ttl if ttl is not None else None, future)
+        heapq.heappush(self.queues.setdefault(channel_id, []), item)
+        if key is not None:
+            self.keyed[key] = item
+        self.wake.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return future
+
+    def send(self, channel, content=None, priority=ANNOUNCE, **kwargs) -> asyncio.Future:
+        return self.submit(channel.id, lambda: channel.send(content, **kwargs), priority)
+
+    def edit(self, message, priority=ANNOUNCE, ttl=None, **kwargs) -> asyncio.Future:
+        """Queues an edit; a newer edit of the same message replaces one still waiting."""
+        return self.submit(message.channel.id, lambda: message.edit(**kwargs), priority, key=("edit", message.id), ttl=ttl)
+
+    def _bucket(self, channel_id) -> Bucket:
+        bucket = self.buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.buckets[channel_id] = Bucket(*self.channel_rate)
+        return bucket
+
+    def _next(self, now):
+        """The next call that may start now, or None and how long until one might."""
+        best = None
+        wait = None
+        for channel_id, queue in self.queues.items():
+            if not queue or channel_id in self.busy:
+                continue
+            while queue and queue[0].deadline is not None and queue[0].deadline < now:
+                self._drop(heapq.heappop(queue))
+            if not queue:
+                continue
+            if channel_id == INTERACTION:
+                return queue[0], None
+            delay = 0.0 if channel_id is None else self._bucket(channel_id).delay(now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or queue[0] < best:
+                best = queue[0]
+        if best is not None:
+            delay = self.global_bucket.delay(now)
+            if delay > 0:
+                return None, delay
+        return best, wait
+
+    def _drop(self, item):
+        self.dropped += 1
+        self._forget(item)
+        if not item.future.done():
+            item.future.set_result(None)
+
+    def _forget(self, item):
+        if item.key is not None and self.keyed.get(item.key) is item:
+            del self.keyed[item.key]
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            item, wait = self._next(now)
+            if item is None:
+                self.wake.clear()
+                try:
+                    async with asyncio.timeout(wait):
+                        await self.wake.wait()
+                except TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.queues[item.channel_id])
+            self._forget(item)
+            if item.channel_id != INTERACTION:
+                self.global_bucket.take(now)
+            if item.channel_id not in (None, INTERACTION):
+                self._bucket(item.channel_id).take(now)
+                self.busy.add(item.channel_id)
+            self.waits[item.priority].append(now - item.queued_at)
+            call = asyncio.create_task(self._call(item))
+            self.calls.add(call)
+            call.add_done_callback(self.calls.discard)
+
+    async def _call(self, item, attempt=0):
+        eventlog.context.set(item.context)
+        try:
+            result = await item.op()
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None and attempt < self.max_retries:
+                self.rate_limited += 1
+                log.warning("rate limited", extra={"channel": item.channel_id, "retry_after": retry_after,
+                                                   "is_global": getattr(e, "is_global", False)})
+                now = time.monotonic()
+                if getattr(e, "is_global", False) or item.channel_id is None:
+                    self.global_bucket.block(retry_after, now)
+                elif item.channel_id != INTERACTION:
+                    self._bucket(item.channel_id).block(retry_after, now)
+                await asyncio.sleep(retry_after)
+                if item.channel_id not in (None, INTERACTION):
+                    self._bucket(item.channel_id).take(time.monotonic())
+                return await self._call(item, attempt + 1)
+            log.warning("outbound call failed", exc_info=e, extra={"channel": item.channel_id})
+            item.future.set_exception(e)
+        else:
+            self.sent += 1
+            log.info("outbound call", extra={"channel": item.channel_id, "priority": PRIORITY_NAMES[item.priority],
+                                             "waited_ms": round((time.monotonic() - item.queued_at) * 1000, 1)})
+            item.future.set_result(result)
+        finally:
+            if attempt == 0:
+                self.busy.discard(item.channel_id)
+                self.wake.set()
+
+    def stats(self) -> dict:
+        """Queue depth per channel and wait-before-send percentiles per priority, in ms."""
+        waits = {}
+        for priority, samples in self.waits.items():
+            if samples:
+                ordered = sorted(samples)
+                waits[PRIORITY_NAMES[priority]] = {
+                    "p50": ordered[len(ordered) // 2] * 1000,
+                    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+                    "max": ordered[-1] * 1000,
+                }
+        return {
+            "depth": {channel_id: len(queue) for channel_id, queue in self.queues.items() if queue},
+            "waits": waits,
+            "sent": self.sent,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "rate_limited": self.rate_limited,
+        }
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+def _retrieve(future):
+    # Fire-and-forget callers never look at the future; failures are already logged
+    if not future.cancelled():
+        future.exception()
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class Profiler:
+    """Opt-in sampling profiler for when the bot feels slow, turned on and off at runtime.
+
+    While running, a thread takes a stack sample of every other thread each interval
+    seconds and counts them as collapsed stacks, the input format of flamegraph.pl and
+    speedscope. The same thread pings the event loop; a ping that isn't answered within
+    block_threshold means a callback is blocking the loop, and the loop thread's stack at
+    that moment is kept with how long the block lasted. Given a Database, queries and writes
+    slower than slow_query_threshold are kept with their SQL and parameters.
+
+    stop() writes <out_dir>/<time>.folded and <time>.txt with the blocks and slow queries.
+    When stopped there is no thread, and Database only checks that its profiler is None.
+    """
+
+    def __init__(self, db=None, out_dir="profiles", interval=0.005, block_threshold=0.1, slow_query_threshold=0.05):
+        self.db = db
+        self.out_dir = out_dir
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.slow_query_threshold = slow_query_threshold
+        self.thread = None
+        self.stopping = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def start(self):
+        """Starts profiling; called from the event loop."""
+        if self.running:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.started = time.time()
+        self.stacks = Counter()
+        self.blocks = []  # (seconds, loop thread stack)
+        self.slow_queries = []  # (seconds, op, args, [SQL with parameters bound])
+        self.pinged_at = self.answered_at = time.perf_counter()
+        self.block_stack = None
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self.thread.start()
+        if self.db is not None:
+            self.db.profiler = self
+
+    async def stop(self) -> str | None:
+        """Stops profiling and writes what was collected; returns a one-line summary, or None if it wasn't running."""
+        if not self.running:
+            return None
+        if self.db is not None:
+            self.db.profiler = None
+        self.stopping.set()
+        await asyncio.to_thread(self.thread.join)
+        self.thread = None
+        return await asyncio.to_thread(self._write)
+
+    async def toggle(self) -> str:
+        if self.running:
+            return await self.stop()
+        self.start()
+        return f"Profiling; blocks over {self.block_threshold * 1000:.0f}ms and queries over {self.slow_query_threshold * 1000:.0f}ms are kept."
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {}
+        while not self.stopping.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    name = names[ident] = next((t.name for t in threading.enumerate() if t.ident == ident), str(ident))
+                self.stacks[collapse(name, frame)] += 1
+            now = time.perf_counter()
+            if self.answered_at >= self.pinged_at:
+                self.pinged_at = now
+                self.loop.call_soon_threadsafe(self._answer)
+            elif self.block_stack is None and now - self.pinged_at > self.block_threshold and self.loop_thread in frames:
+                self.block_stack = collapse("loop", frames[self.loop_thread])
+
+    def _answer(self):
+        # On the loop: how long since the sampler asked, most of which a blocking callback held it
+        self.answered_at = time.perf_counter()
+        lag = self.answered_at - self.pinged_at
+        if self.block_stack is not None:
+            self.blocks.append((lag, self.block_stack))
+            self.block_stack = None
+
+    def query(self, op: str, args: tuple, statements: list[str], seconds: float):
+        """Called by the database thread after each query or write while profiling."""
+        if seconds >= self.slow_query_threshold:
+            self.slow_queries.append((seconds, op, args, statements))
+
+    def _write(self) -> str:
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started)))
+        with open(base + ".folded", "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+        with open(base + ".txt", "w") as f:
+            f.write(f"Event loop blocked for over {self.block_threshold * 1000:.0f}ms:\n")
+            for seconds, stack in sorted(self.blocks, reverse=True):
+                f.write(f"{seconds * 1000:9.1f}ms  {stack}\n")
+            f.write(f"\nQueries over {self.slow_query_threshold * 1000:.0f}ms:\n")
+            for seconds, op, args, statements in sorted(self.slow_queries, key=lambda q: -q[0]):
+                f.write(f"{seconds * 1000:9.1f}ms  {op}{args!r}\n")
+                f.writelines(f"             {' '.join(sql.split())}\n" for sql in statements)
+        return (f"Wrote {base}.folded ({sum(self.stacks.values())} samples) and {base}.txt "
+                f"({len(self.blocks)} loop blocks, {len(self.slow_queries)} slow queries).")
+
+
+def collapse(thread_name: str, frame) -> str:
+    """The stack as "thread;outermost;...;innermost", one file:function per frame."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
@@ -0,0 +1,110 @@
+from runs import MAX_ATTENDEES, MAX_WAITLIST, Ladder, Run, RunType, mention
+
+PAGE_SIZE = 10  # runs per /runs page; keeps an embed well under Discord's 6000 characters
+
+
+class RunFragments:
+    """The /runs field for each run, rendered once and kept until that run changes.
+
+    Keyed by runner ID. An entry also remembers the Run it was rendered from, so a runner
+    who hosts again after handing their run over never gets the old run's text. discard()
+    must follow every change to a run's runner, attendees or waitlist; the game name and
+    password are only shown to the run's own members and are not cached.
+    """
+
+    def __init__(self, waitlists: dict[int, dict[int, None]]):
+        self.waitlists = waitlists
+        self.cache: dict[int, tuple[Run, tuple[str, str]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, run: Run) -> tuple[str, str]:
+        entry = self.cache.get(run.runner_id)
+        if entry is not None and entry[0] is run:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        fragment = self.render(run)
+        self.cache[run.runner_id] = (run, fragment)
+        return fragment
+
+    def render(self, run: Run) -> tuple[str, str]:
+        """(field name, field value) for the run."""
+        seats = f"{len(run.attendees)}/{MAX_ATTENDEES}"
+        if run.is_full:
+            seats += f", full, {len(self.waitlists.get(run.runner_id, ()))} waiting"
+        attendees = " ".join(mention(a) for a in run.attendees) or "none yet"
+        return f"{run.ladder.label} - {run.type.label} ({seats})", f"Runner: {mention(run.runner_id)}\nAttendees: {attendees}"
+
+    def discard(self, runner_id: int):
+        self.cache.pop(runner_id, None)
+
+    def joinable(self, run: Run) -> bool:
+        """Whether the join button would seat the player or put them on the waitlist."""
+        return len(self.waitlists.get(run.runner_id, ())) < MAX_WAITLIST
+
+
+def page_state(page: int, ladder: Ladder | None = None, run_type: RunType | None = None) -> int:
+    """Packs a page and its filters into one int, for a button's custom_id."""
+    ladder_code = 0 if ladder is None else ladder + 1
+    type_code = 0 if run_type is None else run_type + 1
+    return (page * (len(Ladder) + 1) + ladder_code) * (len(RunType) + 1) + type_code
+
+
+def parse_page_state(state: int) -> tuple[int, Ladder | None, RunType | None]:
+    rest, type_code = divmod(state, len(RunType) + 1)
+    page, ladder_code = divmod(rest, len(Ladder) + 1)
+    return page, Ladder(ladder_code - 1) if ladder_code else None, RunType(type_code - 1) if type_code else None
+
+
+class RunsPage:
+    """One page of /runs for one viewer, as plain text; the bot turns it into an embed and buttons."""
+
+    __slots__ = ("title", "description", "fields", "footer", "join", "leave", "prev_state", "next_state")
+
+    def __init__(self, title, description, fields, footer, join, leave, prev_state, next_state):
+        self.title = title
+        self.description = description
+        self.fields = fields  # [(name, value)]
+        self.footer = footer
+        self.join = join  # [(label, runner ID)] of runs on this page the viewer can join or wait for
+        self.leave = leave  # runner ID of the run the viewer attends, or None
+        self.prev_state = prev_state  # page_state() of the neighbouring pages, or None at either end
+        self.next_state = next_state
+
+
+def build_page(runs, fragments: RunFragments, viewer_run: Run | None, viewer_id: int,
+               page: int = 0, ladder: Ladder | None = None, run_type: RunType | None = None) -> RunsPage:
+    """Page `page` of the runs matching the filters, clamped to the pages there are.
+
+    Each field comes from the fragment cache; only the numbering and the viewer's own game
+    info are put together per call.
+    """
+    matching = [run for run in runs if (ladder is None or run.ladder == ladder) and (run_type is None or run.type == run_type)]
+    pages = max(1, -(-len(matching) // PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    shown = matching[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+
+    title = "Current Runs"
+    filters = [f.label for f in (ladder, run_type) if f is not None]
+    if filters:
+        title += " - " + " ".join(filters)
+    description = []
+    if viewer_run is not None:
+        description.append(f"**Your run** with {mention(viewer_run.runner_id)}\nGame Name: {viewer_run.run_name}\nGame Password: {viewer_run.password}")
+    if not matching:
+        description.append("There are no runs like that right now. Use /host to start one!")
+
+    fields = []
+    join = []
+    offset = page * PAGE_SIZE
+    for index, run in enumerate(shown, offset + 1):
+        name, value = fragments.get(run)
+        fields.append((f"{index}. {name}", value))
+        if viewer_run is None and fragments.joinable(run):
+            join.append((f"{'Wait for' if run.is_full else 'Join'} #{index}", run.runner_id))
+
+    leave = viewer_run.runner_id if viewer_run is not None and viewer_run.runner_id != viewer_id else None
+    return RunsPage(title, "\n\n".join(description), fields, f"Page {page + 1}/{pages} - {len(matching)} runs", join, leave,
+                    page_state(page - 1, ladder, run_type) if page > 0 else None,
+                    page_state(page + 1, ladder, run_type) if page + 1 < pages else None)
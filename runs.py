@@ -0,0 +1,490 @@
+import asyncio
+import re
+import time
+from array import array
+from enum import IntEnum
+
+from matchmaking import MatchQueue
+from scheduler import ExpiryScheduler
+from snapshot import Snapshot
+
+MAX_ATTENDEES = 7
+MAX_WAITLIST = 5  # players who can wait for a seat in one full run
+SNAPSHOT_FORMAT = 2  # bump when Run.to_dict() changes; older snapshots are not restored
+
+HARDCORE_LAD = 1356339382323249312
+HARDCORE_NONLAD = 1337609082290573404
+SOFTCORE_LAD = 1337608997997510732
+SOFTCORE_NONLAD = 1337608670661316678
+
+
+class Ladder(IntEnum):
+    NON_LADDER = 0
+    LADDER = 1
+    NON_LADDER_HARDCORE = 2
+    LADDER_HARDCORE = 3
+
+    @property
+    def label(self) -> str:
+        return LADDER_LABELS[self]
+
+    @property
+    def realm(self) -> int:
+        """The channel runs on this ladder are announced in."""
+        return REALMS[self]
+
+    @classmethod
+    def parse(cls, label: str) -> "Ladder":
+        return cls(LADDER_LABELS.index(label))
+
+
+LADDER_LABELS = ("Non-Ladder", "Ladder", "Non-Ladder Hardcore", "Ladder Hardcore")
+REALMS = (SOFTCORE_NONLAD, SOFTCORE_LAD, HARDCORE_NONLAD, HARDCORE_LAD)
+
+
+class RunType(IntEnum):
+    BAAL = 0
+    PRE_TELE_BAAL = 1
+    CHAOS_FULL_CLEAR = 2
+    CHAOS_SEAL_POP = 3
+    COWS = 4
+    TOMBS = 5
+    SPLIT_TOMBS = 6
+    TZ = 7
+    GRUSH = 8
+
+    @property
+    def label(self) -> str:
+        return RUN_TYPE_LABELS[self]
+
+    @classmethod
+    def parse(cls, label: str) -> "RunType":
+        return cls(RUN_TYPE_LABELS.index(label))
+
+
+RUN_TYPE_LABELS = ("Baal", "Pre-Tele Baal", "Chaos-Full Clear", "Chaos-Seal Pop", "Cows", "Tombs", "Split-Tombs", "TZ", "GRush")
+
+
+class Run:
+    """Live state of one run.
+
+    Members are kept as IDs, attendees in an array of at most MAX_ATTENDEES unsigned 64-bit
+    ints, and ladder and type as small enums, so a run holds no references into discord.py's
+    cache. Names are looked up with member_name() when a message is rendered; mentions need
+    only the ID. start_time is a UTC Unix timestamp in whole seconds, as in runs.db.
+    """
+
+    __slots__ = ("runner_id", "ladder", "type", "run_name", "password", "attendees", "start_time", "db_id")
+
+    def __init__(self, runner_id: int, ladder: Ladder, run_type: RunType, run_name: str, password: str,
+                 attendees=(), start_time: int | None = None, db_id: int | None = None):
+        self.runner_id = runner_id
+        self.ladder = ladder
+        self.type = run_type
+        self.run_name = run_name
+        self.password = password
+        self.attendees = array("Q", attendees)
+        self.start_time = int(time.time()) if start_time is None else start_time
+        self.db_id = db_id  # runs.id of the row this run is currently writing to
+
+    def get_realm(self) -> int:
+        return self.ladder.realm
+
+    @property
+    def is_full(self) -> bool:
+        return len(self.attendees) >= MAX_ATTENDEES
+
+    def add(self, member_id: int) -> bool:
+        if self.is_full or member_id in self.attendees or member_id == self.runner_id:
+            return False
+        self.attendees.append(member_id)
+        return True
+
+    def discard(self, member_id: int) -> bool:
+        if member_id not in self.attendees:
+            return False
+        self.attendees.remove(member_id)
+        return True
+
+    def members(self) -> list[int]:
+        """The runner followed by the attendees."""
+        return [self.runner_id, *self.attendees]
+
+    def to_dict(self) -> dict:
+        return {
+            "runner": self.runner_id,
+            "ladder": int(self.ladder),
+            "type": int(self.type),
+            "run_name": self.run_name,
+            "password": self.password,
+            "attendees": self.attendees.tolist(),
+            "start_time": self.start_time,
+            "db_id": self.db_id,
+        }
+
+    @classmethod
+    def from_dict(cls, saved: dict) -> "Run":
+        return cls(saved["runner"], Ladder(saved["ladder"]), RunType(saved["type"]), saved["run_name"], saved["password"],
+                   saved["attendees"], saved["start_time"], saved["db_id"])
+
+    def __repr__(self):
+        return f"<Run runner={self.runner_id} {self.ladder.label} {self.type.label} attendees={self.attendees.tolist()}>"
+
+
+class OpenRuns:
+    """Runs with a free seat, bucketed by (ladder, type) and by how many attendees they have.
+
+    Within a fill level, runs keep the order they reached it in, so best() hands out the
+    fullest open run of a kind, longest-waiting first, by looking at no more than
+    MAX_ATTENDEES levels. update() must follow every change to a run's attendees.
+    """
+
+    def __init__(self):
+        self.buckets: dict[tuple[Ladder, RunType], list[dict[int, None]]] = {}
+        self.where: dict[int, dict[int, None]] = {}  # runner ID -> the level it's filed in
+
+    def update(self, run: Run):
+        level = self.where.get(run.runner_id)
+        if run.is_full:
+            self.discard(run.runner_id)
+            return
+        levels = self.buckets.get((run.ladder, run.type))
+        if levels is None:
+            levels = self.buckets[(run.ladder, run.type)] = [{} for _ in range(MAX_ATTENDEES)]
+        new_level = levels[len(run.attendees)]
+        if level is new_level:
+            return
+        if level is not None:
+            del level[run.runner_id]
+        new_level[run.runner_id] = None
+        self.where[run.runner_id] = new_level
+
+    def discard(self, runner_id: int):
+        level = self.where.pop(runner_id, None)
+        if level is not None:
+            del level[runner_id]
+
+    def best(self, ladder: Ladder, run_type: RunType) -> int | None:
+        """Runner ID of the fullest open run of this kind, or None if there is none."""
+        for level in reversed(self.buckets.get((ladder, run_type), ())):
+            if level:
+                return next(iter(level))
+        return None
+
+    def __len__(self):
+        return len(self.where)
+
+
+class RunLocks:
+    """One asyncio.Lock per runner ID, made by new_lock on first use and dropped when the run ends."""
+
+    def __init__(self, new_lock=asyncio.Lock):
+        self.locks: dict[int, asyncio.Lock] = {}
+        self.new_lock = new_lock
+
+    def __call__(self, runner_id: int) -> asyncio.Lock:
+        lock = self.locks.get(runner_id)
+        if lock is None:
+            lock = self.locks[runner_id] = self.new_lock()
+        return lock
+
+    def move(self, old_runner_id: int, new_runner_id: int):
+        lock = self.locks.pop(old_runner_id, None)
+        if lock is not None:
+            self.locks[new_runner_id] = lock
+
+    def discard(self, runner_id: int):
+        self.locks.pop(runner_id, None)
+
+
+class RunManager:
+    """Live runs, indexed by runner ID and by player ID.
+
+    Creating, ending and transferring a run change which runner ID it is filed under, so
+    they take registry_lock and then the run's own lock. Joins, leaves and renames take only
+    the run's lock, so they never wait on other runs. players is the one-run-per-player
+    index: the check that a player is free and the claim on them happen with no await in
+    between, so two runs can't both take the same player. A change that had to wait for a
+    run's lock checks the run is still filed under that runner ID before touching it.
+
+    A full run keeps a FIFO waitlist of up to MAX_WAITLIST players, and a player waits on
+    at most one. Seats that open up, in a new run or when someone leaves or is kicked, go
+    to the run's waitlist first and then to the matchmaking queue, in the same step.
+    on_seated(run, player_ids) is then called, before the lock is released, for the players
+    seated that way, who have no interaction to be answered through. Taking a seat anywhere drops a player's queue entry
+    and waitlist place.
+    """
+
+    def __init__(self, snapshot_path="active_runs.json"):
+        self.active_runs: dict[int, Run] = {}  # runner ID -> run
+        self.players: dict[int, int] = {}  # runner or attendee ID -> runner ID of the run they're in
+        self.expiry = ExpiryScheduler(self._expire)  # keyed by runner ID, reset by activity
+        self.snapshot = Snapshot(self.dump, snapshot_path)
+        self.board = None  # RunBoard, set once the bot exists
+        self.fragments = None  # runlist.RunFragments, set once the bot exists
+        self.open = OpenRuns()
+        self.queue = MatchQueue()
+        self.waitlists: dict[int, dict[int, None]] = {}  # runner ID -> player IDs in order, only for runs with any
+        self.waitlisted: dict[int, int] = {}  # player ID -> runner ID of the run they wait for
+        self.on_seated = None
+        self.registry_lock = asyncio.Lock()
+        self.locks = RunLocks()
+
+    def changed(self, run: Run | None = None):
+        self.snapshot.changed()
+        if run and self.fragments:
+            self.fragments.discard(run.runner_id)
+        if run and self.board:
+            self.board.changed(run.get_realm())
+
+    def dump(self) -> dict:
+        now = time.time()
+        return {"format": SNAPSHOT_FORMAT, "runs": [{
+            **run.to_dict(),
+            "waitlist": list(self.waitlists.get(runner_id, ())),
+            "expires_at": now + (self.expiry.remaining(runner_id) or 0),
+        } for runner_id, run in self.active_runs.items()]}
+
+    def restore(self) -> int:
+        """Reloads the runs saved by the last snapshot, dropping any that expired while the bot was down."""
+        data = self.snapshot.load()
+        if not data or data.get("format") != SNAPSHOT_FORMAT:
+            return 0
+        now = time.time()
+        for saved in data["runs"]:
+            if saved["expires_at"] <= now:
+                continue
+            run = Run.from_dict(saved)
+            self.active_runs[run.runner_id] = run
+            for member_id in run.members():
+                self.players[member_id] = run.runner_id
+            for player_id in saved.get("waitlist", ()):
+                self.waitlists.setdefault(run.runner_id, {})[player_id] = None
+                self.waitlisted[player_id] = run.runner_id
+            self.open.update(run)
+            self.expiry.touch(run.runner_id, saved["expires_at"] - now)
+            if self.board:
+                self.board.changed(run.get_realm())
+        return len(self.active_runs)
+
+    async def add_run(self, run: Run):
+        async with self.registry_lock:
+            if run.runner_id in self.players:
+                raise ValueError("Runner already hosting or in a run")
+            self.active_runs[run.runner_id] = run
+            self._claim(run.runner_id, run.runner_id)
+            self.open.update(run)
+            self.expiry.touch(run.runner_id)
+            self._seat_waiting(run)
+        self.changed(run)
+
+    async def _expire(self, runner_id: int):
+        await self.remove_run(runner_id)
+
+    async def remove_run(self, runner_id: int) -> Run | None:
+        async with self.registry_lock, self.locks(runner_id):
+            run = self.active_runs.pop(runner_id, None)
+            if run:
+                for member_id in run.members():
+                    self.players.pop(member_id, None)
+            for player_id in self.waitlists.pop(runner_id, ()):
+                del self.waitlisted[player_id]
+            self.open.discard(runner_id)
+            self.expiry.cancel(runner_id)
+            self.locks.discard(runner_id)
+        self.changed(run)
+        return run
+
+    async def reset_timeout(self, runner_id: int):
+        if runner_id in self.active_runs:
+            self.expiry.touch(runner_id)
+            self.snapshot.changed()
+
+    def get_run(self, player_id: int) -> Run | None:
+        return self.active_runs.get(self.players.get(player_id))
+
+    async def is_player_in_run(self, player_id: int) -> bool:
+        return player_id in self.players
+
+    def is_runner(self, player_id: int) -> bool:
+        return player_id in self.active_runs
+
+    async def add_attendee(self, runner_id: int, attendee_id: int) -> bool:
+        run = self.active_runs.get(runner_id)
+        if run is None:
+            return False
+        async with self.locks(runner_id):
+            if self.active_runs.get(runner_id) is not run or attendee_id in self.players or not run.add(attendee_id):
+                return False
+            self._claim(attendee_id, runner_id)
+            self.open.update(run)
+            self.expiry.touch(runner_id)
+        self.changed(run)
+        return True
+
+    async def join_or_wait(self, runner_id: int, player_id: int) -> int | None:
+        """Seats the player in this run or, if it is full, puts them at the back of its waitlist.
+
+        Returns 0 if they were seated, their place on the waitlist (from 1) if they wait, and
+        None if the run is gone, they're already in a run, or the waitlist is full.
+        """
+        run = self.active_runs.get(runner_id)
+        if run is None:
+            return None
+        async with self.locks(runner_id):
+            if self.active_runs.get(runner_id) is not run or player_id in self.players:
+                return None
+            if run.add(player_id):
+                self._claim(player_id, runner_id)
+                self.open.update(run)
+                self.expiry.touch(runner_id)
+                self.changed(run)
+                return 0
+            waitlist = self.waitlists.get(runner_id, {})
+            if player_id not in waitlist:
+                if not run.is_full or len(waitlist) >= MAX_WAITLIST:
+                    return None
+                self.leave_waitlist(player_id)
+                self.waitlists[runner_id] = waitlist
+                waitlist[player_id] = None
+                self.waitlisted[player_id] = runner_id
+                self.changed(run)
+            return list(waitlist).index(player_id) + 1
+
+    def leave_waitlist(self, player_id: int) -> bool:
+        runner_id = self.waitlisted.pop(player_id, None)
+        if runner_id is None:
+            return False
+        waitlist = self.waitlists[runner_id]
+        del waitlist[player_id]
+        if not waitlist:
+            del self.waitlists[runner_id]
+        self.changed(self.active_runs.get(runner_id))
+        return True
+
+    async def remove_attendee(self, runner_id: int, attendee_id: int) -> bool:
+        run = self.active_runs.get(runner_id)
+        if run is None:
+            return False
+        async with self.locks(runner_id):
+            if self.active_runs.get(runner_id) is not run or not run.discard(attendee_id):
+                return False
+            del self.players[attendee_id]
+            self.open.update(run)
+            self._seat_waiting(run)
+        self.changed(run)
+        return True
+
+    async def change_runner(self, old_runner_id: int, new_runner_id: int) -> bool:
+        async with self.registry_lock, self.locks(old_runner_id):
+            run = self.active_runs.get(old_runner_id)
+            if not run or self.players.get(new_runner_id, old_runner_id) != old_runner_id:
+                return False
+            del self.active_runs[old_runner_id]
+            del self.players[old_runner_id]
+            self.open.discard(old_runner_id)
+            run.discard(new_runner_id)
+            run.runner_id = new_runner_id
+            self.active_runs[new_runner_id] = run
+            for member_id in run.members():
+                self.players[member_id] = new_runner_id
+            waitlist = self.waitlists.pop(old_runner_id, None)
+            if waitlist:
+                self.waitlists[new_runner_id] = waitlist
+                for player_id in waitlist:
+                    self.waitlisted[player_id] = new_runner_id
+            self._claim(new_runner_id, new_runner_id)
+            self._seat_waiting(run)
+            self.open.update(run)
+            self.locks.move(old_runner_id, new_runner_id)
+            self.expiry.cancel(old_runner_id)
+            self.expiry.touch(new_runner_id)
+        if self.fragments:
+            self.fragments.discard(old_runner_id)
+        self.changed(run)
+        return True
+
+    async def quick_join(self, ladder: Ladder, run_type: RunType, player_id: int) -> Run | None:
+        """Seats the player in the fullest open run of this kind; None if there is none or they're already in one."""
+        return await self._join_fullest(ladder, (run_type,), player_id)
+
+    async def enqueue(self, player_id: int, ladder: Ladder, run_types, ttl=None) -> Run | None:
+        """Seats the player in the fullest open run of any of run_types, or queues them for the next seat to open.
+
+        Returns the run if a seat was free, None if they were queued.
+        """
+        if player_id in self.players:
+            raise ValueError("Player already hosting or in a run")
+        run = await self._join_fullest(ladder, run_types, player_id)
+        if run is None and player_id not in self.players:  # no await since the last look at the index
+            self.queue.add(player_id, ladder, run_types, ttl)
+        return run
+
+    async def _join_fullest(self, ladder: Ladder, run_types, player_id: int) -> Run | None:
+        # The seat is claimed by add_attendee under the run's lock. If the run filled up or
+        # ended while waiting for it, the index has moved on and the next best run is tried.
+        while player_id not in self.players:
+            found = [runner_id for runner_id in (self.open.best(ladder, run_type) for run_type in run_types) if runner_id is not None]
+            if not found:
+                return None
+            runner_id = max(found, key=lambda r: len(self.active_runs[r].attendees))
+            run = self.active_runs[runner_id]
+            if await self.add_attendee(runner_id, player_id):
+                return run
+        return None
+
+    def _seat_waiting(self, run: Run):
+        # Called with the run's lock held, right after it gained a free seat
+        seated = []
+        waitlist = self.waitlists.get(run.runner_id, ())
+        while not run.is_full:
+            player_id = next(iter(waitlist), None)
+            if player_id is None:
+                player_id = self.queue.pop(run.ladder, run.type)
+            if player_id is None:
+                break
+            run.add(player_id)
+            self._claim(player_id, run.runner_id)
+            seated.append(player_id)
+        if seated:
+            self.open.update(run)
+            self.expiry.touch(run.runner_id)
+            if self.on_seated:
+                # Still under the lock: whatever on_seated schedules, such as the attendee
+                # writes, runs before a leave or kick waiting for the lock can write
+                self.on_seated(run, seated)
+
+    def _claim(self, player_id: int, runner_id: int):
+        # The player was just seated in or given this run; nothing else may still hold them
+        self.players[player_id] = runner_id
+        self.queue.cancel(player_id)
+        self.leave_waitlist(player_id)
+
+    async def increment_run_name(self, runner_id: int) -> str | None:
+        run = self.active_runs.get(runner_id)
+        if run is None:
+            return None
+        async with self.locks(runner_id):
+            if self.active_runs.get(runner_id) is not run:
+                return None
+            run.run_name = next_run_name(run.run_name)
+            self.snapshot.changed()
+            return run.run_name
+
+
+def next_run_name(run_name: str) -> str:
+    """game-7 -> game-8, game-09 -> game-10, game -> game-1."""
+    match = re.findall(r"[0-9]*$", run_name)[0]
+    if match == "":
+        return run_name + "-1"
+    return re.sub(r"[0-9]*$", str(int(match) + 1).zfill(len(match)), run_name, count=1)
+
+
+def mention(member_id: int) -> str:
+    return f"<@{member_id}>"
+
+
+def member_name(guild, member_id: int) -> str | None:
+    """The member's name from the client cache, or None if they aren't cached."""
+    member = guild.get_member(member_id) if guild is not None else None
+    return member.name if member else None
@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+import logging
+import time
+
+log = logging.getLogger("runs.scheduler")
+
+
+class ExpiryScheduler:
+    """Expires runs after a period of inactivity from a single background task.
+
+    Deadlines live in a heap of [deadline, seq, key] entries. Rescheduling a key pushes a new
+    entry and leaves the old one in the heap as stale; it is skipped when popped, and the heap
+    is compacted once stale entries outnumber live ones. touch, cancel and move are O(log n)
+    and never create or cancel tasks.
+    """
+
+    def __init__(self, on_expire, ttl=2 * 60 * 60):
+        self.on_expire = on_expire  # async callable, given the expired key
+        self.ttl = ttl
+        self.heap = []
+        self.entries = {}  # key -> its live heap entry
+        self.seq = 0
+        self.wake = asyncio.Event()
+        self.task = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def touch(self, key, ttl=None):
+        """Schedules key to expire ttl seconds from now, replacing any earlier deadline."""
+        deadline = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self.seq += 1
+        entry = [deadline, self.seq, key]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.wake.set()
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [entry for entry in self.heap if self.entries.get(entry[2]) is entry]
+            heapq.heapify(self.heap)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def cancel(self, key):
+        self.entries.pop(key, None)
+
+    def move(self, old_key, new_key):
+        """Hands old_key's deadline to new_key, e.g. when a run changes runner."""
+        entry = self.entries.pop(old_key, None)
+        if entry is not None:
+            self.touch(new_key, entry[0] - time.monotonic())
+
+    def remaining(self, key) -> float | None:
+        entry = self.entries.get(key)
+        return entry[0] - time.monotonic() if entry else None
+
+    def upcoming(self, limit=10) -> list[tuple[object, float]]:
+        """The next limit keys to expire, with seconds left until each one does."""
+        now = time.monotonic()
+        return [(entry[2], entry[0] - now) for entry in heapq.nsmallest(limit, self.entries.values())]
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now:
+                entry = heapq.heappop(self.heap)
+                key = entry[2]
+                if self.entries.get(key) is not entry:
+                    continue
+                del self.entries[key]
+                try:
+                    await self.on_expire(key)
+                except Exception:
+                    log.exception("expiry callback failed", extra={"key": key})
+                now = time.monotonic()
+            while self.heap and self.entries.get(self.heap[0][2]) is not self.heap[0]:
+                heapq.heappop(self.heap)
+            self.wake.clear()
+            timeout = self.heap[0][0] - now if self.heap else None
+            try:
+                async with asyncio.timeout(timeout):
+                    await self.wake.wait()
+            except TimeoutError:
+                pass
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
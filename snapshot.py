@@ -0,0 +1,58 @@
+import asyncio
+import json
+import logging
+import os
+
+log = logging.getLogger("runs.snapshot")
+
+
+class Snapshot:
+    """Live run state mirrored to a small JSON file so a restart doesn't drop any runs.
+
+    dump() builds the state; changed() schedules a save interval seconds later, so a burst
+    of joins costs one write. The file is written off the event loop and swapped in with
+    os.replace, so a crash mid-write leaves the previous snapshot intact.
+    """
+
+    def __init__(self, dump, path="active_runs.json", interval=1.0):
+        self.dump = dump
+        self.path = path
+        self.interval = interval
+        self.task = None
+        self.write_lock = asyncio.Lock()
+
+    def changed(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.interval)
+        self.task = None  # changes from here on schedule another save
+        data = self._encode()
+        async with self.write_lock:
+            await asyncio.to_thread(self._write, data)
+
+    def _encode(self) -> bytes:
+        return json.dumps(self.dump(), separators=(",", ":")).encode()
+
+    def _write(self, data: bytes):
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def save(self):
+        """Writes the current state right away, e.g. on shutdown."""
+        self._write(self._encode())
+
+    def load(self) -> dict | None:
+        try:
+            with open(self.path, "rb") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning("ignoring unreadable snapshot", extra={"path": self.path, "error": str(e)})
+            return None